@@ -2,10 +2,11 @@
     Notebook for streaming data from a microphone in realtime
 
     audio is captured using pyaudio
-    then converted from binary data to ints using struct
+    then viewed as 16-bit ints using np.frombuffer (no copy)
     then displayed using matplotlib
 
-    scipy.fftpack computes the FFT
+    numpy computes the FFT, and YAMNet classifies the stream on a
+    background thread, running the model once per patch hop
 
     if you don't have pyaudio, then run
 
@@ -17,14 +18,14 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import pyaudio
-from pyqtgraph.Qt import QtGui, QtCore
-import pyqtgraph as pg
-import struct
-from scipy.fftpack import fft
+import queue
 import sys
+import threading
 import time
 
 import inference
+import metrics
+import class_map
 
 class AudioStream(object):
     def __init__(self):
@@ -36,6 +37,21 @@ class AudioStream(object):
         self.RATE = 44100
         self.pause = False
 
+        # streaming classifier, fed from the audio loop through a queue and
+        # run on its own thread so that the model never stalls the display.
+        # The queue holds at most MAX_CHUNKS (about 1.5 s of audio); if the
+        # classifier falls that far behind, the stale chunks are dropped
+        self.MAX_CHUNKS = 32
+        self.classes = class_map.class_names('yamnet_class_map.csv')
+        self.classifier = inference.StreamingClassifier(
+            sr=self.RATE, channels=self.CHANNELS)
+        self.chunks = queue.Queue(maxsize=self.MAX_CHUNKS)
+        self.dropped_chunks = 0
+        self.scores = None
+        self.classifier_thread = threading.Thread(target=self.classify_chunks)
+        self.classifier_thread.daemon = True
+        self.classifier_thread.start()
+
         # stream object
         self.p = pyaudio.PyAudio()
         self.stream = self.p.open(
@@ -53,29 +69,33 @@ class AudioStream(object):
     def init_plots(self):
 
         # x variables for plotting
-        x = np.arange(0, 2 * self.CHUNK, 2)
-        xf = np.linspace(0, self.RATE, self.CHUNK)
+        x = np.arange(self.CHUNK)
+        xf = np.fft.rfftfreq(self.CHUNK, 1.0 / self.RATE)
 
         # create matplotlib figure and axes
         self.fig, (ax1, ax2) = plt.subplots(2, figsize=(15, 7))
         self.fig.canvas.mpl_connect('button_press_event', self.onClick)
 
         # create a line object with random data
-        self.line, = ax1.plot(x, np.random.rand(self.CHUNK), '-', lw=2)
+        self.line, = ax1.plot(x, np.zeros(self.CHUNK), '-', lw=2)
 
         # create semilogx line for spectrum
         self.line_fft, = ax2.semilogx(
-            xf, np.random.rand(self.CHUNK), '-', lw=2)
+            xf, np.zeros(len(xf)), '-', lw=2)
+
+        # top classes of the latest YAMNet scores
+        self.text_classes = ax2.text(
+            0.01, 0.95, '', transform=ax2.transAxes, va='top')
 
         # format waveform axes
         ax1.set_title('AUDIO WAVEFORM')
         ax1.set_xlabel('samples')
         ax1.set_ylabel('volume')
-        ax1.set_ylim(0, 300)
-        ax1.set_xlim(0, 2 * self.CHUNK)
+        ax1.set_ylim(-32768, 32767)
+        ax1.set_xlim(0, self.CHUNK)
         plt.setp(
-            ax1, yticks=[0, 128, 255],
-            xticks=[0, self.CHUNK, 2 * self.CHUNK],
+            ax1, yticks=[-32768, 0, 32767],
+            xticks=[0, self.CHUNK // 2, self.CHUNK],
         )
         plt.setp(ax2, yticks=[0, 1],)
 
@@ -94,23 +114,34 @@ class AudioStream(object):
         start_time = time.time()
 
         while not self.pause:
-            data = self.stream.read(self.CHUNK)
-            data_int = struct.unpack(str(2 * self.CHUNK) + 'B', data)
-            data_np = np.array(data_int, dtype='b')[::2] + 128
-            
-            predictions = inference.main(data_np)
-            print(predictions)
+            with metrics.timer('capture'):
+                data = self.stream.read(self.CHUNK, exception_on_overflow=False)
+            # 16-bit samples, viewed in place
+            data_np = np.frombuffer(data, dtype=np.int16)
+
+            # hand the chunk to the classifier thread, never wait for it
+            self.queue_chunk(data)
 
             self.line.set_ydata(data_np)
 
             # compute FFT and update line
-            yf = fft(data_int)
+            yf = np.fft.rfft(data_np)
             self.line_fft.set_ydata(
-                np.abs(yf[0:self.CHUNK]) / (128 * self.CHUNK))
+                2 * np.abs(yf) / (32768 * self.CHUNK))
+
+            # publish the latest scores together with this FFT frame
+            scores = self.scores
+            if scores is not None:
+                with metrics.timer('ranking'):
+                    top3 = np.argsort(scores)[::-1][:3]
+                self.text_classes.set_text('\n'.join(
+                    '{}: {:.2f}'.format(self.classes[i], scores[i])
+                    for i in top3))
 
             # update figure canvas
-            self.fig.canvas.draw()
-            self.fig.canvas.flush_events()
+            with metrics.timer('render'):
+                self.fig.canvas.draw()
+                self.fig.canvas.flush_events()
             frame_count += 1
 
         else:
@@ -118,8 +149,41 @@ class AudioStream(object):
             print('average frame rate = {:.0f} FPS'.format(self.fr))
             self.exit_app()
 
+    def queue_chunk(self, data):
+        # queues a chunk for the classifier thread. When the queue is full,
+        # every chunk in it is stale: they are dropped and counted, and the
+        # new chunk is marked as following a gap
+        gap = False
+        while True:
+            try:
+                self.chunks.put_nowait((data, gap))
+                return
+            except queue.Full:
+                while True:
+                    try:
+                        self.chunks.get_nowait()
+                    except queue.Empty:
+                        break
+                    self.dropped_chunks += 1
+                    metrics.count('dropped_chunks')
+                gap = True
+
+    def classify_chunks(self):
+        # runs YAMNet whenever the streamed chunks complete a patch
+        while True:
+            chunk, gap = self.chunks.get()
+            if chunk is None:
+                break
+            if gap:
+                # don't splice the audio across the dropped chunks
+                self.classifier.reset()
+            scores = self.classifier.add(chunk)
+            if len(scores):
+                self.scores = scores[-1]
+
     def exit_app(self):
         print('stream closed')
+        self.queue_chunk(None)
         self.p.close(self.stream)
 
     def onClick(self, event):
@@ -127,4 +191,8 @@ class AudioStream(object):
 
 
 if __name__ == '__main__':
+    # with YAMNET_METRICS=1, serve the stage timings on
+    # http://127.0.0.1:9464/metrics
+    if metrics.enabled:
+        metrics.serve()
     AudioStream()
@@ -0,0 +1,405 @@
+"""Classify a large collection of sound files with one model process.
+
+Usage:
+  python batch_inference.py recordings/ --output scores.jsonl
+  python batch_inference.py 'archive/**/*.flac' --output scores.csv --frames
+
+Decoding, resampling and feature extraction run in a pool of worker
+processes which feed log mel spectrograms through a bounded queue to the
+main process, the only one holding the model. The workers compute the
+features with numpy_features, so they never import TensorFlow, and the main
+process frames the spectrograms into patches without copying. Files are
+read in blocks of --block-seconds, so recordings of any length are
+featurized and scored in bounded memory. The queue keeps feature
+extraction ahead of inference without letting it run away with memory, so
+the model is never idle waiting for audio.
+
+Results are appended to a JSONL or CSV file (chosen by extension, or
+--format), all the records of a file at once, and a file counts as done
+only once its last record is complete. Files already done are skipped and
+partial records are cut off, so an interrupted run can simply be
+restarted. A worker that dies (e.g. killed for memory) fails the file it
+was reading and is replaced.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import csv
+import glob
+import io
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+import numpy as np
+import soundfile as sf
+
+import chunks
+import class_map
+import numpy_features
+import params
+import resampling
+
+# The worker processes only need the modules imported above; TensorFlow and
+# the model are imported in the main process alone (see classify_files()).
+
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.ogg')
+
+
+def find_files(inputs):
+  """Expand directories (recursively) and glob patterns into sorted paths."""
+  paths = set()
+  for pattern in inputs:
+    if os.path.isdir(pattern):
+      for (root, _, file_names) in os.walk(pattern):
+        paths.update(os.path.join(root, file_name) for file_name in file_names
+                     if file_name.lower().endswith(AUDIO_EXTENSIONS))
+    else:
+      paths.update(glob.glob(pattern, recursive=True))
+  return sorted(paths)
+
+
+def _patch_frames(patches):
+  """The contiguous spectrogram frames spanned by a stack of patches."""
+  window = patches.shape[1]
+  hop = int(round(params.PATCH_HOP_SECONDS / params.STFT_HOP_SECONDS))
+  return np.concatenate(
+    [patches[0],
+     np.reshape(patches[1:, window - hop:], [-1, patches.shape[2]])])
+
+
+def spectrogram_blocks(path, block_seconds=60.0):
+  """Yield the log mel spectrogram of a sound file in bounded pieces.
+
+  The file is read block_seconds at a time with chunks.iter_chunks() and
+  resampled and featurized incrementally. Each piece spans whole patches:
+  the spectrogram_to_patches() of the pieces are, in order, the patches of
+  the whole file.
+  """
+  info = sf.info(path)
+  resampler = None
+  if info.samplerate != params.SAMPLE_RATE:
+    resampler = resampling.Resampler(info.samplerate, params.SAMPLE_RATE)
+  features = numpy_features.StreamingFeatures(params)
+  remaining = info.frames
+  for windows in chunks.iter_chunks(path, block_seconds, pad=True,
+                                    windows_per_block=1):
+    # Only the last window is padded; cut it back to the end of the file.
+    block = windows[0][:remaining]
+    remaining -= len(block)
+    if block.ndim > 1:
+      block = np.mean(block, axis=1)
+    if resampler is not None:
+      block = resampler.process(block, final=remaining == 0)
+    patches = features.add(block)
+    if len(patches):
+      yield _patch_frames(patches)
+
+
+def _decode_worker(worker, tasks, results, block_seconds):
+  """Featurize paths from tasks into results until a None sentinel arrives.
+
+  Sends ('start', worker, path), then ('part', worker, path, spectrogram)
+  for each piece of the file and ('done', worker, path, duration, error,
+  seconds); finally ('exit', worker).
+  """
+  while True:
+    path = tasks.get()
+    if path is None:
+      break
+    results.put(('start', worker, path))
+    busy_seconds = 0.0
+    duration, error = 0.0, None
+    try:
+      start = time.time()
+      info = sf.info(path)
+      duration = info.frames / info.samplerate
+      pieces = spectrogram_blocks(path, block_seconds)
+      for spectrogram in pieces:
+        busy_seconds += time.time() - start
+        results.put(('part', worker, path, spectrogram))
+        start = time.time()
+      busy_seconds += time.time() - start
+    except Exception as e:  # Report unreadable files and carry on.
+      error = str(e)
+    results.put(('done', worker, path, duration, error, busy_seconds))
+  results.put(('exit', worker))
+
+
+def resume_output(output, output_format):
+  """Return the files already done in an existing output.
+
+  Anything after the last complete file, i.e. a record cut short by an
+  interrupted run or the frame rows of a file whose final clip row is
+  missing, is truncated, so that such a file is simply classified again.
+  Other complete JSONL lines that are not records of a file are skipped
+  and kept.
+  """
+  if not os.path.exists(output):
+    return set()
+  done = set()
+  complete = 0  # Length of the output up to the end of the last done file.
+  offset = 0
+  with open(output, 'rb') as output_file:
+    for line in output_file:
+      offset += len(line)
+      if not line.endswith(b'\n'):
+        break
+      text = line.decode('utf-8', errors='replace')
+      if output_format == 'csv':
+        row = next(csv.reader([text]), [])
+        if offset == len(line):  # The header.
+          complete = offset
+        elif len(row) > 1 and row[1] == 'clip':
+          done.add(row[0])
+          complete = offset
+      else:
+        complete = offset
+        try:
+          done.add(json.loads(text)['file'])
+        except (ValueError, KeyError, TypeError):
+          continue
+  if complete < offset:
+    with open(output, 'r+b') as output_file:
+      output_file.truncate(complete)
+  return done
+
+
+class ResultWriter(object):
+  """Appends per-file results as JSONL records or CSV rows."""
+
+  def __init__(self, output, output_format, class_names, top_k, frames):
+    self.output_format = output_format
+    self.class_names = class_names
+    self.top_k = top_k
+    self.frames = frames
+    is_new = not os.path.exists(output) or os.path.getsize(output) == 0
+    self._file = open(output, 'a', newline='')
+    if output_format == 'csv':
+      self._csv = csv.writer(self._file)
+      if is_new:
+        header = ['file', 'frame', 'start_seconds']
+        for rank in range(1, top_k + 1):
+          header += ['class_{}'.format(rank), 'score_{}'.format(rank)]
+        self._csv.writerow(header)
+
+  def _top_k(self, scores):
+    indexes = np.argsort(scores)[::-1][:self.top_k]
+    return [(self.class_names[i], round(float(scores[i]), 4)) for i in indexes]
+
+  def write(self, path, duration, scores):
+    """Write the results of a file from its (num_frames, num_classes) scores."""
+    prediction = (np.mean(scores, axis=0) if len(scores)
+                  else np.zeros(params.NUM_CLASSES))
+    if self.output_format == 'csv':
+      # The clip row goes last: it marks the file as done (resume_output()).
+      rows = []
+      if self.frames:
+        rows += [(path, i, round(i * params.PATCH_HOP_SECONDS, 2),
+                  self._top_k(frame_scores))
+                 for (i, frame_scores) in enumerate(scores)]
+      rows.append((path, 'clip', 0.0, self._top_k(prediction)))
+      buffer = io.StringIO()
+      writer = csv.writer(buffer)
+      for (file_name, frame, start, top_k) in rows:
+        writer.writerow([file_name, frame, start] +
+                        [value for pair in top_k for value in pair])
+      self._file.write(buffer.getvalue())
+    else:
+      record = {'file': path, 'duration': round(duration, 3),
+                'num_frames': len(scores), 'top_k': self._top_k(prediction)}
+      if self.frames:
+        record['frame_hop_seconds'] = params.PATCH_HOP_SECONDS
+        record['frame_scores'] = np.round(scores, 4).tolist()
+      self._file.write(json.dumps(record) + '\n')
+    self._file.flush()
+
+  def close(self):
+    self._file.close()
+
+
+class StageStats(object):
+  """Accumulates per-stage wall time and throughput of a batch run."""
+
+  def __init__(self):
+    self.start = time.time()
+    self.files = 0
+    self.errors = 0
+    self.audio_seconds = 0.0
+    self.decode_seconds = 0.0
+    self.inference_seconds = 0.0
+    self.wait_seconds = 0.0
+
+  def report(self):
+    elapsed = time.time() - self.start
+    return ('{} files ({} errors), {:.0f} s audio in {:.1f} s: '
+            '{:.1f} files/s, {:.0f}x realtime | features {:.1f} s (workers), '
+            'inference {:.1f} s, model idle {:.1f} s').format(
+              self.files, self.errors, self.audio_seconds, elapsed,
+              self.files / elapsed, self.audio_seconds / elapsed,
+              self.decode_seconds, self.inference_seconds, self.wait_seconds)
+
+
+def classify_files(paths, writer, num_workers, queue_size, batch_clips,
+                   block_seconds=60.0, report_every=100, classifier=None,
+                   poll_seconds=5.0):
+  """Featurize paths in worker processes and classify them in this process.
+
+  Pieces of files are scored batch_clips at a time, or as soon as no new
+  piece arrives for poll_seconds. Then the workers are also checked, and
+  one that died is replaced, failing the file it was reading.
+  """
+  context = multiprocessing.get_context('spawn')
+  tasks = context.Queue()
+  results = context.Queue(maxsize=queue_size)
+  for path in paths:
+    tasks.put(path)
+  for _ in range(num_workers):
+    tasks.put(None)
+  workers = {}
+
+  def start_worker(worker):
+    workers[worker] = context.Process(
+      target=_decode_worker, args=(worker, tasks, results, block_seconds))
+    workers[worker].daemon = True
+    workers[worker].start()
+
+  # Start the workers before TensorFlow is loaded so decoding gets going
+  # while the model is built.
+  for worker in range(num_workers):
+    start_worker(worker)
+  running = set(workers)
+  if classifier is None:
+    import inference
+    classifier = inference.get_classifier()
+
+  stats = StageStats()
+  reading = {}  # The file each worker is reading.
+  files = {}  # Scores so far and the number of pieces waiting, per file.
+  finished = []  # Files read completely, in order, waiting to be written.
+  batch = []  # (path, spectrogram) pieces waiting for the model.
+  while running or batch:
+    message = None
+    if running:
+      wait_start = time.time()
+      try:
+        message = results.get(timeout=poll_seconds)
+      except queue.Empty:
+        pass
+      stats.wait_seconds += time.time() - wait_start
+    if message is None:
+      for worker in sorted(running):
+        if workers[worker].exitcode is None:
+          continue
+        # Died without its exit message; its sentinel is still queued.
+        running.discard(worker)
+        path = reading.pop(worker, None)
+        print('Worker died (exit code {}){}'.format(
+          workers[worker].exitcode,
+          ' reading {}'.format(path) if path else ''), file=sys.stderr)
+        if path is not None:
+          files.pop(path, None)
+          stats.errors += 1
+        replacement = max(workers) + 1
+        start_worker(replacement)
+        running.add(replacement)
+    elif message[0] == 'start':
+      (_, worker, path) = message
+      reading[worker] = path
+      files[path] = {'scores': [], 'pending': 0}
+    elif message[0] == 'part':
+      (_, _, path, spectrogram) = message
+      files[path]['pending'] += 1
+      batch.append((path, spectrogram))
+    elif message[0] == 'done':
+      (_, worker, path, duration, error, decode_seconds) = message
+      reading.pop(worker, None)
+      stats.decode_seconds += decode_seconds
+      if error is not None:
+        files.pop(path)
+        stats.errors += 1
+        print('Skipping {}: {}'.format(path, error), file=sys.stderr)
+      else:
+        files[path]['duration'] = duration
+        finished.append(path)
+    else:
+      running.discard(message[1])
+
+    if batch and (len(batch) >= batch_clips or message is None or
+                  not running):
+      inference_start = time.time()
+      scores = classifier.classify_patches_batch(
+        [numpy_features.spectrogram_to_patches(spectrogram, params)
+         for (_, spectrogram) in batch])
+      stats.inference_seconds += time.time() - inference_start
+      for ((path, _), piece_scores) in zip(batch, scores):
+        if path in files:  # Not failed meanwhile.
+          files[path]['scores'].append(piece_scores)
+          files[path]['pending'] -= 1
+      batch = []
+    while finished and not files[finished[0]]['pending']:
+      path = finished.pop(0)
+      state = files.pop(path)
+      writer.write(path, state['duration'],
+                   np.concatenate(state['scores']) if state['scores'] else
+                   np.zeros((0, params.NUM_CLASSES), dtype=np.float32))
+      stats.files += 1
+      stats.audio_seconds += state['duration']
+      if stats.files % report_every == 0:
+        print(stats.report(), file=sys.stderr)
+  for worker in workers.values():
+    worker.join()
+  return stats
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+    description='Classify sound files with YAMNet.')
+  parser.add_argument('inputs', nargs='+',
+                      help='Sound files, directories or glob patterns.')
+  parser.add_argument('--output', required=True,
+                      help='JSONL or CSV file to append results to.')
+  parser.add_argument('--format', choices=('jsonl', 'csv'),
+                      help='Output format (default: from --output extension).')
+  parser.add_argument('--top-k', type=int, default=5)
+  parser.add_argument('--frames', action='store_true',
+                      help='Also write per-frame scores.')
+  parser.add_argument('--workers', type=int,
+                      default=max(1, multiprocessing.cpu_count() - 1),
+                      help='Number of decode/feature processes.')
+  parser.add_argument('--queue-size', type=int, default=32,
+                      help='Maximum number of featurized blocks waiting for '
+                           'the model.')
+  parser.add_argument('--batch-clips', type=int, default=16,
+                      help='Number of files (or blocks of long files) scored '
+                           'in one batched pass.')
+  parser.add_argument('--block-seconds', type=float, default=60.0,
+                      help='Audio read and featurized at a time per file.')
+  args = parser.parse_args(argv)
+
+  output_format = args.format or (
+    'csv' if args.output.lower().endswith('.csv') else 'jsonl')
+  done = resume_output(args.output, output_format)
+  paths = [path for path in find_files(args.inputs) if path not in done]
+  print('{} files to classify ({} already done)'.format(len(paths), len(done)),
+        file=sys.stderr)
+  if not paths:
+    return
+
+  writer = ResultWriter(args.output, output_format,
+                        class_map.class_names('yamnet_class_map.csv'),
+                        args.top_k, args.frames)
+  try:
+    stats = classify_files(paths, writer, args.workers, args.queue_size,
+                           args.batch_clips, args.block_seconds)
+  finally:
+    writer.close()
+  print(stats.report(), file=sys.stderr)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
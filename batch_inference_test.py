@@ -0,0 +1,116 @@
+"""Tests for the batch classification pipeline, with a stand-in model."""
+
+import json
+import os
+
+import numpy as np
+import soundfile as sf
+import tensorflow as tf
+
+import batch_inference
+from fake_classifier import FakeClassifier
+import numpy_features
+import params
+import resampling
+
+
+class BatchInferenceTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(BatchInferenceTest, self).setUp()
+    np.random.seed(0)
+    self.directory = self.get_temp_dir()
+
+  def write_wav(self, name, seconds, sr, channels=1):
+    path = os.path.join(self.directory, name)
+    waveform = 0.1 * np.random.uniform(
+      -1.0, 1.0, (int(seconds * sr), channels)).astype(np.float32)
+    sf.write(path, waveform, sr, subtype='FLOAT')
+    return path
+
+  def whole_file_patches(self, path):
+    (waveform, sr) = sf.read(path, dtype='float32', always_2d=True)
+    waveform = np.mean(waveform, axis=1)
+    if sr != params.SAMPLE_RATE:
+      waveform = resampling.resample(waveform, sr, params.SAMPLE_RATE)
+    return numpy_features.waveform_to_patches(waveform, params)
+
+  def testSpectrogramBlocksMatchWholeFile(self):
+    path = self.write_wav('long.wav', 7.3, 44100, channels=2)
+    pieces = list(batch_inference.spectrogram_blocks(path, block_seconds=1.0))
+    self.assertGreater(len(pieces), 1)
+    patches = np.concatenate(
+      [numpy_features.spectrogram_to_patches(piece, params)
+       for piece in pieces])
+    expected = self.whole_file_patches(path)
+    self.assertEqual(expected.shape, patches.shape)
+    self.assertAllClose(expected, patches, atol=1e-4)
+
+  def testResumeTruncatesPartialCsvRecord(self):
+    output = os.path.join(self.directory, 'scores.csv')
+    with open(output, 'w') as output_file:
+      output_file.write('file,frame,start_seconds,class_1,score_1\n'
+                        'a.wav,0,0.0,Speech,0.9\n'
+                        'a.wav,clip,0.0,Speech,0.9\n'
+                        'b.wav,0,0.0,Music,0.8\n'  # No clip row: not done.
+                        'b.wav,1,0.48,Mus')
+    self.assertEqual({'a.wav'},
+                     batch_inference.resume_output(output, 'csv'))
+    with open(output) as output_file:
+      self.assertEqual(['file,frame,start_seconds,class_1,score_1',
+                        'a.wav,0,0.0,Speech,0.9',
+                        'a.wav,clip,0.0,Speech,0.9'],
+                       output_file.read().splitlines())
+
+  def testResumeTruncatesPartialJsonlRecord(self):
+    output = os.path.join(self.directory, 'scores.jsonl')
+    record = json.dumps({'file': 'a.wav'}) + '\n'
+    with open(output, 'w') as output_file:
+      output_file.write(record + '{"file": "b.w')
+    self.assertEqual({'a.wav'},
+                     batch_inference.resume_output(output, 'jsonl'))
+    with open(output) as output_file:
+      self.assertEqual(record, output_file.read())
+    self.assertEqual(set(), batch_inference.resume_output(
+      os.path.join(self.directory, 'missing.jsonl'), 'jsonl'))
+
+  def testResumeKeepsMalformedJsonlLines(self):
+    output = os.path.join(self.directory, 'scores.jsonl')
+    lines = (json.dumps({'file': 'a.wav'}) + '\n' + '[]\n{}\n"x"\n' +
+             'not json\n' + json.dumps({'file': 'b.wav'}) + '\n')
+    with open(output, 'w') as output_file:
+      output_file.write(lines + '{"file": "c.w')
+    self.assertEqual({'a.wav', 'b.wav'},
+                     batch_inference.resume_output(output, 'jsonl'))
+    with open(output) as output_file:
+      self.assertEqual(lines, output_file.read())
+
+  def testClassifyFiles(self):
+    paths = [self.write_wav('a.wav', 5.0, 44100, channels=2),
+             self.write_wav('b.wav', 2.0, params.SAMPLE_RATE),
+             os.path.join(self.directory, 'missing.wav')]
+    output = os.path.join(self.directory, 'scores.jsonl')
+    writer = batch_inference.ResultWriter(
+      output, 'jsonl', ['class {}'.format(i) for i in range(
+        params.NUM_CLASSES)], top_k=1, frames=True)
+    stats = batch_inference.classify_files(
+      paths, writer, num_workers=2, queue_size=4, batch_clips=3,
+      block_seconds=1.0, classifier=FakeClassifier(), poll_seconds=0.5)
+    writer.close()
+    self.assertEqual(2, stats.files)
+    self.assertEqual(1, stats.errors)
+    with open(output) as output_file:
+      records = {record['file']: record for record in
+                 map(json.loads, output_file)}
+    self.assertEqual(set(paths[:2]), set(records))
+    for path in paths[:2]:
+      expected = FakeClassifier().classify_patches_batch(
+        [self.whole_file_patches(path)])[0]
+      self.assertAllClose(np.round(expected, 4),
+                          records[path]['frame_scores'], atol=2e-4)
+      self.assertAlmostEqual(sf.info(path).duration,
+                             records[path]['duration'], places=3)
+
+
+if __name__ == '__main__':
+  tf.test.main()
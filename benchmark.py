@@ -0,0 +1,318 @@
+"""Benchmark harness for the YAMNet pipeline stages.
+
+Usage:
+  python benchmark.py --output bench.json
+  python benchmark.py --durations 1 10 --compare bench.json
+
+Times each stage of the pipeline on reproducible synthetic 44.1 kHz clips
+(1 s, 10 s, 10 min and 1 h by default) plus sample.wav:
+
+  resample:     44.1 kHz -> 16 kHz (resampling.resample)
+  log_mel:      features.waveform_to_log_mel_spectrogram
+  patches:      features.spectrogram_to_patches
+  model:        the YAMNet trunk and classifier on the patches
+  end_to_end:   YamnetClassifier.classification on the int16 clip
+
+Clips longer than ONE_SHOT_MAX_SECONDS would not fit in memory one-shot
+(an hour of audio takes several GB of STFT tensors), so they are written to
+a temporary WAV file and timed as one stage instead:
+
+  classify_file: YamnetClassifier.classify_file, which streams the file in
+                 bounded memory
+
+and reports latency percentiles, the realtime factor (seconds of audio per
+second of processing), the model load time and the peak RSS, overall and
+the growth of the peak during each stage. Startup is timed in fresh
+processes: importing inference.py, creating the classifier (from
+yamnet.h5, and from the prebuilt SavedModel if there is one) and the first
+classification. Results are written as JSON so runs can be compared across
+commits; --compare flags stages that got slower than a previous result by
+more than --tolerance.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+import tensorflow as tf
+
+import features as features_lib
+import inference
+import params
+import resampling
+
+INPUT_RATE = 44100
+# Longest clip whose stages are timed one-shot, on the whole clip in memory.
+ONE_SHOT_MAX_SECONDS = 600
+
+
+def _synthetic_blocks(seconds, seed, block_seconds=60):
+  # The clip in blocks; RandomState draws the same noise in any block sizes.
+  random_state = np.random.RandomState(seed)
+  num_samples = int(seconds * INPUT_RATE)
+  block = int(block_seconds * INPUT_RATE)
+  for start in range(0, num_samples, block):
+    t = np.arange(start, min(start + block, num_samples)) / INPUT_RATE
+    waveform = 0.1 * random_state.uniform(-1.0, +1.0, len(t))
+    waveform += 0.5 * np.sin(2 * np.pi * 440 * t) * (np.sin(2 * np.pi * 0.5 * t) > 0)
+    yield (waveform * 32767).astype(np.int16)
+
+
+def synthetic_clip(seconds, seed=51773):
+  """A reproducible int16 clip of tones over noise at the input rate."""
+  return np.concatenate(
+    [np.zeros(0, dtype=np.int16)] + list(_synthetic_blocks(seconds, seed)))
+
+
+def write_synthetic_clip(path, seconds, seed=51773):
+  """Write synthetic_clip(seconds, seed) to a WAV file, block by block."""
+  with sf.SoundFile(path, 'w', samplerate=INPUT_RATE, channels=1,
+                    subtype='PCM_16') as sound_file:
+    for block in _synthetic_blocks(seconds, seed):
+      sound_file.write(block)
+
+
+def peak_rss_mb():
+  """Peak resident set size of this process so far, in MB."""
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # ru_maxrss is in kB on Linux and in bytes on macOS.
+  return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def git_commit():
+  try:
+    return subprocess.check_output(
+      ['git', 'rev-parse', '--short', 'HEAD'],
+      stderr=subprocess.DEVNULL).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def _time(function, repeats):
+  """Call function repeats times, returning its last result and the times."""
+  seconds = []
+  for _ in range(repeats):
+    start = time.perf_counter()
+    result = function()
+    seconds.append(time.perf_counter() - start)
+  return result, seconds
+
+
+def _summary(seconds, audio_seconds, rss_before):
+  """Latency statistics of a stage, and its memory use.
+
+  ru_maxrss only ever grows, so a stage's own footprint shows as
+  peak_rss_growth_mb, how far it raised the process peak above rss_before
+  (the peak_rss_mb() before the stage); 0 when it stayed under an earlier
+  peak. process_peak_rss_mb is the peak of the whole run so far.
+  """
+  milliseconds = 1000 * np.asarray(seconds)
+  process_peak = peak_rss_mb()
+  return {
+      'p50_ms': float(np.percentile(milliseconds, 50)),
+      'p90_ms': float(np.percentile(milliseconds, 90)),
+      'p99_ms': float(np.percentile(milliseconds, 99)),
+      'mean_ms': float(np.mean(milliseconds)),
+      'realtime_factor': (audio_seconds / float(np.median(seconds))
+                          if audio_seconds else None),
+      'peak_rss_growth_mb': process_peak - rss_before,
+      'process_peak_rss_mb': process_peak,
+  }
+
+
+# Run in a fresh interpreter, so that nothing is imported or cached yet.
+_STARTUP_SCRIPT = '''
+import json, sys, time
+import numpy as np
+start = time.perf_counter()
+import inference
+imported = time.perf_counter()
+classifier = inference.create_classifier(sys.argv[1])
+loaded = time.perf_counter()
+classifier.classification(np.zeros(44100, dtype='int16'), 44100)
+classified = time.perf_counter()
+print(json.dumps({'import_seconds': imported - start,
+                  'model_load_seconds': loaded - imported,
+                  'first_classification_seconds': classified - loaded,
+                  'total_seconds': classified - start}))
+'''
+
+
+def startup(weights):
+  """Time a cold start with weights (an HDF5 file or a SavedModel)."""
+  output = subprocess.check_output(
+    [sys.executable, '-c', _STARTUP_SCRIPT, weights],
+    stderr=subprocess.DEVNULL)
+  return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def benchmark_clip(classifier, wav_data, repeats):
+  """Time every pipeline stage on one int16 clip at INPUT_RATE."""
+  audio_seconds = len(wav_data) / INPUT_RATE
+  results = {}
+  rss = peak_rss_mb()
+  waveform, seconds = _time(
+    lambda: resampling.resample(wav_data / 32768.0, INPUT_RATE), repeats)
+  results['resample'] = _summary(seconds, audio_seconds, rss)
+  waveform = tf.constant(waveform, dtype=tf.float32)
+  rss = peak_rss_mb()
+  spectrogram, seconds = _time(
+    lambda: features_lib.waveform_to_log_mel_spectrogram(waveform, params),
+    repeats)
+  results['log_mel'] = _summary(seconds, audio_seconds, rss)
+  rss = peak_rss_mb()
+  patches, seconds = _time(
+    lambda: features_lib.spectrogram_to_patches(spectrogram, params).numpy(),
+    repeats)
+  results['patches'] = _summary(seconds, audio_seconds, rss)
+  rss = peak_rss_mb()
+  _, seconds = _time(lambda: classifier.classify_patches(patches), repeats)
+  results['model'] = _summary(seconds, audio_seconds, rss)
+  results['model']['patches'] = len(patches)
+  rss = peak_rss_mb()
+  _, seconds = _time(
+    lambda: classifier.classification(wav_data, INPUT_RATE), repeats)
+  results['end_to_end'] = _summary(seconds, audio_seconds, rss)
+  return results
+
+
+def benchmark_file(classifier, path, audio_seconds, repeats):
+  """Time the streamed classification of a sound file."""
+  rss = peak_rss_mb()
+  _, seconds = _time(
+    lambda: sum(len(scores) for scores in classifier.classify_file(path)),
+    repeats)
+  return {'classify_file': _summary(seconds, audio_seconds, rss)}
+
+
+def run(durations, repeats, weights):
+  report = {
+      'commit': git_commit(),
+      'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'platform': platform.platform(),
+      'python': platform.python_version(),
+      'tensorflow': tf.__version__,
+      'repeats': repeats,
+  }
+  report['startup'] = {}
+  for model in [weights] + ([inference.SAVED_MODEL]
+                            if os.path.isdir(inference.SAVED_MODEL) else []):
+    report['startup'][model] = startup(model)
+    print_startup(model, report['startup'][model])
+  start = time.perf_counter()
+  classifier = inference.YamnetClassifier(weights)
+  report['model_load_seconds'] = time.perf_counter() - start
+  # Design the filter bank and trace the graphs before anything is timed.
+  benchmark_clip(classifier, synthetic_clip(1), 1)
+
+  clips = [('{:g}s'.format(seconds), seconds) for seconds in durations]
+  wav_data, sr = sf.read('sample.wav', dtype=np.int16)
+  if len(wav_data) and sr == INPUT_RATE:
+    clips.append(('sample.wav', len(wav_data) / INPUT_RATE))
+
+  report['clips'] = {}
+  for (name, seconds) in clips:
+    # Long clips get fewer repeats so a full run stays in minutes.
+    clip_repeats = max(1, min(repeats, int(600 / seconds)))
+    if name == 'sample.wav':
+      report['clips'][name] = benchmark_clip(classifier, wav_data,
+                                             clip_repeats)
+    elif seconds <= ONE_SHOT_MAX_SECONDS:
+      report['clips'][name] = benchmark_clip(
+        classifier, synthetic_clip(seconds), clip_repeats)
+    else:
+      with tempfile.NamedTemporaryFile(suffix='.wav') as clip_file:
+        write_synthetic_clip(clip_file.name, seconds)
+        report['clips'][name] = benchmark_file(
+          classifier, clip_file.name, seconds, clip_repeats)
+    print_clip(name, report['clips'][name])
+  report['peak_rss_mb'] = peak_rss_mb()
+  return report
+
+
+def print_startup(model, result):
+  print('startup from {}: import {:.2f} s, model load {:.2f} s, first '
+        'classification {:.2f} s, total {:.2f} s'.format(
+          model, result['import_seconds'], result['model_load_seconds'],
+          result['first_classification_seconds'], result['total_seconds']))
+
+
+def print_clip(name, stages):
+  print(name)
+  for (stage, result) in stages.items():
+    print('  {:13s} p50 {:10.2f} ms  p90 {:10.2f} ms  {:>10s}  '
+          'peak rss +{:.0f} MB'.format(
+            stage, result['p50_ms'], result['p90_ms'],
+            '{:.0f}x rt'.format(result['realtime_factor']),
+            result['peak_rss_growth_mb']))
+
+
+def compare(report, baseline, tolerance):
+  """Print stage-by-stage ratios to a baseline report; return regressions."""
+  regressions = []
+  print('Compared with {} ({}):'.format(baseline.get('commit'),
+                                        baseline.get('timestamp')))
+  for (name, stages) in report['clips'].items():
+    for (stage, result) in stages.items():
+      try:
+        before = baseline['clips'][name][stage]['p50_ms']
+      except KeyError:
+        continue
+      ratio = result['p50_ms'] / before
+      flag = ''
+      if ratio > 1 + tolerance:
+        regressions.append((name, stage, ratio))
+        flag = '  REGRESSION'
+      print('  {:10s} {:12s} {:6.2f}x{}'.format(name, stage, ratio, flag))
+  for (model, result) in report.get('startup', {}).items():
+    try:
+      before = baseline['startup'][model]['total_seconds']
+    except KeyError:
+      continue
+    ratio = result['total_seconds'] / before
+    flag = ''
+    if ratio > 1 + tolerance:
+      regressions.append((model, 'startup', ratio))
+      flag = '  REGRESSION'
+    print('  {:23s} {:6.2f}x{}'.format('startup ' + model, ratio, flag))
+  return regressions
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+    description='Benchmark the YAMNet pipeline stages.')
+  parser.add_argument('--durations', type=float, nargs='+',
+                      default=[1, 10, 600, 3600],
+                      help='Synthetic clip lengths in seconds.')
+  parser.add_argument('--repeats', type=int, default=10)
+  parser.add_argument('--weights', default='yamnet.h5')
+  parser.add_argument('--output', help='Write the results to this JSON file.')
+  parser.add_argument('--compare', help='A previous JSON result to compare to.')
+  parser.add_argument('--tolerance', type=float, default=0.1,
+                      help='Relative slowdown reported as a regression.')
+  args = parser.parse_args(argv)
+
+  report = run(args.durations, args.repeats, args.weights)
+  print('model load {:.2f} s, peak RSS {:.0f} MB'.format(
+    report['model_load_seconds'], report['peak_rss_mb']))
+  if args.output:
+    with open(args.output, 'w') as output_file:
+      json.dump(report, output_file, indent=2)
+  if args.compare:
+    with open(args.compare) as baseline_file:
+      if compare(report, json.load(baseline_file), args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -2,30 +2,111 @@
 """
 Created on Tue Apr  7 13:27:53 2020
 
+Splits audio into fixed-length, overlapping windows.
+
+chunk() returns all windows of a waveform at once as a read-only strided
+view of it, so no samples are copied however many windows overlap.
+iter_chunks() is the lazy form for files too large for memory: it reads the
+file in overlapping blocks and yields the windows block by block, and
+together they are the same windows that chunk() gives for the whole file.
+
+>>> windows = chunk(waveform, slice_length=4, overlap=3, fs=16000)
+>>> for windows in iter_chunks('long.wav', slice_length=4, overlap=3):
+...     scores = classify(windows)
 """
 
 import numpy as np
-from scipy.io import wavfile
-import sys
-
-def sliceing():
-    fs, signal = wavfile.read('test/cc6ab45b.wav')
-    
-    slice_length = 4 # in seconds
-    overlap = 3 # in seconds
-    strating_point = np.arange(0, len(signal)/fs, 
-                               slice_length-overlap,
-                               dtype=np.int)
-    
-    if slice_length < overlap:
-        sys.exit('Overlap cannot be longer than length of the slice')
-    elif slice_length > len(signal):
-        sys.exit('Slice cannot be longer than signal')
-    
-    
-    for start in strating_point:
-        start_audio = start * fs # Chunk starting index
-        end_audio = (start+slice_length) * fs # Chunk ending index
-        audio_slice = signal[start_audio: end_audio] # Chunk
-    
-    return audio_slice
+import soundfile as sf
+
+
+def _window_samples(slice_length, overlap, fs):
+    # Window and hop length in samples from lengths in seconds
+    if overlap < 0 or overlap >= slice_length:
+        raise ValueError('Overlap must be at least 0 and shorter than the '
+                         'slice, got slice_length={}, overlap={}'.format(
+                             slice_length, overlap))
+    window = int(round(slice_length * fs))
+    hop = window - int(round(overlap * fs))
+    return window, hop
+
+
+def num_chunks(num_samples, window, hop, pad=False):
+    """Number of windows of window samples, hop apart, in num_samples.
+
+    Without padding only complete windows count; with padding the last
+    window may extend past the end, so that every sample is in a window.
+    """
+    if pad:
+        if num_samples == 0:
+            return 0
+        return max(0, -(-(num_samples - window) // hop)) + 1
+    return max(0, (num_samples - window) // hop + 1)
+
+
+def _strided(signal, window, hop, count):
+    # A zero-copy (count, window, ...) view of windows hop samples apart
+    return np.lib.stride_tricks.as_strided(
+        signal, shape=(count, window) + signal.shape[1:],
+        strides=(hop * signal.strides[0],) + signal.strides,
+        writeable=False)
+
+
+def chunk(signal, slice_length, overlap=0.0, fs=1, pad=False):
+    """Split a signal into overlapping windows.
+
+    Args:
+        signal: A (num_samples,) or (num_samples, channels) array.
+        slice_length: Window length in seconds (in samples with fs=1).
+        overlap: Overlap of consecutive windows, in the same unit.
+        fs: Sample rate of the signal.
+        pad: Whether to zero-pad the end of the signal so that its last
+            samples are in a window too. Padding copies the signal; without
+            it the result is a view of the signal.
+
+    Returns:
+        A read-only (num_windows, window_samples, ...) array. Window i
+        starts at sample i * hop, see chunk_starts().
+    """
+    signal = np.asarray(signal)
+    window, hop = _window_samples(slice_length, overlap, fs)
+    count = num_chunks(len(signal), window, hop, pad)
+    if pad:
+        padded_length = max(len(signal), (count - 1) * hop + window)
+        padding = [(0, padded_length - len(signal))] + [(0, 0)] * (signal.ndim - 1)
+        signal = np.pad(signal, padding, mode='constant')
+    return _strided(signal, window, hop, count)
+
+
+def chunk_starts(num_windows, slice_length, overlap=0.0, fs=1):
+    """Start times in seconds (in samples with fs=1) of the windows."""
+    window, hop = _window_samples(slice_length, overlap, fs)
+    return np.arange(num_windows) * hop / fs
+
+
+def iter_chunks(path, slice_length, overlap=0.0, pad=False, windows_per_block=256,
+                dtype='float32'):
+    """Lazily split a sound file into overlapping windows.
+
+    The file is read in blocks of windows_per_block windows, consecutive
+    blocks overlapping by the window overlap, so memory use is independent
+    of the file length.
+
+    Yields:
+        (num_windows, window_samples, ...) arrays of windows, in file order;
+        concatenated they equal chunk() of the whole file. Mono files give
+        (num_windows, window_samples) arrays.
+    """
+    with sf.SoundFile(path) as sound_file:
+        window, hop = _window_samples(slice_length, overlap, sound_file.samplerate)
+        blocksize = window + (windows_per_block - 1) * hop
+        for block in sound_file.blocks(blocksize, overlap=window - hop, dtype=dtype):
+            # Only the last block can be short, and only it needs padding
+            windows = chunk(block, window, window - hop, pad=pad)
+            if len(windows):
+                yield windows
+
+
+def sliceing(path='test/cc6ab45b.wav', slice_length=4, overlap=3):
+    """Compatibility wrapper: all the windows of a 16-bit wav file."""
+    signal, fs = sf.read(path, dtype='int16')
+    return chunk(signal, slice_length, overlap, fs)
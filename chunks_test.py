@@ -0,0 +1,46 @@
+"""Tests for the windowing utilities."""
+
+import os
+
+import numpy as np
+import soundfile as sf
+import tensorflow as tf
+
+import chunks
+
+
+class ChunksTest(tf.test.TestCase):
+
+  def testChunk(self):
+    signal = np.arange(11)
+    windows = chunks.chunk(signal, slice_length=4, overlap=2)
+    self.assertAllEqual([[0, 1, 2, 3], [2, 3, 4, 5], [4, 5, 6, 7],
+                         [6, 7, 8, 9]], windows)
+    self.assertTrue(np.shares_memory(signal, windows))
+    padded = chunks.chunk(signal, slice_length=4, overlap=2, pad=True)
+    self.assertAllEqual([8, 9, 10, 0], padded[-1])
+    self.assertAllEqual([0, 2, 4, 6, 8],
+                        chunks.chunk_starts(len(padded), 4, overlap=2))
+    with self.assertRaises(ValueError):
+      chunks.chunk(signal, slice_length=2, overlap=3)
+
+  def testSeconds(self):
+    signal = np.zeros((10 * 16000, 2))
+    windows = chunks.chunk(signal, slice_length=4, overlap=3, fs=16000)
+    self.assertEqual((7, 4 * 16000, 2), windows.shape)
+
+  def testIterChunksMatchesChunk(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    signal = np.random.uniform(-1.0, +1.0, 2345).astype(np.float32)
+    path = os.path.join(self.get_temp_dir(), 'chunks.wav')
+    sf.write(path, signal, 100, subtype='FLOAT')
+    for pad in (False, True):
+      expected = chunks.chunk(signal, 2.5, overlap=0.7, fs=100, pad=pad)
+      blocks = list(chunks.iter_chunks(path, 2.5, overlap=0.7, pad=pad,
+                                       windows_per_block=3))
+      self.assertGreater(len(blocks), 1)
+      self.assertAllEqual(expected, np.concatenate(blocks))
+
+
+if __name__ == '__main__':
+  tf.test.main()
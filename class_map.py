@@ -0,0 +1,17 @@
+"""Reading the YAMNet class map.
+
+Kept apart from yamnet.py so that programs which only need the class names
+do not have to import TensorFlow.
+"""
+
+import csv
+
+import numpy as np
+
+
+def class_names(class_map_csv):
+  """Read the class name definition file and return a list of strings."""
+  with open(class_map_csv) as csv_file:
+    reader = csv.reader(csv_file)
+    next(reader)   # Skip header
+    return np.array([display_name for (_, _, display_name) in reader])
@@ -0,0 +1,268 @@
+"""Sound event segments from per-frame class scores.
+
+Averaging the frame scores of a clip hides the short events in it, and
+storing every score of every frame takes num_classes floats per frame.
+EventDetector instead turns the (num_frames, num_classes) score matrix into
+a few (class, start, end, peak) segments:
+
+  1. Each class's scores are smoothed with a centered running median of
+     median_frames frames, which removes single-frame spikes and dropouts.
+  2. A class turns on when its smoothed score reaches its on_threshold and
+     off when it falls below its off_threshold. With off_threshold below
+     on_threshold (hysteresis), scores that hover around one threshold do
+     not split an event into many.
+  3. Each on period is an event, from the start of its first frame to the
+     end of its last, with the highest raw score in it as its peak. Events
+     shorter than min_frames frames are dropped.
+
+All steps are vectorized over the frames and the classes. The detector keeps
+its state between add() calls, so scores can be fed as they are produced
+(e.g. by inference.StreamingClassifier) and complete events come out with a
+delay of median_frames // 2 frames; feeding the scores in any number of
+pieces gives the same events as detect() over the whole matrix.
+
+  detector = EventDetector(on_threshold=0.5, off_threshold=0.3)
+  for scores in classifier.classify_file('long.wav'):
+    events = detector.add(scores)
+  events = detector.flush()
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import sys
+
+import numpy as np
+
+import class_map
+import params
+
+# One row per event; class is the class index.
+EVENT_DTYPE = np.dtype([('class', np.int32), ('start', np.float64),
+                        ('end', np.float64), ('peak', np.float32)])
+
+
+def class_thresholds(default, per_class=None,
+                     class_map_csv='yamnet_class_map.csv'):
+  """A (num_classes,) threshold array from a default and named overrides.
+
+  Args:
+    default: Threshold of the classes not in per_class; np.inf disables
+      them.
+    per_class: Dict from class display names (or indexes) to thresholds.
+  """
+  thresholds = np.full(params.NUM_CLASSES, default, dtype=np.float32)
+  if per_class:
+    names = list(class_map.class_names(class_map_csv))
+    for (name, threshold) in per_class.items():
+      thresholds[names.index(name) if isinstance(name, str) else name] = (
+        threshold)
+  return thresholds
+
+
+def _running_median(frames, width):
+  # Median of each run of width consecutive frames, i.e. for the frames that
+  # have width // 2 neighbours on both sides.
+  count = len(frames) - width + 1
+  if width == 1 or count <= 0:
+    return frames[:max(count, 0)]
+  windows = np.lib.stride_tricks.as_strided(
+    frames, shape=(count, width) + frames.shape[1:],
+    strides=(frames.strides[0],) + frames.strides, writeable=False)
+  return np.median(windows, axis=1)
+
+
+class EventDetector(object):
+  """Incremental thresholding of frame scores into event segments.
+
+  Args:
+    on_threshold: Smoothed score at which a class turns on, a scalar or a
+      (num_classes,) array (see class_thresholds()).
+    off_threshold: Smoothed score below which it turns off again; by default
+      half of on_threshold.
+    median_frames: Odd width of the running median, 1 for no smoothing.
+    min_frames: Shortest event kept, in frames.
+    start_time: Time of the first frame, e.g. a time.time() stamp or 0.0
+      for times into a file.
+    hop_seconds: Time between frames.
+    window_seconds: Duration of the audio behind each frame.
+  """
+
+  def __init__(self, on_threshold=0.5, off_threshold=None, median_frames=3,
+               min_frames=1, start_time=0.0,
+               hop_seconds=params.PATCH_HOP_SECONDS,
+               window_seconds=params.PATCH_WINDOW_SECONDS):
+    if median_frames < 1 or median_frames % 2 == 0:
+      raise ValueError('median_frames must be odd, got {}'.format(
+        median_frames))
+    self.on_threshold = np.broadcast_to(
+      np.asarray(on_threshold, dtype=np.float32), [params.NUM_CLASSES])
+    if off_threshold is None:
+      off_threshold = self.on_threshold / 2
+    self.off_threshold = np.broadcast_to(
+      np.asarray(off_threshold, dtype=np.float32), [params.NUM_CLASSES])
+    if np.any(self.off_threshold > self.on_threshold):
+      raise ValueError('off_threshold must not exceed on_threshold.')
+    self.median_frames = median_frames
+    self.min_frames = min_frames
+    self.start_time = start_time
+    self.hop_seconds = hop_seconds
+    self.window_seconds = window_seconds
+    self.reset()
+
+  def reset(self):
+    """Start a new stream, dropping any open events."""
+    self._context = None  # Raw frames still needed by the running median.
+    self._num_frames = 0  # Smoothed frames done so far.
+    self._active = np.zeros(params.NUM_CLASSES, dtype=bool)
+    self._open_start = np.zeros(params.NUM_CLASSES, dtype=np.int64)
+    self._open_peak = np.full(params.NUM_CLASSES, -np.inf, dtype=np.float32)
+
+  def add(self, scores):
+    """Feed the (num_frames, num_classes) scores of the next frames.
+
+    Returns:
+      The events that ended within the frames smoothed so far, as an
+      EVENT_DTYPE array sorted by start and then class.
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    if self._context is None:
+      if not len(scores):
+        return np.zeros(0, dtype=EVENT_DTYPE)
+      # Pad the start by repeating the first frame.
+      self._context = np.repeat(scores[:1], self.median_frames // 2, axis=0)
+    return self._process(np.concatenate([self._context, scores]))
+
+  def flush(self):
+    """End the stream: return the remaining events, including open ones."""
+    if self._context is None:
+      events = np.zeros(0, dtype=EVENT_DTYPE)
+    else:
+      # Pad the end by repeating the last frame.
+      frames = np.concatenate(
+        [self._context,
+         np.repeat(self._context[-1:], self.median_frames // 2, axis=0)])
+      events = self._process(frames, final=True)
+    self.reset()
+    return events
+
+  def _process(self, frames, final=False):
+    smoothed = _running_median(frames, self.median_frames)
+    half = self.median_frames // 2
+    raw = frames[half:half + len(smoothed)]
+    self._context = frames[len(smoothed):]
+
+    # Hysteresis: +1 where a class turns on, -1 where it turns off, else 0,
+    # then every frame takes the state of the last nonzero marker before it.
+    marker = ((smoothed >= self.on_threshold).astype(np.int8) -
+              (smoothed < self.off_threshold).astype(np.int8))
+    marker = np.concatenate(
+      [np.where(self._active, 1, -1).astype(np.int8)[np.newaxis], marker])
+    last = np.where(marker != 0, np.arange(len(marker))[:, np.newaxis], 0)
+    np.maximum.accumulate(last, axis=0, out=last)
+    active = np.take_along_axis(marker, last, axis=0)[1:] > 0
+
+    # Class-major rows: closed, the previous state, the new frames, closed.
+    # Segments of consecutive on frames start at rises and end at falls.
+    num_classes = active.shape[1]
+    states = np.concatenate(
+      [np.zeros((num_classes, 1), dtype=bool), self._active[:, np.newaxis],
+       active.T, np.zeros((num_classes, 1), dtype=bool)], axis=1)
+    steps = np.diff(states.astype(np.int8), axis=1)
+    classes, rises = np.nonzero(steps == 1)
+    _, falls = np.nonzero(steps == -1)
+    rises += 1  # Column of the first on frame.
+    falls += 1  # Column after the last on frame.
+
+    # The peak of each segment, from the running peak of an event that was
+    # already open and the raw scores of the new frames.
+    peaks = np.concatenate(
+      [np.full((num_classes, 1), -np.inf, dtype=np.float32),
+       self._open_peak[:, np.newaxis], raw.T,
+       np.full((num_classes, 1), -np.inf, dtype=np.float32)], axis=1)
+    offsets = classes * states.shape[1]
+    bounds = np.stack([offsets + rises, offsets + falls], axis=1).ravel()
+    peak = np.zeros(0, dtype=np.float32)
+    if len(bounds):
+      peak = np.maximum.reduceat(peaks.ravel(), bounds)[::2]
+
+    # Column 1 is the previous state and column 2 the first new frame.
+    start = np.where(rises == 1, self._open_start[classes],
+                     self._num_frames + rises - 2)
+    end = self._num_frames + falls - 2
+    still_open = falls == states.shape[1] - 1
+    if not final:
+      self._open_start[classes[still_open]] = start[still_open]
+      self._open_peak[classes[still_open]] = peak[still_open]
+      closed = ~still_open
+      classes, start, end, peak = (classes[closed], start[closed],
+                                   end[closed], peak[closed])
+    if len(active):
+      self._active = active[-1].copy()
+    self._open_peak[~self._active] = -np.inf
+    self._num_frames += len(active)
+
+    keep = end - start >= self.min_frames
+    events = np.zeros(np.count_nonzero(keep), dtype=EVENT_DTYPE)
+    events['class'] = classes[keep]
+    events['start'] = self.start_time + self.hop_seconds * start[keep]
+    events['end'] = (self.start_time + self.hop_seconds * (end[keep] - 1) +
+                     self.window_seconds)
+    events['peak'] = peak[keep]
+    return np.sort(events, order=['start', 'class'])
+
+
+def detect(scores, **kwargs):
+  """The events in a whole (num_frames, num_classes) score matrix.
+
+  Takes the arguments of EventDetector. The events are sorted by start and
+  then class.
+  """
+  detector = EventDetector(**kwargs)
+  return np.sort(np.concatenate([detector.add(scores), detector.flush()]),
+                 order=['start', 'class'])
+
+
+def detect_file(path, classifier=None, block_seconds=10.0, **kwargs):
+  """The events in a sound file of any length, streamed in bounded memory.
+
+  Takes the arguments of EventDetector; the event times are seconds into
+  the file by default.
+  """
+  if classifier is None:
+    import inference
+    classifier = inference.get_classifier()
+  detector = EventDetector(**kwargs)
+  events = [detector.add(scores)
+            for scores in classifier.classify_file(path, block_seconds)]
+  return np.sort(np.concatenate(events + [detector.flush()]),
+                 order=['start', 'class'])
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+    description='List the sound events in sound files.')
+  parser.add_argument('files', nargs='+')
+  parser.add_argument('--on', type=float, default=0.5,
+                      help='Score at which a class turns on.')
+  parser.add_argument('--off', type=float,
+                      help='Score below which it turns off (default: half '
+                           'of --on).')
+  parser.add_argument('--median-frames', type=int, default=3)
+  parser.add_argument('--min-frames', type=int, default=1)
+  args = parser.parse_args(argv)
+
+  names = class_map.class_names('yamnet_class_map.csv')
+  for path in args.files:
+    events = detect_file(path, on_threshold=args.on,
+                         off_threshold=args.off,
+                         median_frames=args.median_frames,
+                         min_frames=args.min_frames)
+    print(path + ':')
+    for event in events:
+      print('  {:8.2f} {:8.2f}  {:.3f}  {}'.format(
+        event['start'], event['end'], event['peak'], names[event['class']]))
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
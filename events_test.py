@@ -0,0 +1,93 @@
+"""Tests for the event detector."""
+
+import numpy as np
+import tensorflow as tf
+
+import events
+import params
+
+
+def reference_events(scores, on, off, median_frames, min_frames):
+  """A frame-by-frame, class-by-class implementation of the detector."""
+  half = median_frames // 2
+  padded = np.concatenate([np.repeat(scores[:1], half, axis=0), scores,
+                           np.repeat(scores[-1:], half, axis=0)])
+  found = []
+  for c in range(scores.shape[1]):
+    active, start = False, 0
+    for i in range(len(scores) + 1):
+      if i < len(scores):
+        smoothed = np.median(padded[i:i + median_frames, c])
+        now = smoothed >= on or (active and smoothed >= off)
+      else:
+        now = False
+      if now and not active:
+        start = i
+      elif active and not now and i - start >= min_frames:
+        found.append((c, start, i, scores[start:i, c].max()))
+      active = now
+  return sorted(found, key=lambda event: (event[1], event[0]))
+
+
+class EventDetectorTest(tf.test.TestCase):
+
+  def assertEventsEqual(self, expected, actual, hop=params.PATCH_HOP_SECONDS,
+                        window=params.PATCH_WINDOW_SECONDS):
+    self.assertEqual([(c, start, end) for (c, start, end, _) in expected],
+                     [(int(event['class']), int(round(event['start'] / hop)),
+                       int(round((event['end'] - window) / hop)) + 1)
+                      for event in actual])
+    self.assertAllClose([peak for (_, _, _, peak) in expected],
+                        actual['peak'])
+
+  def testMatchesReference(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    # Sparse bursts of activity on a few classes.
+    scores = np.random.uniform(0.0, 0.3, (200, params.NUM_CLASSES))
+    for _ in range(40):
+      c = np.random.randint(5)
+      start = np.random.randint(200)
+      scores[start:start + np.random.randint(1, 15), c] += np.random.uniform(
+        0.1, 0.7)
+    for (median_frames, min_frames) in [(1, 1), (3, 1), (5, 2)]:
+      expected = reference_events(scores, 0.5, 0.25, median_frames,
+                                  min_frames)
+      detected = events.detect(scores, on_threshold=0.5, off_threshold=0.25,
+                               median_frames=median_frames,
+                               min_frames=min_frames)
+      self.assertNotEmpty(expected)
+      self.assertEventsEqual(expected, detected)
+
+      # Fed in pieces of any size, including empty ones.
+      detector = events.EventDetector(
+        on_threshold=0.5, off_threshold=0.25, median_frames=median_frames,
+        min_frames=min_frames)
+      edges = np.sort(np.random.randint(0, 200, size=30))
+      streamed = np.concatenate(
+        [detector.add(piece) for piece in np.split(scores, edges)] +
+        [detector.flush()])
+      self.assertEventsEqual(
+        expected, np.sort(streamed, order=['start', 'class']))
+
+  def testHysteresisAndThresholds(self):
+    scores = np.zeros((8, params.NUM_CLASSES), dtype=np.float32)
+    scores[:, 0] = [0.0, 0.6, 0.4, 0.6, 0.4, 0.1, 0.0, 0.0]
+    scores[:, 1] = [0.0, 0.0, 0.6, 0.6, 0.0, 0.0, 0.7, 0.0]
+    on = events.class_thresholds(0.5, {1: 0.65})
+    detected = events.detect(scores, on_threshold=on, off_threshold=0.3,
+                             median_frames=1, start_time=10.0, hop_seconds=1.0,
+                             window_seconds=1.0)
+    self.assertAllEqual([0, 1], detected['class'])
+    self.assertAllClose([11.0, 16.0], detected['start'])
+    self.assertAllClose([15.0, 17.0], detected['end'])
+    self.assertAllClose([0.6, 0.7], detected['peak'])
+
+  def testBadArguments(self):
+    with self.assertRaises(ValueError):
+      events.EventDetector(median_frames=4)
+    with self.assertRaises(ValueError):
+      events.EventDetector(on_threshold=0.2, off_threshold=0.3)
+
+
+if __name__ == '__main__':
+  tf.test.main()
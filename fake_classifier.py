@@ -0,0 +1,27 @@
+"""A stand-in for the YAMNet classifiers, shared by the tests."""
+
+import numpy as np
+
+import params
+
+
+class FakeClassifier(object):
+  """Scores every class of a patch with the patch mean.
+
+  Records the number of patches per clip of each batched call in `calls`.
+  """
+
+  def __init__(self):
+    self.calls = []
+
+  def classify_patches(self, patches):
+    return np.repeat(np.mean(patches, axis=(1, 2))[:, np.newaxis],
+                     params.NUM_CLASSES, axis=1).astype(np.float32)
+
+  def embed_patches(self, patches):
+    scores = self.classify_patches(patches)
+    return scores, scores[:, :params.EMBEDDING_SIZE]
+
+  def classify_patches_batch(self, patches_list):
+    self.calls.append([len(patches) for patches in patches_list])
+    return [self.classify_patches(patches) for patches in patches_list]
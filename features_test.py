@@ -0,0 +1,58 @@
+"""Tests for the YAMNet feature computation."""
+
+import numpy as np
+import tensorflow as tf
+
+import features
+import numpy_features
+import params
+
+
+class StreamingFeaturesTest(tf.test.TestCase):
+
+  def testMatchesOneShot(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    waveform = np.random.uniform(
+      -1.0, +1.0, int(5 * params.SAMPLE_RATE)).astype(np.float32)
+    expected = features.spectrogram_to_patches(
+      features.waveform_to_log_mel_spectrogram(tf.constant(waveform), params),
+      params).numpy()
+
+    streaming = numpy_features.StreamingFeatures(params)
+    block_edges = np.cumsum(np.random.randint(1, 4000, size=100))
+    blocks = np.split(waveform, block_edges[block_edges < len(waveform)])
+    patches = np.concatenate([streaming.add(block) for block in blocks])
+
+    self.assertEqual(expected.shape, patches.shape)
+    self.assertAllClose(expected, patches, atol=1e-4)
+
+
+class NumpyFeaturesTest(tf.test.TestCase):
+
+  def testMelWeightMatrix(self):
+    self.assertAllClose(
+      tf.signal.linear_to_mel_weight_matrix(
+        num_mel_bins=params.MEL_BANDS, num_spectrogram_bins=257,
+        sample_rate=params.SAMPLE_RATE, lower_edge_hertz=params.MEL_MIN_HZ,
+        upper_edge_hertz=params.MEL_MAX_HZ).numpy(),
+      numpy_features.mel_weight_matrix(
+        params.MEL_BANDS, 257, params.SAMPLE_RATE, params.MEL_MIN_HZ,
+        params.MEL_MAX_HZ), atol=1e-5)
+
+  def testMatchesTensorFlow(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    waveform = np.random.uniform(
+      -1.0, +1.0, int(3.3 * params.SAMPLE_RATE)).astype(np.float32)
+    expected = features.spectrogram_to_patches(
+      features.waveform_to_log_mel_spectrogram(tf.constant(waveform), params),
+      params).numpy()
+    patches = numpy_features.waveform_to_patches(waveform, params)
+    self.assertEqual(expected.shape, patches.shape)
+    self.assertAllClose(expected, patches, atol=1e-4)
+    self.assertEqual(
+      (0, params.PATCH_FRAMES, params.PATCH_BANDS),
+      numpy_features.waveform_to_patches(np.zeros(1000), params).shape)
+
+
+if __name__ == '__main__':
+  tf.test.main()
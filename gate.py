@@ -0,0 +1,163 @@
+"""Energy and spectral-flux gate in front of the model.
+
+Microphones spend most of the day recording silence or a steady background,
+and running the Mobilenet trunk on those patches only reproduces the scores
+it gave the last time. SilenceGate looks at the log mel patches, which are
+computed anyway, and decides per patch whether the model needs to run:
+
+  quiet:  the loudest log mel value of the patch is below energy_threshold.
+          The patch gets the (cached) scores of digital silence.
+  steady: the mean log mel spectrum of the patch differs from that of the
+          last patch the model ran on by less than flux_threshold on
+          average. The patch gets the scores of that patch.
+
+Anything else runs through the model and becomes the new reference. To keep
+a slowly changing background from being frozen forever, the model runs at
+least once every max_skips steady patches.
+
+The gate keeps state between calls, so it is meant for one continuous
+stream (e.g. a StreamingClassifier); reset() it between unrelated streams.
+The state only advances once the model call of apply() has returned, so a
+call that raises leaves the gate as it was.
+"""
+
+from __future__ import division
+
+import threading
+
+import numpy as np
+
+import metrics
+import params
+
+# Decisions.
+RUN = 0
+QUIET = 1
+STEADY = 2
+
+
+class SilenceGate(object):
+  """Skips model inference on quiet or unchanged patches.
+
+  Args:
+    energy_threshold: Log mel level (natural log of mel magnitude plus
+      LOG_OFFSET) below which a patch counts as quiet. Digital silence is
+      log(LOG_OFFSET) = -6.9; the default of -3.0 passes background noise
+      above roughly -70 dBFS.
+    flux_threshold: Mean absolute difference of log mel spectra below which a
+      patch counts as unchanged.
+    max_skips: Most consecutive steady patches between two model runs.
+  """
+
+  def __init__(self, energy_threshold=-3.0, flux_threshold=0.1, max_skips=20):
+    self.energy_threshold = energy_threshold
+    self.flux_threshold = flux_threshold
+    self.max_skips = max_skips
+    self._lock = threading.Lock()
+    self._silence = None
+    self.counts = np.zeros(3, dtype=np.int64)
+    self.reset()
+
+  def reset(self):
+    """Forget the reference patch, e.g. at the start of a new stream."""
+    self._reference_spectrum = None
+    self._reference = None
+    self._skips = 0
+
+  @staticmethod
+  def measure(patches):
+    """Return the (level, spectrum) of each patch.
+
+    level is the loudest log mel value of a patch and spectrum its mean log
+    mel spectrum over time.
+    """
+    patches = np.asarray(patches)
+    return patches.max(axis=(1, 2)), patches.mean(axis=1)
+
+  def decide(self, patches):
+    """Return the RUN, QUIET or STEADY decision for each patch.
+
+    Does not change the gate state.
+    """
+    return self._decide(patches)[0]
+
+  def _decide(self, patches):
+    # The decisions, and the reference spectrum and skip count that the gate
+    # moves on to once the RUN patches have been scored.
+    level, spectrum = self.measure(patches)
+    decisions = np.where(level < self.energy_threshold, QUIET, RUN)
+    reference_spectrum = self._reference_spectrum
+    skips = self._skips
+    for i in np.flatnonzero(decisions == RUN):
+      if (reference_spectrum is not None and skips < self.max_skips and
+          np.mean(np.abs(spectrum[i] - reference_spectrum)) <
+          self.flux_threshold):
+        decisions[i] = STEADY
+        skips += 1
+      else:
+        reference_spectrum = spectrum[i]
+        skips = 0
+    return decisions, reference_spectrum, skips
+
+  def apply(self, patches, embed):
+    """Score patches, running embed only on those that pass the gate.
+
+    Args:
+      patches: A (num_patches, num_frames, num_bands) stack of patches.
+      embed: Callable mapping a stack of patches to (scores, embeddings),
+        e.g. YamnetClassifier's model call.
+
+    Returns:
+      (scores, embeddings) for all the patches.
+    """
+    if len(patches) == 0:
+      return embed(patches)
+    with self._lock:
+      reference = self._reference
+      decisions, reference_spectrum, skips = self._decide(patches)
+      run = np.flatnonzero(decisions == RUN)
+      if self._silence is None and np.any(decisions == QUIET):
+        silent_patch = np.full((1,) + np.shape(patches)[1:],
+                               np.log(params.LOG_OFFSET), dtype=np.float32)
+        self._silence = embed(silent_patch)
+      scores, embeddings = embed(np.asarray(patches)[run])
+      # Only now that the patches are scored does the gate move on.
+      self._reference_spectrum = reference_spectrum
+      self._skips = skips
+      if len(run):
+        self._reference = (scores[-1], embeddings[-1])
+      self.counts += np.bincount(decisions, minlength=3)
+
+    all_scores = np.zeros((len(patches), params.NUM_CLASSES), dtype=np.float32)
+    all_embeddings = np.zeros((len(patches), params.EMBEDDING_SIZE),
+                              dtype=np.float32)
+    all_scores[run] = scores
+    all_embeddings[run] = embeddings
+    if self._silence is not None:
+      all_scores[decisions == QUIET] = self._silence[0]
+      all_embeddings[decisions == QUIET] = self._silence[1]
+    # Each steady patch takes the results of the last run before it, from
+    # this call or, before the first one, from the previous calls.
+    steady = np.flatnonzero(decisions == STEADY)
+    if len(steady):
+      last_run = np.searchsorted(run, steady) - 1
+      from_run = last_run >= 0
+      all_scores[steady[from_run]] = scores[last_run[from_run]]
+      all_embeddings[steady[from_run]] = embeddings[last_run[from_run]]
+      if not np.all(from_run):
+        all_scores[steady[~from_run]] = reference[0]
+        all_embeddings[steady[~from_run]] = reference[1]
+
+    metrics.count('gate_run', len(run))
+    metrics.count('gate_quiet', int(np.sum(decisions == QUIET)))
+    metrics.count('gate_steady', len(steady))
+    return all_scores, all_embeddings
+
+  def stats(self):
+    """Counts of the gate decisions so far and the fraction skipped."""
+    total = int(self.counts.sum())
+    return {'patches': total,
+            'run': int(self.counts[RUN]),
+            'quiet': int(self.counts[QUIET]),
+            'steady': int(self.counts[STEADY]),
+            'skip_rate': (total - int(self.counts[RUN])) / total if total else 0.0}
@@ -0,0 +1,77 @@
+"""Tests for the silence gate."""
+
+import numpy as np
+import tensorflow as tf
+
+import gate
+import params
+
+
+def fake_embed(patches):
+  """Scores that identify the patch, as a stand-in for the model."""
+  patches = np.asarray(patches)
+  scores = np.repeat(patches.mean(axis=(1, 2))[:, np.newaxis],
+                     params.NUM_CLASSES, axis=1)
+  return scores, np.zeros((len(patches), params.EMBEDDING_SIZE))
+
+
+class SilenceGateTest(tf.test.TestCase):
+
+  def testDecisions(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    shape = (params.PATCH_FRAMES, params.PATCH_BANDS)
+    silent = np.full(shape, np.log(params.LOG_OFFSET))
+    background = np.random.uniform(-1.0, -0.9, shape)
+    loud = np.random.uniform(2.0, 3.0, shape)
+    patches = np.stack([silent, background, background + 0.01,
+                        background + 0.02, loud, loud + 0.01])
+    self.assertAllEqual(
+        [gate.QUIET, gate.RUN, gate.STEADY, gate.RUN, gate.RUN, gate.STEADY],
+        gate.SilenceGate(max_skips=1).decide(patches))
+    silence_gate = gate.SilenceGate(max_skips=1)
+    scores, embeddings = silence_gate.apply(patches, fake_embed)
+    expected = fake_embed(patches)[0]
+    self.assertAllClose(expected[[0, 1, 1, 3, 4, 4]], scores)
+    self.assertEqual((6, params.EMBEDDING_SIZE), embeddings.shape)
+    self.assertEqual({'patches': 6, 'run': 3, 'quiet': 1, 'steady': 2,
+                      'skip_rate': 0.5}, silence_gate.stats())
+
+  def testStateAcrossCalls(self):
+    shape = (1, params.PATCH_FRAMES, params.PATCH_BANDS)
+    silence_gate = gate.SilenceGate(max_skips=2)
+    first, _ = silence_gate.apply(np.zeros(shape), fake_embed)
+    for _ in range(2):
+      scores, _ = silence_gate.apply(np.full(shape, 0.01), fake_embed)
+      self.assertAllClose(first, scores)
+    scores, _ = silence_gate.apply(np.full(shape, 0.01), fake_embed)
+    self.assertAllClose(0.01, scores[0, 0])
+    silence_gate.reset()
+    scores, _ = silence_gate.apply(np.full(shape, 0.02), fake_embed)
+    self.assertAllClose(0.02, scores[0, 0])
+
+  def testFailedEmbedLeavesState(self):
+    shape = (1, params.PATCH_FRAMES, params.PATCH_BANDS)
+    silence_gate = gate.SilenceGate()
+
+    def failing_embed(patches):
+      raise RuntimeError('model failed')
+
+    with self.assertRaises(RuntimeError):
+      silence_gate.apply(np.zeros(shape), failing_embed)
+    self.assertEqual(0, silence_gate.stats()['patches'])
+    # The failed patch did not become the reference, so a similar one runs
+    # through the model instead of taking the missing reference's scores.
+    self.assertAllEqual([gate.RUN],
+                        silence_gate.decide(np.full(shape, 0.01)))
+    scores, _ = silence_gate.apply(np.full(shape, 0.01), fake_embed)
+    self.assertAllClose(0.01, scores[0, 0])
+
+  def testDecideLeavesState(self):
+    shape = (1, params.PATCH_FRAMES, params.PATCH_BANDS)
+    silence_gate = gate.SilenceGate()
+    for _ in range(2):
+      self.assertAllEqual([gate.RUN], silence_gate.decide(np.zeros(shape)))
+
+
+if __name__ == '__main__':
+  tf.test.main()
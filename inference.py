@@ -2,49 +2,460 @@ from __future__ import division, print_function
 
 
 import numpy as np
-import resampy
-import soundfile as sf
 
+import class_map
+import metrics
+import numpy_features
 import params
-import yamnet as yamnet_model
+import resampling
 
+import argparse
 import os
+import sys
+import threading
+import time
 #from keras.models import load_model
 
-def classification(argv):
-  yamnet = yamnet_model.yamnet_frames_model(params)
-  yamnet.load_weights('yamnet.h5')
-  #yamnet_classes = yamnet_model.class_names('yamnet_class_map.csv')
-
-  waveform = wav_data / 32768.0  # Convert to [-1.0, +1.0]
-  sr = 44100
-  
-  # Convert to mono and the sample rate expected by YAMNet.
-  if len(waveform.shape) > 1:
-    waveform = np.mean(waveform, axis=1)
-  if sr != params.SAMPLE_RATE:
-    waveform = resampy.resample(waveform, sr, params.SAMPLE_RATE)
-
-  # Predict YAMNet classes.
-  # Second output is log-mel-spectrogram array (used for visualizations).
-  # (steps=1 is a work around for Keras batching limitations.)
-  scores, _ = yamnet.predict(np.reshape(waveform, [1, -1]), steps=1)
-  # Scores is a matrix of (time_frames, num_classes) classifier scores.
-  # Average them along time to get an overall classifier output for the clip.
-  prediction = np.mean(scores, axis=0)
-  # Report the highest-scoring classes and their scores.
-  #sound_events = np.argsort(prediction)[::-1]
-  return prediction
-'''
-  present = []
-  prob = prediction[sound_events[0]]
-  for event in sound_events:
-    event_prob = prediction[event]
-    if event_prob >= 0.1:
-      present.append(event)
-
-  print('Stream :\n' + 
-        '\n'.join('  {:12s}: {:.3f}'.format(yamnet_classes[i], prediction[i])
-                  for i in present[:5]))
-'''  
+# TensorFlow (with the model definition in yamnet.py) and soundfile are only
+# imported when they are first needed, so that importing this module, and
+# starting the programs built on it, is fast.
 
+# Where `python inference.py --export` writes the prebuilt model, which
+# get_classifier() prefers over rebuilding the model from yamnet.h5.
+SAVED_MODEL = 'yamnet_saved_model'
+
+
+class YamnetClassifier(object):
+  """A long-lived YAMNet session that is reused across classification calls.
+
+  Building the graph and loading the HDF5 weights costs far more than
+  scoring a second of audio, so both happen once in the constructor,
+  followed by a warm-up call on a dummy waveform. Model calls are
+  serialized with a lock, so one instance can be shared between threads;
+  preprocessing (mono downmix, resampling) runs outside the lock.
+
+  An optional patch_cache.PatchCache lets patches that were already scored
+  skip the model altogether, and an optional gate.SilenceGate skips it for
+  quiet or unchanged patches of a continuous stream. By default the batch
+  norm layers are folded into the convolutions (see
+  yamnet.fold_batch_norm()).
+  """
+
+  def __init__(self, weights='yamnet.h5', batch_size=64, cache=None,
+               fused=True, gate=None):
+    self.batch_size = batch_size
+    self.fused = fused
+    self.cache = None
+    self.gate = None
+    self._lock = threading.Lock()
+    self._features = self._build_features()
+    self._yamnet = self._build_model(weights)
+    # Trace both models once so the first real call is not the slow one.
+    self.classify_waveform(np.zeros(params.SAMPLE_RATE))
+    self.cache = cache
+    self.gate = gate
+
+  def _build_features(self):
+    """Build the waveform to patches model used by waveform_to_patches()."""
+    import yamnet as yamnet_model
+    return yamnet_model.yamnet_features_model(params)
+
+  def _build_model(self, weights):
+    """Build the patches model and load its weights."""
+    import yamnet as yamnet_model
+    yamnet = yamnet_model.yamnet_patches_model()
+    yamnet.load_weights(weights)
+    if self.fused:
+      fused_yamnet = yamnet_model.yamnet_patches_model(fused=True)
+      yamnet_model.fold_batch_norm(yamnet, fused_yamnet)
+      yamnet = fused_yamnet
+    return yamnet
+
+  @staticmethod
+  def preprocess(waveform, sr):
+    """Convert a float waveform to mono at the sample rate expected by YAMNet."""
+    waveform = np.asarray(waveform)
+    if len(waveform.shape) > 1:
+      waveform = np.mean(waveform, axis=1)
+    if sr != params.SAMPLE_RATE:
+      with metrics.timer('resample'):
+        waveform = resampling.resample(waveform, sr, params.SAMPLE_RATE)
+    return waveform
+
+  def waveform_to_patches(self, waveform):
+    """Frame a mono 16 kHz waveform into log mel spectrogram patches."""
+    # (steps=1 is a work around for Keras batching limitations.)
+    with self._lock, metrics.timer('features'):
+      return self._features.predict(np.reshape(waveform, [1, -1]), steps=1)
+
+  def _predict_batch(self, patches):
+    """Run the model over one batch of patches."""
+    return self._yamnet.predict_on_batch(patches)
+
+  def _predict_patches(self, patches):
+    """Run the model over patches in batches, returning (scores, embeddings)."""
+    with self._lock, metrics.timer('predict'):
+      outputs = [self._predict_batch(patches[i:i + self.batch_size])
+                 for i in range(0, len(patches), self.batch_size)]
+    metrics.count('patches', len(patches))
+    return (np.concatenate([scores for scores, _ in outputs]),
+            np.concatenate([embeddings for _, embeddings in outputs]))
+
+  def embed_patches(self, patches):
+    """Return the (scores, embeddings) of a stack of patches.
+
+    With a SilenceGate, only the patches that pass the gate are scored, and
+    with a PatchCache, only the patches that are not in the cache are run
+    through the model.
+    """
+    if self.gate is not None:
+      return self.gate.apply(patches, self._embed_patches)
+    return self._embed_patches(patches)
+
+  def _embed_patches(self, patches):
+    """embed_patches() without the gate."""
+    if len(patches) == 0:
+      return (np.zeros((0, params.NUM_CLASSES), dtype=np.float32),
+              np.zeros((0, params.EMBEDDING_SIZE), dtype=np.float32))
+    if self.cache is None:
+      return self._predict_patches(patches)
+
+    keys = [self.cache.key(patch) for patch in patches]
+    entries = [self.cache.get(key) for key in keys]
+    missing = [i for (i, entry) in enumerate(entries) if entry is None]
+    metrics.count('cache_hits', len(patches) - len(missing))
+    if missing:
+      scores, embeddings = self._predict_patches(np.asarray(patches)[missing])
+      for (j, i) in enumerate(missing):
+        self.cache.put(keys[i], embeddings[j], scores[j])
+        entries[i] = (embeddings[j], scores[j])
+    return (np.stack([scores for _, scores in entries]),
+            np.stack([embedding for embedding, _ in entries]))
+
+  def classify_patches(self, patches):
+    """Score a (num_patches, num_frames, num_bands) stack of patches."""
+    return self.embed_patches(patches)[0]
+
+  def classify_waveform(self, waveform):
+    """Return the (num_patches, num_classes) scores of a mono 16 kHz waveform."""
+    return self.classify_patches(self.waveform_to_patches(waveform))
+
+  def classify_batch(self, waveforms, sr=params.SAMPLE_RATE):
+    """Score a list of variable-length waveforms in batched forward passes.
+
+    The patches of all clips are packed into one stack and run through the
+    Mobilenet trunk together, rather than one predict() call per clip.
+
+    Args:
+      waveforms: A list of 1-D (or [samples, channels]) float waveforms in
+        [-1.0, +1.0], all sampled at sr.
+      sr: The sample rate of the waveforms.
+
+    Returns:
+      A list with one (num_patches, num_classes) score matrix per input
+      clip. Clips shorter than one patch window get an empty
+      (0, num_classes) matrix.
+    """
+    return self.classify_patches_batch(
+      [self.waveform_to_patches(self.preprocess(waveform, sr))
+       for waveform in waveforms])
+
+  def classify_patches_batch(self, patches):
+    """Score a list of patch stacks, one per clip, in batched forward passes.
+
+    The SilenceGate, if any, is bypassed: its state follows one continuous
+    stream, and the clips of a batch are unrelated.
+
+    Returns:
+      A list with one (num_patches, num_classes) score matrix per stack.
+    """
+    if not patches:
+      return []
+    # End offset of each clip's patches in the packed stack.
+    boundaries = np.cumsum([len(clip_patches) for clip_patches in patches])
+    scores = self._embed_patches(np.concatenate(patches))[0]
+    return np.split(scores, boundaries[:-1])
+
+  def classify_file(self, path, block_seconds=10.0, batch_patches=None):
+    """Yield the frame scores of a sound file of any length, batch by batch.
+
+    The file is read in blocks with soundfile, and each block is downmixed,
+    resampled and featurized incrementally (the streaming resampler and
+    StreamingFeatures carry the filter and STFT history across blocks), so
+    memory use depends on the block size, not on the length of the file.
+    Concatenated, the yielded scores equal those of classify_waveform() on
+    the whole (preprocessed) file.
+
+    Args:
+      path: The sound file.
+      block_seconds: Seconds of audio read per block.
+      batch_patches: Number of patches scored per batch, by default
+        batch_size. Every yielded batch but the last has this many rows.
+
+    Yields:
+      (num_patches, num_classes) score matrices, in file order.
+    """
+    import soundfile as sf
+    batch_patches = batch_patches or self.batch_size
+    streaming_features = numpy_features.StreamingFeatures(params)
+    pending = np.zeros((0, params.PATCH_FRAMES, params.PATCH_BANDS),
+                       dtype=np.float32)
+    with sf.SoundFile(path) as sound_file:
+      resampler = None
+      if sound_file.samplerate != params.SAMPLE_RATE:
+        resampler = resampling.Resampler(sound_file.samplerate,
+                                         params.SAMPLE_RATE)
+      blocks = sound_file.blocks(
+        max(1, int(block_seconds * sound_file.samplerate)), always_2d=True)
+      # An empty last block flushes the tail of the resampler.
+      for (block, final) in _with_final(blocks, np.zeros((0, 1))):
+        with metrics.timer('decode'):
+          waveform = np.mean(block, axis=1)
+        if resampler is not None:
+          with metrics.timer('resample'):
+            waveform = resampler.process(waveform, final=final)
+        with metrics.timer('features'):
+          pending = np.concatenate(
+            [pending, streaming_features.add(waveform)])
+        while len(pending) >= batch_patches or (final and len(pending)):
+          yield self.classify_patches(pending[:batch_patches])
+          pending = pending[batch_patches:]
+
+  def classification(self, wav_data, sr=44100):
+    """Return the clip-mean class scores of 16-bit PCM audio."""
+    with metrics.timer('decode'):
+      waveform = wav_data / 32768.0  # Convert to [-1.0, +1.0]
+
+    # Convert to mono and the sample rate expected by YAMNet.
+    waveform = self.preprocess(waveform, sr)
+
+    # Scores is a matrix of (time_frames, num_classes) classifier scores.
+    scores = self.classify_waveform(waveform)
+    # Average them along time to get an overall classifier output for the clip.
+    prediction = np.mean(scores, axis=0)
+    # Report the highest-scoring classes and their scores.
+    #sound_events = np.argsort(prediction)[::-1]
+    return prediction
+
+
+class StreamingClassifier(object):
+  """Classifies a live stream of 16-bit PCM chunks at patch rate.
+
+  Chunks of any size are decoded without copying, resampled with a
+  streaming resampler and featurized incrementally, so each chunk costs
+  only its own share of the work. The model runs only when a new patch is
+  complete, i.e. every PATCH_HOP_SECONDS, not on every chunk.
+
+  With a score_archive.ArchiveWriter, the scores of every patch (and their
+  embeddings, if the archive stores them) are also appended to it, stamped
+  with wall-clock times counted from the first chunk of the stream.
+  """
+
+  def __init__(self, classifier=None, sr=44100, channels=1, archive=None):
+    self._classifier = classifier
+    self.channels = channels
+    self.archive = archive
+    self._resampler = resampling.Resampler(sr, params.SAMPLE_RATE)
+    self._features = numpy_features.StreamingFeatures(params)
+    self._start_time = None
+    self._num_patches = 0
+
+  @property
+  def classifier(self):
+    """The classifier, by default the shared one, built on first use.
+
+    The first patch is only complete after a second of audio, so a program
+    can open its window and start streaming before the model is loaded.
+    """
+    if self._classifier is None:
+      self._classifier = get_classifier()
+    return self._classifier
+
+  def reset(self):
+    self._resampler.reset()
+    self._features.reset()
+    self._start_time = None
+    self._num_patches = 0
+
+  def add(self, chunk):
+    """Feed a chunk of interleaved int16 samples (bytes or array).
+
+    Returns:
+      A (num_new_patches, num_classes) matrix with the scores of the patches
+      completed by this chunk, usually empty.
+    """
+    if self._start_time is None:
+      self._start_time = time.time()
+    with metrics.timer('decode'):
+      if isinstance(chunk, bytes):
+        chunk = np.frombuffer(chunk, dtype=np.int16)
+      waveform = chunk / 32768.0  # Convert to [-1.0, +1.0]
+      if self.channels > 1:
+        waveform = np.mean(np.reshape(waveform, [-1, self.channels]), axis=1)
+    with metrics.timer('resample'):
+      waveform = self._resampler.process(waveform)
+    with metrics.timer('features'):
+      patches = self._features.add(waveform)
+    if not len(patches):
+      return np.zeros((0, params.NUM_CLASSES), dtype=np.float32)
+    if self.archive is None:
+      return self.classifier.classify_patches(patches)
+
+    scores, embeddings = self.classifier.embed_patches(patches)
+    times = self._start_time + params.PATCH_HOP_SECONDS * (
+      self._num_patches + np.arange(len(patches)))
+    self._num_patches += len(patches)
+    self.archive.append(
+      scores, embeddings if self.archive.header['embedding_size'] else None,
+      times)
+    return scores
+
+
+class SavedModelYamnetClassifier(YamnetClassifier):
+  """A YamnetClassifier that loads the prebuilt model of export_saved_model().
+
+  Loading the serialized, batch-norm-folded graph skips building the Keras
+  layers, loading the HDF5 weights and folding the batch norms. The patches
+  are computed with numpy_features, so no Keras model is built at all.
+  """
+
+  def __init__(self, weights=SAVED_MODEL, batch_size=64, cache=None,
+               fused=True, gate=None):
+    # fused is accepted so that create_classifier() takes the same arguments
+    # for both kinds of model; the export is always folded.
+    super(SavedModelYamnetClassifier, self).__init__(
+      weights, batch_size=batch_size, cache=cache, fused=fused, gate=gate)
+
+  def _build_features(self):
+    return None
+
+  def waveform_to_patches(self, waveform):
+    with metrics.timer('features'):
+      return numpy_features.waveform_to_patches(
+        np.asarray(waveform, dtype=np.float32), params)
+
+  def _build_model(self, weights):
+    import tensorflow as tf
+    model = tf.saved_model.load(weights)
+    self._serve = model.signatures['serving_default']
+    return model
+
+  def _predict_batch(self, patches):
+    import tensorflow as tf
+    outputs = self._serve(tf.constant(patches, dtype=tf.float32))
+    return outputs['scores'].numpy(), outputs['embeddings'].numpy()
+
+
+def export_saved_model(path=SAVED_MODEL, weights='yamnet.h5'):
+  """Write the batch-norm-folded patches model as a SavedModel.
+
+  Its serving signature maps a [batch, PATCH_FRAMES, PATCH_BANDS] float32
+  patch stack to 'scores' and 'embeddings'.
+  """
+  import tensorflow as tf
+  model = YamnetClassifier(weights)._yamnet
+
+  @tf.function(input_signature=[tf.TensorSpec(
+    [None, params.PATCH_FRAMES, params.PATCH_BANDS], tf.float32)])
+  def serve(patches):
+    scores, embeddings = model(patches, training=False)
+    return {'scores': scores, 'embeddings': embeddings}
+
+  module = tf.Module()
+  module.model = model
+  module.serve = serve
+  tf.saved_model.save(module, path, signatures={'serving_default': serve})
+
+
+def create_classifier(weights=None, **kwargs):
+  """Create a classifier from an HDF5 weights file or a SavedModel.
+
+  By default the SavedModel written by `python inference.py --export` is
+  used if there is one, and yamnet.h5 otherwise.
+  """
+  if weights is None:
+    weights = SAVED_MODEL if os.path.isdir(SAVED_MODEL) else 'yamnet.h5'
+  if os.path.isdir(weights):
+    return SavedModelYamnetClassifier(weights, **kwargs)
+  return YamnetClassifier(weights, **kwargs)
+
+
+def _with_final(iterable, last):
+  """Yield (item, False) for each item, then (last, True)."""
+  for item in iterable:
+    yield item, False
+  yield last, True
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier():
+  """Return the process-wide YamnetClassifier, building it on first use."""
+  global _classifier
+  with _classifier_lock:
+    if _classifier is None:
+      _classifier = create_classifier()
+    return _classifier
+
+
+def classification(wav_data, sr=44100):
+  """Return the clip-mean class scores of 16-bit PCM audio."""
+  return get_classifier().classification(wav_data, sr)
+
+
+def classify_batch(waveforms, sr=params.SAMPLE_RATE):
+  """Score a list of waveforms with the shared classifier.
+
+  See YamnetClassifier.classify_batch().
+  """
+  return get_classifier().classify_batch(waveforms, sr)
+
+
+def classify_file(path, block_seconds=10.0):
+  """Yield the frame scores of a sound file with the shared classifier.
+
+  See YamnetClassifier.classify_file().
+  """
+  return get_classifier().classify_file(path, block_seconds)
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+    description='Print the top classes of sound files.')
+  parser.add_argument('files', nargs='*')
+  parser.add_argument('--weights',
+                      help='HDF5 weights or SavedModel directory (default: {} '
+                           'if it exists, else yamnet.h5).'.format(SAVED_MODEL))
+  parser.add_argument('--export', metavar='DIR',
+                      help='Write the prebuilt model to DIR for faster '
+                           'startup, and exit.')
+  args = parser.parse_args(argv)
+  if args.export:
+    export_saved_model(args.export, args.weights or 'yamnet.h5')
+    return
+  if not args.files:
+    parser.error('Give sound files to classify, or --export.')
+
+  classifier = create_classifier(args.weights)
+  yamnet_classes = class_map.class_names('yamnet_class_map.csv')
+
+  for file_name in args.files:
+    # Stream the file, so that recordings of any length fit in memory.
+    score_sum = np.zeros(params.NUM_CLASSES)
+    num_frames = 0
+    for scores in classifier.classify_file(file_name):
+      score_sum += np.sum(scores, axis=0)
+      num_frames += len(scores)
+    prediction = score_sum / max(num_frames, 1)
+
+    # Report the highest-scoring classes and their scores.
+    top5_i = np.argsort(prediction)[::-1][:5]
+    print(file_name, ':\n' +
+          '\n'.join('  {:12s}: {:.3f}'.format(yamnet_classes[i], prediction[i])
+                    for i in top5_i))
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,328 @@
+"""Local inference server that batches the requests of several processes.
+
+Usage:
+  python inference_server.py --port 8765
+
+  client = inference_server.InferenceClient('http://127.0.0.1:8765')
+  scores = client.classify_waveform(waveform, sr=44100)
+
+One process holds the model and serves it over HTTP on localhost, so the
+dashboards and batch jobs of a host share a single copy of it instead of
+loading their own. The clients (InferenceClient) only need NumPy.
+
+  POST /classify?sr=<rate>  Body: a waveform in the .npy format, float in
+                            [-1.0, +1.0] or int16, mono or (samples,
+                            channels). Returns its (num_frames, num_classes)
+                            float32 frame scores as .npy.
+  POST /patches             Body: a (num_patches, PATCH_FRAMES, PATCH_BANDS)
+                            stack of log mel patches as .npy (e.g. from
+                            numpy_features). Returns their scores.
+  GET /health               Request and batch counts as JSON.
+
+Every request is decoded, resampled and featurized on its own handler
+thread. Only the model is shared: DynamicBatcher collects the patches of
+concurrent requests until max_batch_patches are waiting or the oldest has
+waited max_latency seconds, scores them in one classify_patches_batch()
+call and hands each request its own rows.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import concurrent.futures
+import io
+import json
+import queue
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import metrics
+import numpy_features
+import params
+import resampling
+
+NPY_CONTENT_TYPE = 'application/x-npy'
+
+
+def _to_npy(array):
+  buffer = io.BytesIO()
+  np.save(buffer, np.asarray(array), allow_pickle=False)
+  return buffer.getvalue()
+
+
+def _from_npy(data):
+  return np.load(io.BytesIO(data), allow_pickle=False)
+
+
+class DynamicBatcher(threading.Thread):
+  """Scores the patch stacks of concurrent callers in shared batches.
+
+  Args:
+    classify_patches_batch: Callable mapping a list of patch stacks to a list
+      of their score matrices, e.g. YamnetClassifier.classify_patches_batch.
+    max_batch_patches: Most patches gathered into one call. A single larger
+      request still goes through on its own.
+    max_latency: Longest time in seconds the first request of a batch waits
+      for others to join it.
+  """
+
+  def __init__(self, classify_patches_batch, max_batch_patches=256,
+               max_latency=0.01):
+    super(DynamicBatcher, self).__init__(name='dynamic-batcher')
+    self.daemon = True
+    self.classify_patches_batch = classify_patches_batch
+    self.max_batch_patches = max_batch_patches
+    self.max_latency = max_latency
+    self.requests = 0
+    self.batches = 0
+    self.patches = 0
+    self._queue = queue.Queue()
+    self._stats_lock = threading.Lock()
+
+  def submit(self, patches):
+    """Queue a patch stack; returns a Future of its score matrix."""
+    future = concurrent.futures.Future()
+    self._queue.put((np.asarray(patches, dtype=np.float32), future,
+                     time.time()))
+    return future
+
+  def classify_patches(self, patches, timeout=None):
+    """Score a patch stack in the next batch, blocking until it is done."""
+    return self.submit(patches).result(timeout)
+
+  def stop(self):
+    self._queue.put(None)
+
+  def run(self):
+    pending = None  # A request that did not fit in the previous batch.
+    while True:
+      first = pending or self._queue.get()
+      pending = None
+      if first is None:
+        return
+      batch = [first]
+      num_patches = len(first[0])
+      deadline = first[2] + self.max_latency
+      while num_patches < self.max_batch_patches:
+        remaining = deadline - time.time()
+        try:
+          request = (self._queue.get(timeout=remaining) if remaining > 0 else
+                     self._queue.get_nowait())
+        except queue.Empty:
+          break
+        if request is None:
+          self._queue.put(None)  # Stop after this batch.
+          break
+        if num_patches + len(request[0]) > self.max_batch_patches:
+          pending = request  # Starts the next batch.
+          break
+        batch.append(request)
+        num_patches += len(request[0])
+      self._run_batch(batch, num_patches)
+
+  def _run_batch(self, batch, num_patches):
+    start = time.time()
+    for (_, _, arrived) in batch:
+      metrics.observe('batch_wait', start - arrived)
+    try:
+      scores = self.classify_patches_batch([patches for (patches, _, _)
+                                            in batch])
+    except Exception as error:
+      for (_, future, _) in batch:
+        future.set_exception(error)
+      return
+    with self._stats_lock:
+      self.requests += len(batch)
+      self.batches += 1
+      self.patches += num_patches
+    metrics.count('server_requests', len(batch))
+    metrics.count('server_batches')
+    for ((_, future, _), request_scores) in zip(batch, scores):
+      future.set_result(request_scores)
+
+  def stats(self):
+    with self._stats_lock:
+      return {'requests': self.requests,
+              'batches': self.batches,
+              'patches': self.patches,
+              'mean_batch_patches': (self.patches / self.batches
+                                     if self.batches else 0.0)}
+
+
+def waveform_to_patches(waveform, sr):
+  """Log mel patches of a float or int16 waveform of any rate and layout."""
+  waveform = np.asarray(waveform)
+  if waveform.dtype == np.int16:
+    waveform = waveform / 32768.0
+  if waveform.ndim > 1:
+    waveform = np.mean(waveform, axis=1)
+  if sr != params.SAMPLE_RATE:
+    with metrics.timer('resample'):
+      waveform = resampling.resample(waveform, sr, params.SAMPLE_RATE)
+  with metrics.timer('features'):
+    return numpy_features.waveform_to_patches(waveform, params)
+
+
+class _InferenceHandler(BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    if self.path.split('?')[0] != '/health':
+      self.send_error(404)
+      return
+    self._send(json.dumps(self.server.batcher.stats()).encode('utf-8'),
+               'application/json')
+
+  def do_POST(self):
+    url = urllib.parse.urlsplit(self.path)
+    if url.path not in ('/classify', '/patches'):
+      self.send_error(404)
+      return
+    try:
+      data = _from_npy(self.rfile.read(int(self.headers['Content-Length'])))
+      if url.path == '/classify':
+        query = urllib.parse.parse_qs(url.query)
+        patches = waveform_to_patches(
+          data, int(query.get('sr', [params.SAMPLE_RATE])[0]))
+      else:
+        patches = data
+        if patches.shape[1:] != (params.PATCH_FRAMES, params.PATCH_BANDS):
+          raise ValueError('Expected patches of shape (n, {}, {}), got '
+                           '{}'.format(params.PATCH_FRAMES, params.PATCH_BANDS,
+                                       patches.shape))
+    except (TypeError, ValueError) as error:
+      self.send_error(400, str(error))
+      return
+    try:
+      scores = self.server.batcher.classify_patches(patches)
+    except Exception as error:
+      self.send_error(500, str(error))
+      return
+    self._send(_to_npy(np.asarray(scores, dtype=np.float32)), NPY_CONTENT_TYPE)
+
+  def _send(self, body, content_type):
+    self.send_response(200)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass  # One line per request would drown the log.
+
+
+def serve(classifier, port=8765, host='127.0.0.1', max_batch_patches=256,
+          max_latency=0.01):
+  """Serve a classifier from daemon threads.
+
+  Returns the server; call its shutdown() method and its batcher's stop()
+  to stop it.
+  """
+  batcher = DynamicBatcher(classifier.classify_patches_batch,
+                           max_batch_patches, max_latency)
+  batcher.start()
+  server = ThreadingHTTPServer((host, port), _InferenceHandler)
+  server.daemon_threads = True
+  server.batcher = batcher
+  thread = threading.Thread(target=server.serve_forever, name='inference-http')
+  thread.daemon = True
+  thread.start()
+  return server
+
+
+class InferenceClient(object):
+  """Classifies audio with a model held by an inference server.
+
+  Has the classification() and classify_*() methods of
+  inference.YamnetClassifier that return scores, so it can stand in for one
+  (e.g. in multi_stream.MultiStreamClassifier).
+  """
+
+  def __init__(self, url='http://127.0.0.1:8765', timeout=60.0):
+    self.url = url.rstrip('/')
+    self.timeout = timeout
+
+  def _post(self, path, array):
+    request = urllib.request.Request(
+      self.url + path, data=_to_npy(array),
+      headers={'Content-Type': NPY_CONTENT_TYPE})
+    with urllib.request.urlopen(request, timeout=self.timeout) as response:
+      return _from_npy(response.read())
+
+  def classify_waveform(self, waveform, sr=params.SAMPLE_RATE):
+    """Frame scores of a waveform (float or int16, mono or multichannel)."""
+    return self._post('/classify?sr={:d}'.format(int(sr)), waveform)
+
+  def classify_patches(self, patches):
+    """Scores of a (num_patches, PATCH_FRAMES, PATCH_BANDS) patch stack."""
+    return self._post('/patches', np.asarray(patches, dtype=np.float32))
+
+  def classify_patches_batch(self, patches):
+    """Scores of each patch stack in a list.
+
+    The stacks are posted concurrently, so that the server's DynamicBatcher
+    scores them together in one model call.
+    """
+    patches = [np.asarray(stack, dtype=np.float32) for stack in patches]
+    scores = [np.zeros((0, params.NUM_CLASSES), dtype=np.float32)
+              for _ in patches]
+    nonempty = [i for (i, stack) in enumerate(patches) if len(stack)]
+    if nonempty:
+      with concurrent.futures.ThreadPoolExecutor(len(nonempty)) as executor:
+        for (i, stack_scores) in zip(
+            nonempty, executor.map(self.classify_patches,
+                                   [patches[i] for i in nonempty])):
+          scores[i] = stack_scores
+    return scores
+
+  def classify_batch(self, waveforms, sr=params.SAMPLE_RATE):
+    """Frame scores of each waveform in a list."""
+    return [self.classify_waveform(waveform, sr) for waveform in waveforms]
+
+  def classification(self, wav_data, sr=44100):
+    """Return the clip-mean class scores of 16-bit PCM audio."""
+    return np.mean(
+      self.classify_waveform(np.asarray(wav_data, dtype=np.int16), sr), axis=0)
+
+  def health(self):
+    with urllib.request.urlopen(self.url + '/health',
+                                timeout=self.timeout) as response:
+      return json.loads(response.read().decode('utf-8'))
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+    description='Serve the YAMNet model to local processes.')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8765)
+  parser.add_argument('--weights',
+                      help='HDF5 weights or SavedModel directory.')
+  parser.add_argument('--max-batch-patches', type=int, default=256)
+  parser.add_argument('--max-latency-ms', type=float, default=10.0,
+                      help='Longest wait for a batch to fill.')
+  args = parser.parse_args(argv)
+
+  import inference
+  classifier = inference.create_classifier(args.weights)
+  server = serve(classifier, args.port, args.host, args.max_batch_patches,
+                 args.max_latency_ms / 1000.0)
+  if metrics.enabled:
+    metrics.serve()
+  print('Serving on http://{}:{}'.format(args.host, args.port),
+        file=sys.stderr)
+  try:
+    while True:
+      time.sleep(3600)
+  except KeyboardInterrupt:
+    server.shutdown()
+    server.batcher.stop()
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
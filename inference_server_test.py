@@ -0,0 +1,101 @@
+"""Tests for the local inference server."""
+
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+import inference_server
+from fake_classifier import FakeClassifier
+import numpy_features
+import params
+
+
+def random_patches(count, seed):
+  return np.random.RandomState(seed).uniform(
+    -5.0, 0.0, (count, params.PATCH_FRAMES, params.PATCH_BANDS))
+
+
+class DynamicBatcherTest(tf.test.TestCase):
+
+  def testBatchesConcurrentRequests(self):
+    classifier = FakeClassifier()
+    batcher = inference_server.DynamicBatcher(
+      classifier.classify_patches_batch, max_batch_patches=8, max_latency=0.5)
+    requests = [random_patches(count, seed)
+                for (seed, count) in enumerate([3, 2, 2, 4])]
+    futures = [batcher.submit(patches) for patches in requests]
+    batcher.start()
+    expected = FakeClassifier().classify_patches_batch(requests)
+    for (scores, future) in zip(expected, futures):
+      self.assertAllClose(scores, future.result(5))
+    # The fourth request does not fit in the first batch.
+    self.assertEqual([[3, 2, 2], [4]], classifier.calls)
+    self.assertEqual(2, batcher.stats()['batches'])
+    batcher.stop()
+    batcher.join(5)
+    self.assertFalse(batcher.is_alive())
+
+  def testErrorsReachTheCaller(self):
+    def fail(patches):
+      raise RuntimeError('model failed')
+    batcher = inference_server.DynamicBatcher(fail, max_latency=0.0)
+    batcher.start()
+    with self.assertRaisesRegex(RuntimeError, 'model failed'):
+      batcher.classify_patches(random_patches(1, 0), timeout=5)
+    batcher.stop()
+
+
+class InferenceServerTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(InferenceServerTest, self).setUp()
+    self.classifier = FakeClassifier()
+    self.server = inference_server.serve(self.classifier, port=0,
+                                         max_latency=0.05)
+    self.client = inference_server.InferenceClient(
+      'http://127.0.0.1:{}'.format(self.server.server_address[1]))
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    self.server.batcher.stop()
+    super(InferenceServerTest, self).tearDown()
+
+  def testClassify(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    waveform = np.random.uniform(-1.0, +1.0, int(3 * params.SAMPLE_RATE))
+    expected = FakeClassifier().classify_patches_batch(
+      [numpy_features.waveform_to_patches(waveform, params)])[0]
+    self.assertAllClose(expected, self.client.classify_waveform(waveform),
+                        atol=1e-6)
+    wav_data = (waveform * 32767).astype(np.int16)
+    self.assertEqual((params.NUM_CLASSES,),
+                     self.client.classification(wav_data, 44100).shape)
+
+  def testConcurrentClients(self):
+    requests = [random_patches(2, seed) for seed in range(8)]
+    results = [None] * len(requests)
+
+    def request(i):
+      results[i] = self.client.classify_patches(requests[i])
+    threads = [threading.Thread(target=request, args=(i,))
+               for i in range(len(requests))]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join(10)
+    for (patches, scores) in zip(requests, results):
+      self.assertAllClose(
+        FakeClassifier().classify_patches_batch([patches])[0], scores)
+    stats = self.client.health()
+    self.assertEqual(len(requests), stats['requests'])
+    self.assertLess(stats['batches'], len(requests))
+
+  def testBadRequest(self):
+    with self.assertRaisesRegex(Exception, '400'):
+      self.client.classify_patches(np.zeros((2, 3)))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,92 @@
+"""Tests for the streaming classifier, with a stand-in model."""
+
+import numpy as np
+import tensorflow as tf
+
+import inference
+from fake_classifier import FakeClassifier
+import numpy_features
+import params
+import resampling
+
+
+class FakeArchive(object):
+
+  def __init__(self, embedding_size):
+    self.header = {'embedding_size': embedding_size}
+    self.appended = []
+
+  def append(self, scores, embeddings=None, times=None):
+    self.appended.append((scores, embeddings, times))
+
+
+class StreamingClassifierTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(StreamingClassifierTest, self).setUp()
+    np.random.seed(0)
+    # 3 s of int16 stereo at 44.1 kHz.
+    self.samples = np.random.randint(
+      -8000, 8000, (3 * 44100, 2)).astype(np.int16)
+
+  def expected_scores(self):
+    waveform = np.mean(self.samples / 32768.0, axis=1)
+    waveform = resampling.resample(waveform, 44100, params.SAMPLE_RATE)
+    return FakeClassifier().classify_patches(
+      numpy_features.waveform_to_patches(waveform, params))
+
+  def stream(self, streaming, chunk_frames):
+    scores = []
+    for start in range(0, len(self.samples), chunk_frames):
+      chunk = self.samples[start:start + chunk_frames]
+      # Alternate between raw bytes and arrays of interleaved samples.
+      scores.append(streaming.add(
+        chunk.tobytes() if len(scores) % 2 else chunk.ravel()))
+    return scores
+
+  def testChunksMatchWholeWaveform(self):
+    expected = self.expected_scores()
+    for chunk_frames in (512, 2048, 44100):
+      streaming = inference.StreamingClassifier(
+        FakeClassifier(), sr=44100, channels=2)
+      scores = self.stream(streaming, chunk_frames)
+      # Most chunks complete no patch and return no scores.
+      self.assertTrue(all(s.shape[1:] == (params.NUM_CLASSES,)
+                          for s in scores))
+      streamed = np.concatenate(scores)
+      # The stream has not ended, so the resampler holds back a few samples.
+      self.assertBetween(len(streamed), len(expected) - 1, len(expected))
+      self.assertAllClose(expected[:len(streamed)], streamed, atol=1e-4)
+
+  def testReset(self):
+    streaming = inference.StreamingClassifier(
+      FakeClassifier(), sr=44100, channels=2)
+    first = np.concatenate(self.stream(streaming, 2048))
+    streaming.reset()
+    self.assertAllClose(first, np.concatenate(self.stream(streaming, 2048)))
+
+  def testArchive(self):
+    archive = FakeArchive(params.EMBEDDING_SIZE)
+    streaming = inference.StreamingClassifier(
+      FakeClassifier(), sr=44100, channels=2, archive=archive)
+    scores = np.concatenate(self.stream(streaming, 4410))
+    self.assertAllClose(
+      scores, np.concatenate([appended[0] for appended in archive.appended]))
+    self.assertAllClose(
+      scores[:, :params.EMBEDDING_SIZE],
+      np.concatenate([appended[1] for appended in archive.appended]))
+    # Times count patch hops from the first chunk.
+    times = np.concatenate([appended[2] for appended in archive.appended])
+    self.assertAllClose(params.PATCH_HOP_SECONDS * np.arange(len(scores)),
+                        times - times[0])
+    # Archives without embeddings get only the scores.
+    archive = FakeArchive(0)
+    streaming = inference.StreamingClassifier(
+      FakeClassifier(), sr=44100, channels=2, archive=archive)
+    self.stream(streaming, 4410)
+    self.assertTrue(archive.appended)
+    self.assertTrue(all(appended[1] is None for appended in archive.appended))
+
+
+if __name__ == '__main__':
+  tf.test.main()
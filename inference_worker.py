@@ -0,0 +1,129 @@
+"""Background inference for the live visualizations.
+
+The GUI thread should only draw. InferenceWorker runs on its own thread:
+every period it reads the latest audio window (e.g. from a
+recorder.RecordingStream, which is filled by the PyAudio callback thread),
+classifies it and publishes the result to a small queue that the GUI polls.
+
+Stale work is dropped rather than queued. If a classification overruns the
+period, the windows that were missed are skipped, not caught up on, and if
+the GUI has not consumed a result by the time the next one is ready, the old
+one is replaced. Both are counted in dropped_windows.
+
+A classification that raises does not stop the worker: the exception is
+counted in errors (and the inference_errors metric), kept in last_error for
+the GUI to show, and the next window is classified as usual.
+"""
+
+import collections
+import queue
+import threading
+import time
+
+import numpy as np
+
+import metrics
+
+WorkerResult = collections.namedtuple(
+  'WorkerResult', ['value', 'captured', 'finished'])
+WorkerResult.__doc__ = """A classification result and when its window was
+captured and its classification finished (time.time() seconds)."""
+
+
+class InferenceWorker(threading.Thread):
+  """Classifies the latest audio window on a dedicated thread.
+
+  Args:
+    read_window: Callable returning the current audio window. The window is
+      copied before classification, so it may be a view of a ring buffer.
+    classify: Callable mapping a window to a result.
+    period: Seconds between classifications.
+    max_results: Size of the result queue.
+  """
+
+  def __init__(self, read_window, classify, period=1.0, max_results=1):
+    super(InferenceWorker, self).__init__(name='inference-worker')
+    self.daemon = True
+    self.read_window = read_window
+    self.classify = classify
+    self.period = period
+    self.results = queue.Queue(maxsize=max_results)
+    self.dropped_windows = 0
+    self.errors = 0
+    self.last_error = None
+    self._peak_depth = 0
+    self._stop_event = threading.Event()
+    self._dropped_lock = threading.Lock()
+
+  def run(self):
+    next_tick = time.time()
+    while not self._stop_event.is_set():
+      # Skip the windows that passed while the previous one was classified.
+      behind = int((time.time() - next_tick) // self.period)
+      if behind > 0:
+        self._count_dropped(behind)
+        next_tick += behind * self.period
+      window = np.array(self.read_window())
+      captured = time.time()
+      try:
+        value = self.classify(window)
+      except Exception as error:
+        self.errors += 1
+        self.last_error = error
+        metrics.count('inference_errors')
+      else:
+        finished = time.time()
+        metrics.observe('inference', finished - captured)
+        self._publish(WorkerResult(value, captured, finished))
+      next_tick += self.period
+      self._stop_event.wait(max(0.0, next_tick - time.time()))
+
+  def _count_dropped(self, count):
+    with self._dropped_lock:
+      self.dropped_windows += count
+    metrics.count('dropped_windows', count)
+
+  def _publish(self, result):
+    """Put result on the queue, replacing the oldest one if it is full."""
+    while True:
+      try:
+        self.results.put_nowait(result)
+        with self._dropped_lock:
+          self._peak_depth = max(self._peak_depth, self.results.qsize())
+        return
+      except queue.Full:
+        try:
+          self.results.get_nowait()
+          self._count_dropped(1)
+        except queue.Empty:
+          pass
+
+  def latest(self):
+    """Return the newest unconsumed result without blocking, or None."""
+    result = None
+    while True:
+      try:
+        newer = self.results.get_nowait()
+      except queue.Empty:
+        return result
+      if result is not None:
+        self._count_dropped(1)
+      result = newer
+
+  def queue_depth(self):
+    return self.results.qsize()
+
+  def peak_queue_depth(self):
+    """The most results that were waiting at once since the previous call.
+
+    Unlike queue_depth() right after latest(), which is always 0, this shows
+    how far the GUI falls behind the worker.
+    """
+    with self._dropped_lock:
+      peak = max(self._peak_depth, self.results.qsize())
+      self._peak_depth = 0
+    return peak
+
+  def stop(self, timeout=None):
+    self._stop_event.set()
+    self.join(timeout)
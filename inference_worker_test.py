@@ -0,0 +1,91 @@
+"""Tests for the background inference worker."""
+
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import inference_worker
+
+
+def result(value):
+  return inference_worker.WorkerResult(value, 0.0, 0.0)
+
+
+class InferenceWorkerTest(tf.test.TestCase):
+
+  def make_worker(self, classify=None, period=1.0, max_results=1):
+    return inference_worker.InferenceWorker(
+      lambda: np.zeros(4), classify or (lambda window: 0), period=period,
+      max_results=max_results)
+
+  def testPublishDropsOldest(self):
+    worker = self.make_worker()
+    for value in range(3):
+      worker._publish(result(value))
+    self.assertEqual(1, worker.queue_depth())
+    self.assertEqual(2, worker.dropped_windows)
+    self.assertEqual(2, worker.latest().value)
+    self.assertIsNone(worker.latest())
+
+  def testLatestSkipsOlderResults(self):
+    worker = self.make_worker(max_results=3)
+    for value in range(3):
+      worker._publish(result(value))
+    self.assertEqual(0, worker.dropped_windows)
+    self.assertEqual(3, worker.peak_queue_depth())
+    self.assertEqual(2, worker.latest().value)
+    # The two results never shown count as dropped.
+    self.assertEqual(2, worker.dropped_windows)
+    self.assertEqual(0, worker.queue_depth())
+    self.assertIsNone(worker.latest())
+    self.assertEqual(0, worker.peak_queue_depth())
+
+  def testOverrunWindowsAreDropped(self):
+    def slow(window):
+      time.sleep(0.25)
+      return len(window)
+    worker = self.make_worker(slow, period=0.05, max_results=10)
+    worker.start()
+    time.sleep(0.6)
+    worker.stop()
+    # Each classification covers about five periods; the missed ones are
+    # skipped rather than classified late.
+    self.assertGreaterEqual(worker.dropped_windows, 4)
+    self.assertLessEqual(worker.queue_depth(), 3)
+    self.assertEqual(4, worker.latest().value)
+
+  def testErrorsAreCountedAndSurvived(self):
+    calls = []
+    def flaky(window):
+      calls.append(None)
+      if len(calls) % 2:
+        raise ValueError('bad window')
+      return len(calls)
+    worker = self.make_worker(flaky, period=0.01, max_results=10)
+    worker.start()
+    while len(calls) < 4:
+      time.sleep(0.01)
+    worker.stop()
+    self.assertGreaterEqual(worker.errors, 2)
+    self.assertIsInstance(worker.last_error, ValueError)
+    self.assertEqual(0, worker.latest().value % 2)
+
+  def testStop(self):
+    started = threading.Event()
+    def classify(window):
+      started.set()
+      return 0
+    worker = self.make_worker(classify, period=10.0)
+    worker.start()
+    self.assertTrue(started.wait(5.0))
+    # Stopping interrupts the wait for the next period.
+    stop_start = time.time()
+    worker.stop(timeout=5.0)
+    self.assertFalse(worker.is_alive())
+    self.assertLess(time.time() - stop_start, 1.0)
+
+
+if __name__ == '__main__':
+  tf.test.main()
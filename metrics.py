@@ -0,0 +1,248 @@
+"""Lightweight timers and counters for the hot paths.
+
+Stages are timed with a context manager and events are counted:
+
+  with metrics.timer('predict'):
+    scores = model(patches)
+  metrics.count('dropped_windows')
+
+Instrumentation is off by default, and then timer() returns a shared no-op
+context manager and count() returns immediately, so the instrumented code
+pays about one function call per stage. Set YAMNET_METRICS=1 in the
+environment or call metrics.enable() to turn it on.
+
+Each timed stage keeps a Prometheus-style histogram (cumulative counts per
+latency bucket, plus the sum and count) and a rolling window of its latest
+durations, from which snapshot() reports percentiles. The metrics can be
+exported in the Prometheus text format from a local HTTP endpoint (serve())
+or written as periodic JSON lines (JsonLogger).
+"""
+
+from __future__ import division, print_function
+
+import bisect
+import json
+import os
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+
+# Upper bounds in seconds of the histogram buckets, a 1-2.5-5 series from
+# 0.1 ms to 10 s. The last bucket is +Inf.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+enabled = os.environ.get('YAMNET_METRICS', '') not in ('', '0')
+
+
+class Histogram(object):
+  """Latency histogram with a rolling window of the latest observations."""
+
+  def __init__(self, window=1024):
+    self.counts = [0] * len(BUCKETS)
+    self.sum = 0.0
+    self.count = 0
+    self._window = [0.0] * window
+    self._index = 0
+
+  def observe(self, seconds):
+    self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+    self.sum += seconds
+    self.count += 1
+    self._window[self._index] = seconds
+    self._index = (self._index + 1) % len(self._window)
+
+  def recent(self):
+    """The durations in the rolling window, in no particular order."""
+    return np.array(self._window[:min(self.count, len(self._window))])
+
+  def summary(self):
+    recent = self.recent()
+    summary = {'count': self.count, 'sum_seconds': self.sum}
+    if len(recent):
+      p50, p90, p99 = np.percentile(recent, [50, 90, 99])
+      summary.update({'p50_ms': 1000 * p50, 'p90_ms': 1000 * p90,
+                      'p99_ms': 1000 * p99, 'max_ms': 1000 * recent.max()})
+    return summary
+
+
+class Registry(object):
+  """Thread-safe collection of named histograms and counters."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.histograms = {}
+    self.counters = {}
+
+  def observe(self, name, seconds):
+    with self._lock:
+      if name not in self.histograms:
+        self.histograms[name] = Histogram()
+      self.histograms[name].observe(seconds)
+
+  def count(self, name, value=1):
+    with self._lock:
+      self.counters[name] = self.counters.get(name, 0) + value
+
+  def reset(self):
+    with self._lock:
+      self.histograms.clear()
+      self.counters.clear()
+
+  def snapshot(self):
+    with self._lock:
+      return {'time': time.time(),
+              'stages': dict((name, histogram.summary()) for (name, histogram)
+                             in sorted(self.histograms.items())),
+              'counters': dict(self.counters)}
+
+  def prometheus_text(self, prefix='yamnet'):
+    """The metrics in the Prometheus text exposition format."""
+    lines = []
+    with self._lock:
+      if self.histograms:
+        family = '{}_stage_seconds'.format(prefix)
+        lines += ['# HELP {} Duration of pipeline stages.'.format(family),
+                  '# TYPE {} histogram'.format(family)]
+        for (name, histogram) in sorted(self.histograms.items()):
+          for (bound, count) in zip(BUCKETS, np.cumsum(histogram.counts)):
+            lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(
+              family, name, '+Inf' if bound == float('inf') else repr(bound),
+              count))
+          lines.append('{}_sum{{stage="{}"}} {!r}'.format(
+            family, name, histogram.sum))
+          lines.append('{}_count{{stage="{}"}} {}'.format(
+            family, name, histogram.count))
+      for (name, value) in sorted(self.counters.items()):
+        counter = '{}_{}_total'.format(prefix, name)
+        lines += ['# TYPE {} counter'.format(counter),
+                  '{} {}'.format(counter, value)]
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class _Timer(object):
+
+  __slots__ = ('name', 'start')
+
+  def __init__(self, name):
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, exception, value, traceback):
+    registry.observe(self.name, time.perf_counter() - self.start)
+
+
+class _NullTimer(object):
+
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exception, value, traceback):
+    pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def enable(on=True):
+  """Turn instrumentation on (or off, with on=False)."""
+  global enabled
+  enabled = on
+
+
+def timer(name):
+  """A context manager recording the duration of its block under name."""
+  if not enabled:
+    return _NULL_TIMER
+  return _Timer(name)
+
+
+def observe(name, seconds):
+  """Record a duration measured elsewhere, e.g. across threads."""
+  if enabled:
+    registry.observe(name, seconds)
+
+
+def count(name, value=1):
+  """Add value to the counter name."""
+  if enabled:
+    registry.count(name, value)
+
+
+def snapshot():
+  """Per-stage percentiles and counters as a JSON-serializable dict."""
+  return registry.snapshot()
+
+
+def prometheus_text():
+  return registry.prometheus_text()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    if self.path.split('?')[0] not in ('/', '/metrics'):
+      self.send_error(404)
+      return
+    body = prometheus_text().encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass  # Scrapes are not worth a line on stderr each.
+
+
+def serve(port=9464, host='127.0.0.1'):
+  """Serve /metrics in the Prometheus text format from a daemon thread.
+
+  Also enables instrumentation. Returns the server; call its shutdown()
+  method to stop it.
+  """
+  enable()
+  server = HTTPServer((host, port), _MetricsHandler)
+  thread = threading.Thread(target=server.serve_forever, name='metrics-http')
+  thread.daemon = True
+  thread.start()
+  return server
+
+
+class JsonLogger(threading.Thread):
+  """Appends a JSON line with snapshot() to a file every period seconds.
+
+  Also enables instrumentation.
+  """
+
+  def __init__(self, path, period=10.0):
+    super(JsonLogger, self).__init__(name='metrics-log')
+    self.daemon = True
+    self.path = path
+    self.period = period
+    self._stop_event = threading.Event()
+    enable()
+
+  def run(self):
+    while not self._stop_event.wait(self.period):
+      self.write()
+
+  def write(self):
+    with open(self.path, 'a') as log_file:
+      log_file.write(json.dumps(snapshot()) + '\n')
+
+  def stop(self, timeout=None):
+    self._stop_event.set()
+    self.join(timeout)
+    self.write()
@@ -0,0 +1,57 @@
+"""Tests for the instrumentation layer."""
+
+import json
+
+import tensorflow as tf
+
+import metrics
+
+
+class MetricsTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(MetricsTest, self).setUp()
+    metrics.registry.reset()
+    self.addCleanup(metrics.enable, metrics.enabled)
+
+  def testDisabled(self):
+    metrics.enable(False)
+    with metrics.timer('predict'):
+      pass
+    metrics.count('patches', 3)
+    self.assertEqual({}, metrics.snapshot()['stages'])
+    self.assertEqual({}, metrics.snapshot()['counters'])
+
+  def testSnapshot(self):
+    metrics.enable()
+    for seconds in (0.001, 0.002, 0.003, 0.5):
+      metrics.observe('predict', seconds)
+    with metrics.timer('features'):
+      pass
+    metrics.count('patches', 3)
+    metrics.count('patches')
+    snapshot = json.loads(json.dumps(metrics.snapshot()))
+    self.assertEqual(4, snapshot['stages']['predict']['count'])
+    self.assertAllClose(2.5, snapshot['stages']['predict']['p50_ms'])
+    self.assertAllClose(500.0, snapshot['stages']['predict']['max_ms'])
+    self.assertEqual(1, snapshot['stages']['features']['count'])
+    self.assertEqual({'patches': 4}, snapshot['counters'])
+
+  def testPrometheusText(self):
+    metrics.enable()
+    metrics.observe('predict', 0.003)
+    metrics.observe('predict', 20.0)
+    metrics.count('dropped_windows', 2)
+    lines = metrics.prometheus_text().splitlines()
+    self.assertIn('yamnet_stage_seconds_bucket{stage="predict",le="0.0025"} 0',
+                  lines)
+    self.assertIn('yamnet_stage_seconds_bucket{stage="predict",le="0.005"} 1',
+                  lines)
+    self.assertIn('yamnet_stage_seconds_bucket{stage="predict",le="+Inf"} 2',
+                  lines)
+    self.assertIn('yamnet_stage_seconds_count{stage="predict"} 2', lines)
+    self.assertIn('yamnet_dropped_windows_total 2', lines)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,292 @@
+"""Classification of many live audio streams with one batched model call.
+
+Usage:
+  python multi_stream.py --channels 16           # a multichannel interface
+  python multi_stream.py a.wav b.wav c.wav       # files replayed as live
+  python multi_stream.py sample.wav --copies 16  # one file as 16 streams
+
+Each stream (a channel of a multichannel input or a replayed file) keeps
+its own Resampler, StreamingFeatures and ScoreHistory, so streams of
+different rates and block sizes advance independently. The model state is
+shared: on every tick MultiStreamClassifier collects the patches that all
+the streams completed and scores them in a single classify_patches_batch()
+call, so the model runs once per tick however many streams there are.
+
+Sources produce one block per stream per read():
+
+  CaptureSource     the channels of one PyAudio input device.
+  FileReplaySource  sound files, block by block, optionally paced in real
+                    time to simulate live inputs.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import queue
+import sys
+import time
+
+import numpy as np
+
+import class_map
+import metrics
+import numpy_features
+import params
+import resampling
+import score_history
+
+
+class Stream(object):
+  """The incremental state of one audio stream."""
+
+  def __init__(self, name, sr, history_length=30):
+    self.name = name
+    self.sr = sr
+    self.resampler = resampling.Resampler(sr, params.SAMPLE_RATE)
+    self.features = numpy_features.StreamingFeatures(params)
+    self.history = score_history.ScoreHistory(history_length)
+    self.num_patches = 0
+
+  def reset(self):
+    self.resampler.reset()
+    self.features.reset()
+    self.num_patches = 0
+
+  def add(self, block, final=False):
+    """Featurize a block of the stream; returns its newly complete patches."""
+    block = np.asarray(block)
+    if block.dtype == np.int16:
+      block = block / 32768.0  # Convert to [-1.0, +1.0]
+    if block.ndim > 1:
+      block = np.mean(block, axis=1)
+    if self.sr == params.SAMPLE_RATE:
+      waveform = block
+    else:
+      with metrics.timer('resample'):
+        waveform = self.resampler.process(block, final=final)
+    with metrics.timer('features'):
+      return self.features.add(waveform)
+
+
+class MultiStreamClassifier(object):
+  """Scores the patches of several streams together, once per tick.
+
+  Args:
+    names: Stream names, one per stream.
+    rates: Sample rate of each stream, or one rate for all of them.
+    classifier: A YamnetClassifier (whose SilenceGate, if any, is bypassed:
+      its state is per stream), an inference_server.InferenceClient or
+      anything else with classify_patches_batch(). By default the shared
+      classifier, built on first use.
+    history_length: Number of patch scores kept per stream.
+  """
+
+  def __init__(self, names, rates=44100, classifier=None, history_length=30):
+    if np.ndim(rates) == 0:
+      rates = [rates] * len(names)
+    self.streams = [Stream(name, sr, history_length)
+                    for (name, sr) in zip(names, rates)]
+    self._classifier = classifier
+    self.ticks = 0
+
+  @property
+  def classifier(self):
+    if self._classifier is None:
+      import inference
+      self._classifier = inference.get_classifier()
+    return self._classifier
+
+  def reset(self):
+    for stream in self.streams:
+      stream.reset()
+
+  def add(self, blocks, final=False):
+    """Feed one block per stream (None or empty for no new audio).
+
+    Args:
+      blocks: Float waveforms in [-1.0, +1.0] or int16 samples, mono or
+        (frames, channels), in stream order.
+      final: Whether the streams end with these blocks.
+
+    Returns:
+      A list with the (num_new_patches, num_classes) scores of each stream,
+      also appended to the streams' histories.
+    """
+    patches = [stream.add(np.zeros(0) if block is None else block, final)
+               for (stream, block) in zip(self.streams, blocks)]
+    self.ticks += 1
+    if not any(len(stream_patches) for stream_patches in patches):
+      return [np.zeros((0, params.NUM_CLASSES), dtype=np.float32)
+              for _ in self.streams]
+    with metrics.timer('multi_stream_predict'):
+      scores = self.classifier.classify_patches_batch(patches)
+    for (stream, stream_scores) in zip(self.streams, scores):
+      stream.num_patches += len(stream_scores)
+      for patch_scores in stream_scores:
+        stream.history.append(patch_scores)
+    return scores
+
+  def run(self, source, callback=None):
+    """Classify a source's blocks until it ends.
+
+    callback, if given, is called with the list of per-stream scores of
+    each tick.
+    """
+    while True:
+      blocks = source.read()
+      if blocks is None:
+        scores = self.add([None] * len(self.streams), final=True)
+      else:
+        scores = self.add(blocks)
+      if callback is not None:
+        callback(scores)
+      if blocks is None:
+        return
+
+
+class FileReplaySource(object):
+  """Replays sound files block by block as if they were live inputs.
+
+  Args:
+    paths: One file per stream.
+    block_seconds: Audio per stream and read().
+    realtime: Whether read() waits until the block would have been recorded,
+      or returns immediately (e.g. for tests and throughput measurements).
+    copies: Number of streams per file.
+  """
+
+  def __init__(self, paths, block_seconds=0.5, realtime=True, copies=1):
+    import soundfile as sf
+    self._files = [sf.SoundFile(path) for path in paths]
+    self.names = ['{}#{}'.format(path, copy) if copies > 1 else path
+                  for path in paths for copy in range(copies)]
+    self.rates = [sound_file.samplerate for sound_file in self._files
+                  for _ in range(copies)]
+    self.copies = copies
+    self.block_seconds = block_seconds
+    self.realtime = realtime
+    self._start = None
+    self._reads = 0
+
+  def read(self):
+    """The next block of each stream, or None when all the files ended."""
+    if self.realtime:
+      if self._start is None:
+        self._start = time.time()
+      wait = self._start + self._reads * self.block_seconds - time.time()
+      if wait > 0:
+        time.sleep(wait)
+    self._reads += 1
+    blocks = []
+    for sound_file in self._files:
+      block = sound_file.read(
+        int(round(self.block_seconds * sound_file.samplerate)),
+        dtype='float32')
+      blocks.extend([block] * self.copies)
+    if not any(len(block) for block in blocks):
+      self.close()
+      return None
+    return blocks
+
+  def close(self):
+    for sound_file in self._files:
+      sound_file.close()
+
+
+class CaptureSource(object):
+  """Captures the channels of one multichannel input as separate streams.
+
+  The PyAudio callback only queues the raw blocks; read() waits for at
+  least one block and returns everything captured since the last read,
+  one column of samples per channel.
+  """
+
+  def __init__(self, channels, rate=44100, frames_per_buffer=1024,
+               device_index=None):
+    import pyaudio
+    self.names = ['channel {}'.format(channel) for channel in range(channels)]
+    self.rates = [rate] * channels
+    self.channels = channels
+    self._blocks = queue.Queue()
+    self._pa = pyaudio.PyAudio()
+    self._stream = self._pa.open(format=pyaudio.paInt16,
+                                 channels=channels,
+                                 rate=rate,
+                                 input=True,
+                                 input_device_index=device_index,
+                                 frames_per_buffer=frames_per_buffer,
+                                 stream_callback=self._callback)
+    self._stream.start_stream()
+
+  def _callback(self, in_data, frame_count, time_info, status):
+    import pyaudio
+    self._blocks.put(in_data)
+    metrics.count('captured_frames', frame_count)
+    if status:
+      metrics.count('capture_overflows')
+    return None, pyaudio.paContinue
+
+  def read(self):
+    data = [self._blocks.get()]
+    while True:
+      try:
+        data.append(self._blocks.get_nowait())
+      except queue.Empty:
+        break
+    frames = np.frombuffer(b''.join(data), dtype=np.int16).reshape(
+      -1, self.channels)
+    return [frames[:, channel] for channel in range(self.channels)]
+
+  def close(self):
+    self._stream.close()
+    self._pa.terminate()
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+    description='Classify several audio streams at once.')
+  parser.add_argument('files', nargs='*',
+                      help='Sound files to replay as live streams.')
+  parser.add_argument('--copies', type=int, default=1,
+                      help='Streams per replayed file.')
+  parser.add_argument('--fast', action='store_true',
+                      help='Replay the files as fast as possible.')
+  parser.add_argument('--channels', type=int,
+                      help='Capture this many channels from the microphone.')
+  parser.add_argument('--device', type=int, help='PyAudio input device.')
+  parser.add_argument('--weights',
+                      help='HDF5 weights or SavedModel directory.')
+  args = parser.parse_args(argv)
+  if args.channels:
+    source = CaptureSource(args.channels, device_index=args.device)
+  elif args.files:
+    source = FileReplaySource(args.files, realtime=not args.fast,
+                              copies=args.copies)
+  else:
+    parser.error('Give sound files to replay or --channels to capture.')
+
+  import inference
+  engine = MultiStreamClassifier(source.names, source.rates,
+                                 inference.create_classifier(args.weights))
+  classes = class_map.class_names('yamnet_class_map.csv')
+
+  def report(scores):
+    if not any(len(stream_scores) for stream_scores in scores):
+      return
+    print('\n'.join('{:24s} {}'.format(stream.name,
+                                       classes[stream.history.top(1)[0]])
+                    for stream in engine.streams) + '\n')
+
+  start = time.time()
+  try:
+    engine.run(source, report)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    source.close()
+  print('{} streams, {} ticks, {:.1f} s'.format(
+    len(engine.streams), engine.ticks, time.time() - start), file=sys.stderr)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,99 @@
+"""Tests for the multi-stream classifier."""
+
+import os
+
+import numpy as np
+import soundfile as sf
+import tensorflow as tf
+
+import inference_server
+from fake_classifier import FakeClassifier
+import multi_stream
+import numpy_features
+import params
+import resampling
+
+
+def expected_scores(waveform, sr):
+  """The fake scores of a whole waveform, classified in one go."""
+  waveform = resampling.resample(waveform, sr, params.SAMPLE_RATE)
+  return FakeClassifier().classify_patches_batch(
+    [numpy_features.waveform_to_patches(waveform, params)])[0]
+
+
+class MultiStreamTest(tf.test.TestCase):
+
+  def testOneModelCallPerTick(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    rates = [44100, 16000, 48000]
+    waveforms = [np.random.uniform(-1.0, +1.0, int(4.2 * sr)) for sr in rates]
+    classifier = FakeClassifier()
+    engine = multi_stream.MultiStreamClassifier(
+      ['a', 'b', 'c'], rates, classifier, history_length=100)
+    scores = [[] for _ in rates]
+    for tick in range(10):
+      blocks = [waveform[tick * len(waveform) // 10:
+                         (tick + 1) * len(waveform) // 10]
+                for waveform in waveforms]
+      for (stream_scores, new) in zip(scores, engine.add(blocks,
+                                                         final=tick == 9)):
+        stream_scores.append(new)
+    self.assertLessEqual(len(classifier.calls), 10)
+    for (stream, stream_scores, waveform, sr) in zip(
+        engine.streams, scores, waveforms, rates):
+      stream_scores = np.concatenate(stream_scores)
+      self.assertAllClose(expected_scores(waveform, sr), stream_scores,
+                          atol=1e-5)
+      self.assertEqual(len(stream_scores), stream.num_patches)
+      self.assertAllClose(stream_scores[-1], stream.history.latest())
+
+  def testFileReplay(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    paths = []
+    for (i, sr) in enumerate([44100, 22050]):
+      paths.append(os.path.join(self.get_temp_dir(), '{}.wav'.format(i)))
+      sf.write(paths[-1], np.random.uniform(-1.0, +1.0, int(2.5 * sr)), sr,
+               subtype='FLOAT')
+    source = multi_stream.FileReplaySource(paths, block_seconds=0.3,
+                                           realtime=False, copies=2)
+    self.assertEqual([44100, 44100, 22050, 22050], source.rates)
+    classifier = FakeClassifier()
+    engine = multi_stream.MultiStreamClassifier(source.names, source.rates,
+                                                classifier)
+    scores = []
+    engine.run(source, scores.append)
+    self.assertLessEqual(len(classifier.calls), len(scores))
+    for i in range(len(engine.streams)):
+      waveform, sr = sf.read(paths[i // 2], dtype='float32')
+      self.assertAllClose(expected_scores(waveform, sr),
+                          np.concatenate([tick[i] for tick in scores]),
+                          atol=1e-5)
+
+  def testInferenceClient(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    classifier = FakeClassifier()
+    server = inference_server.serve(classifier, port=0, max_latency=0.5)
+    try:
+      client = inference_server.InferenceClient(
+        'http://127.0.0.1:{}'.format(server.server_address[1]))
+      rates = [44100, 16000, 16000]
+      # The third stream completes no patch.
+      waveforms = [np.random.uniform(-1.0, +1.0, int(seconds * sr))
+                   for (seconds, sr) in zip([2.5, 3.0, 0.5], rates)]
+      engine = multi_stream.MultiStreamClassifier(['a', 'b', 'c'], rates,
+                                                  client)
+      scores = engine.add(waveforms, final=True)
+      # The requests of the tick were scored in one model call.
+      self.assertEqual(1, len(classifier.calls))
+      self.assertEqual((0, params.NUM_CLASSES), scores[2].shape)
+      for (stream_scores, waveform, sr) in zip(scores[:2], waveforms, rates):
+        self.assertAllClose(expected_scores(waveform, sr), stream_scores,
+                            atol=1e-5)
+    finally:
+      server.shutdown()
+      server.server_close()
+      server.batcher.stop()
+
+
+if __name__ == '__main__':
+  tf.test.main()
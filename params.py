@@ -32,6 +32,7 @@ PATCH_HOP_SECONDS = 0.48
 PATCH_FRAMES = int(round(PATCH_WINDOW_SECONDS / STFT_HOP_SECONDS))
 PATCH_BANDS = MEL_BANDS
 NUM_CLASSES = 521
+EMBEDDING_SIZE = 1024
 CONV_PADDING = 'same'
 BATCHNORM_CENTER = True
 BATCHNORM_SCALE = False
@@ -39,4 +40,5 @@ BATCHNORM_EPSILON = 1e-4
 CLASSIFIER_ACTIVATION = 'sigmoid'
 
 FEATURES_LAYER_NAME = 'features'
+EMBEDDINGS_LAYER_NAME = 'embeddings'
 EXAMPLE_PREDICTIONS_LAYER_NAME = 'predictions'
@@ -0,0 +1,81 @@
+"""Content-addressed LRU cache of YAMNet patch outputs.
+
+Live sliding windows and reprocessed archives present the same 0.96 s
+patches to the model again and again. PatchCache remembers the embedding
+and class scores of recently scored patches, keyed by a hash of the patch
+contents, so that the Mobilenet trunk only runs on patches it has not seen.
+"""
+
+import collections
+import hashlib
+import threading
+
+import numpy as np
+
+import params
+
+
+class PatchCache(object):
+  """Bounded LRU map from patch content hash to (embedding, scores).
+
+  The size of the cache is given as a memory budget in bytes, which is
+  converted into a maximum number of entries using the size of one stored
+  embedding and score vector. Lookups are counted in hits and misses.
+  """
+
+  def __init__(self, max_bytes=64 * 1024 * 1024):
+    self.entry_bytes = 4 * (params.EMBEDDING_SIZE + params.NUM_CLASSES)
+    self.max_entries = max(1, max_bytes // self.entry_bytes)
+    self.hits = 0
+    self.misses = 0
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def key(patch):
+    """Return the cache key of a (num_frames, num_bands) patch or waveform."""
+    patch = np.ascontiguousarray(patch, dtype=np.float32)
+    return hashlib.blake2b(patch.tobytes(), digest_size=16).digest()
+
+  def get(self, key):
+    """Return the cached (embedding, scores) for key, or None."""
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        self.misses += 1
+        return None
+      self._entries.move_to_end(key)
+      self.hits += 1
+      return entry
+
+  def put(self, key, embedding, scores):
+    """Store the outputs for key, evicting the least recently used entry."""
+    entry = (np.array(embedding, dtype=np.float32),
+             np.array(scores, dtype=np.float32))
+    with self._lock:
+      self._entries[key] = entry
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.hits = 0
+      self.misses = 0
+
+  def __len__(self):
+    with self._lock:
+      return len(self._entries)
+
+  def stats(self):
+    """Return the hit/miss counters and current size of the cache."""
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+          'hits': self.hits,
+          'misses': self.misses,
+          'hit_rate': self.hits / lookups if lookups else 0.0,
+          'entries': len(self._entries),
+          'bytes': len(self._entries) * self.entry_bytes,
+      }
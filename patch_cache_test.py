@@ -0,0 +1,77 @@
+"""Tests for the patch output cache."""
+
+import numpy as np
+import tensorflow as tf
+
+import params
+import patch_cache
+
+
+def outputs(value):
+  return (np.full(params.EMBEDDING_SIZE, value),
+          np.full(params.NUM_CLASSES, value))
+
+
+class PatchCacheTest(tf.test.TestCase):
+
+  def testBudgetToEntries(self):
+    entry_bytes = 4 * (params.EMBEDDING_SIZE + params.NUM_CLASSES)
+    self.assertEqual(entry_bytes, patch_cache.PatchCache().entry_bytes)
+    self.assertEqual(3, patch_cache.PatchCache(3 * entry_bytes).max_entries)
+    self.assertEqual(3,
+                     patch_cache.PatchCache(4 * entry_bytes - 1).max_entries)
+    # Even a budget below one entry holds one.
+    self.assertEqual(1, patch_cache.PatchCache(0).max_entries)
+
+  def testLruEviction(self):
+    cache = patch_cache.PatchCache(
+      2 * 4 * (params.EMBEDDING_SIZE + params.NUM_CLASSES))
+    cache.put('a', *outputs(1))
+    cache.put('b', *outputs(2))
+    cache.get('a')  # Now 'b' is the least recently used.
+    cache.put('c', *outputs(3))
+    self.assertEqual(2, len(cache))
+    self.assertIsNone(cache.get('b'))
+    self.assertAllEqual(outputs(1)[1], cache.get('a')[1])
+    self.assertAllEqual(outputs(3)[0], cache.get('c')[0])
+    # Overwriting a key refreshes it.
+    cache.put('a', *outputs(4))
+    cache.put('d', *outputs(5))
+    self.assertIsNone(cache.get('c'))
+    self.assertAllEqual(outputs(4)[1], cache.get('a')[1])
+
+  def testCounters(self):
+    cache = patch_cache.PatchCache()
+    cache.put('a', *outputs(1))
+    cache.get('a')
+    cache.get('a')
+    cache.get('b')
+    stats = cache.stats()
+    self.assertEqual(2, stats['hits'])
+    self.assertEqual(1, stats['misses'])
+    self.assertAllClose(2 / 3, stats['hit_rate'])
+    self.assertEqual(1, stats['entries'])
+    self.assertEqual(cache.entry_bytes, stats['bytes'])
+    cache.clear()
+    self.assertEqual({'hits': 0, 'misses': 0, 'hit_rate': 0.0,
+                      'entries': 0, 'bytes': 0}, cache.stats())
+
+  def testKeyStability(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    patch = np.random.uniform(
+      -5.0, 0.0, (params.PATCH_FRAMES, params.PATCH_BANDS))
+    key = patch_cache.PatchCache.key(patch)
+    # The key depends on the float32 contents only, not on the dtype or
+    # memory layout of the array.
+    self.assertEqual(key, patch_cache.PatchCache.key(patch.copy()))
+    self.assertEqual(key, patch_cache.PatchCache.key(
+      patch.astype(np.float32)))
+    self.assertEqual(key, patch_cache.PatchCache.key(
+      np.asfortranarray(patch)))
+    self.assertEqual(16, len(key))
+    patch[0, 0] += 1.0
+    self.assertNotEqual(key, patch_cache.PatchCache.key(patch))
+
+
+if __name__ == '__main__':
+  tf.test.main()
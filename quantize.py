@@ -0,0 +1,275 @@
+"""Post-training quantized YAMNet for CPU inference.
+
+The float32 Keras model is converted with the TFLite converter into an int8
+(or float16) model and run with the TFLite interpreter, which needs less
+memory and is considerably faster on CPU-only machines. The log mel feature
+frontend is unchanged, so QuantizedYamnetClassifier is a drop-in replacement
+for inference.YamnetClassifier.
+
+Usage:
+  python quantize.py --mode int8 --output yamnet_int8.tflite
+
+converts yamnet.h5, writes the quantized model and reports its accuracy,
+latency and resident memory against the float model. The int8 activation
+ranges are calibrated on calibration_waveforms() and the accuracy is
+measured on the separate evaluation_waveforms(), so it reflects audio the
+calibration has not seen.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+import tensorflow as tf
+
+import inference
+import params
+import yamnet as yamnet_model
+
+QUANTIZATION_MODES = ('int8', 'float16', 'dynamic')
+
+
+def calibration_waveforms(seed=1234, num_clips=8):
+  """Synthetic 16 kHz clips for calibrating the int8 activation ranges.
+
+  Noise, tones and sweeps of random levels and frequencies, generated from
+  their own seed so that none of them is among evaluation_waveforms().
+  """
+  num_samples = int(3 * params.SAMPLE_RATE)
+  random_state = np.random.RandomState(seed)
+  t = np.arange(num_samples) / params.SAMPLE_RATE
+  waveforms = []
+  for i in range(num_clips):
+    level = 10 ** random_state.uniform(-3, 0)
+    kind = i % 3
+    if kind == 0:
+      waveform = random_state.uniform(-1.0, +1.0, num_samples)
+    elif kind == 1:
+      waveform = np.sin(2 * np.pi * random_state.uniform(50, 7000) * t)
+    else:
+      (low, high) = np.sort(random_state.uniform(50, 7000, 2))
+      waveform = np.sin(2 * np.pi * (low * t + (high - low) * t ** 2 / 6))
+    waveforms.append(level * waveform)
+  return waveforms
+
+
+def evaluation_waveforms(seed=51773):
+  """The synthetic clips of yamnet_test.py plus sample.wav, at 16 kHz."""
+  num_samples = int(3 * params.SAMPLE_RATE)
+  random_state = np.random.RandomState(seed)
+  waveforms = [
+      np.zeros(num_samples),
+      random_state.uniform(-1.0, +1.0, num_samples),
+      np.sin(2 * np.pi * 440 * np.linspace(0, 3, num_samples)),
+  ]
+  wav_data, sr = sf.read('sample.wav', dtype=np.int16)
+  if len(wav_data):
+    waveforms.append(
+      inference.YamnetClassifier.preprocess(wav_data / 32768.0, sr))
+  return waveforms
+
+
+def convert(weights='yamnet.h5', mode='int8', calibration=None):
+  """Convert the YAMNet patches model into a quantized TFLite model.
+
+  Args:
+    weights: The Keras HDF5 weights file.
+    mode: 'int8' for full integer quantization of weights and activations,
+      'float16' for float16 weights, or 'dynamic' for int8 weights with
+      float activations.
+    calibration: 16 kHz waveforms used to calibrate the int8 activation
+      ranges. Defaults to calibration_waveforms(); representative field
+      audio gives better ranges. Keep it apart from the audio the accuracy
+      is measured on.
+
+  Returns:
+    The serialized TFLite flatbuffer.
+  """
+  if mode not in QUANTIZATION_MODES:
+    raise ValueError('Unknown quantization mode: {}'.format(mode))
+  yamnet = yamnet_model.yamnet_patches_model()
+  yamnet.load_weights(weights)
+  converter = tf.lite.TFLiteConverter.from_keras_model(yamnet)
+  converter.optimizations = [tf.lite.Optimize.DEFAULT]
+  if mode == 'float16':
+    converter.target_spec.supported_types = [tf.float16]
+  elif mode == 'int8':
+    if calibration is None:
+      calibration = calibration_waveforms()
+    features = yamnet_model.yamnet_features_model(params)
+    patches = np.concatenate([
+      features.predict(np.reshape(waveform, [1, -1]), steps=1)
+      for waveform in calibration])
+
+    def representative_dataset():
+      for patch in patches:
+        yield [patch[np.newaxis].astype(np.float32)]
+    converter.representative_dataset = representative_dataset
+  return converter.convert()
+
+
+class QuantizedYamnetClassifier(inference.YamnetClassifier):
+  """A YamnetClassifier that runs a quantized TFLite model.
+
+  weights may be the Keras HDF5 weights, which are converted on load, or a
+  .tflite file previously written by this module.
+  """
+
+  def __init__(self, weights='yamnet.h5', mode='int8', num_threads=None,
+               batch_size=64, cache=None, fused=True, gate=None):
+    # fused is accepted for the signature of YamnetClassifier; the TFLite
+    # converter folds the batch norms itself.
+    self.mode = mode
+    self.num_threads = num_threads
+    super(QuantizedYamnetClassifier, self).__init__(
+      weights, batch_size=batch_size, cache=cache, fused=fused, gate=gate)
+
+  def _build_model(self, weights):
+    if weights.endswith('.tflite'):
+      with open(weights, 'rb') as model_file:
+        model_content = model_file.read()
+    else:
+      model_content = convert(weights, self.mode)
+    interpreter = tf.lite.Interpreter(model_content=model_content,
+                                      num_threads=self.num_threads)
+    self._input_index = interpreter.get_input_details()[0]['index']
+    for output in interpreter.get_output_details():
+      if output['shape'][-1] == params.NUM_CLASSES:
+        self._scores_index = output['index']
+      else:
+        self._embeddings_index = output['index']
+    self._allocated_batch_size = None
+    return interpreter
+
+  def _predict_batch(self, patches):
+    # The interpreter only needs re-allocating when the batch size changes.
+    if len(patches) != self._allocated_batch_size:
+      self._yamnet.resize_tensor_input(
+        self._input_index,
+        [len(patches), params.PATCH_FRAMES, params.PATCH_BANDS])
+      self._yamnet.allocate_tensors()
+      self._allocated_batch_size = len(patches)
+    self._yamnet.set_tensor(self._input_index,
+                            np.asarray(patches, dtype=np.float32))
+    self._yamnet.invoke()
+    return (self._yamnet.get_tensor(self._scores_index),
+            self._yamnet.get_tensor(self._embeddings_index))
+
+
+def compare(reference, candidate, waveforms, top_n=10):
+  """Compare the per-patch scores of two classifiers on 16 kHz waveforms.
+
+  Returns:
+    A dict with the maximum and mean absolute score error, the fraction of
+    patches whose top class agrees, and the mean overlap of the top_n
+    classes.
+  """
+  patches = np.concatenate([reference.waveform_to_patches(waveform)
+                            for waveform in waveforms])
+  expected = reference.classify_patches(patches)
+  actual = candidate.classify_patches(patches)
+  expected_top = np.argsort(expected, axis=1)[:, -top_n:]
+  actual_top = np.argsort(actual, axis=1)[:, -top_n:]
+  return {
+      'max_abs_error': float(np.max(np.abs(expected - actual))),
+      'mean_abs_error': float(np.mean(np.abs(expected - actual))),
+      'top1_agreement': float(np.mean(
+        expected_top[:, -1] == actual_top[:, -1])),
+      'top{}_overlap'.format(top_n): float(np.mean([
+        len(np.intersect1d(e, a)) / top_n
+        for (e, a) in zip(expected_top, actual_top)])),
+  }
+
+
+def _patches_per_second(classifier, patches, repeats=5):
+  start = time.time()
+  for _ in range(repeats):
+    classifier.classify_patches(patches)
+  return repeats * len(patches) / (time.time() - start)
+
+
+# Run in a fresh interpreter, so that each classifier's memory is measured on
+# its own.
+_RESIDENT_SCRIPT = '''
+import json, resource, sys
+import numpy as np
+import inference, params, quantize
+if sys.argv[2] == 'float32':
+  classifier = inference.YamnetClassifier(sys.argv[1])
+else:
+  classifier = quantize.QuantizedYamnetClassifier(sys.argv[1], mode=sys.argv[2])
+classifier.classify_patches(
+  np.zeros((64, params.PATCH_FRAMES, params.PATCH_BANDS), dtype=np.float32))
+try:
+  # VmHWM starts afresh at exec, while ru_maxrss on Linux also covers the
+  # parent process this one was forked from.
+  with open('/proc/self/status') as status:
+    peak = [int(line.split()[1]) for line in status
+            if line.startswith('VmHWM:')][0] / 1024
+except (IOError, OSError):
+  # ru_maxrss is in bytes on macOS.
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024)
+print(json.dumps(peak))
+'''
+
+
+def resident_mb(weights, mode):
+  """Peak RSS in MB of a process that loads a classifier and scores a batch.
+
+  mode is 'float32' for inference.YamnetClassifier, or the quantization mode
+  of a QuantizedYamnetClassifier (best given a .tflite file, so that the
+  conversion is not counted).
+  """
+  output = subprocess.check_output(
+    [sys.executable, '-c', _RESIDENT_SCRIPT, weights, mode],
+    stderr=subprocess.DEVNULL,
+    cwd=os.path.dirname(os.path.abspath(__file__)))
+  return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--weights', default='yamnet.h5')
+  parser.add_argument('--mode', choices=QUANTIZATION_MODES, default='int8')
+  parser.add_argument('--output', help='Where to write the .tflite model.')
+  args = parser.parse_args()
+
+  model_content = convert(args.weights, args.mode)
+  weights = args.output
+  if not weights:
+    (handle, weights) = tempfile.mkstemp(suffix='.tflite')
+    os.close(handle)
+  try:
+    with open(weights, 'wb') as model_file:
+      model_file.write(model_content)
+    reference = inference.YamnetClassifier(args.weights)
+    candidate = QuantizedYamnetClassifier(weights, mode=args.mode)
+
+    waveforms = evaluation_waveforms()
+    for (name, value) in sorted(
+        compare(reference, candidate, waveforms).items()):
+      print('{:16s}: {:.4f}'.format(name, value))
+    patches = np.concatenate([reference.waveform_to_patches(waveform)
+                              for waveform in waveforms])
+    print('{:16s}: {:.1f} kB'.format('model size', len(model_content) / 1024))
+    print('{:16s}: {:.1f} patches/s, {:.0f} MB resident'.format(
+      'float32', _patches_per_second(reference, patches),
+      resident_mb(args.weights, 'float32')))
+    print('{:16s}: {:.1f} patches/s, {:.0f} MB resident'.format(
+      args.mode, _patches_per_second(candidate, patches),
+      resident_mb(weights, args.mode)))
+  finally:
+    if not args.output:
+      os.remove(weights)
+
+
+if __name__ == '__main__':
+  main()
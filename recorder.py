@@ -13,10 +13,27 @@ Non-blocking mode (start and stop recording):
 ...     recfile2.start_recording()
 ...     time.sleep(5.0)
 ...     recfile2.stop_recording()
+
+Streaming mode (keep the latest audio in memory, no file round trip):
+>>> rec = Recorder(channels=1)
+>>> with rec.stream(seconds=10.0) as stream:
+...     stream.start_recording()
+...     time.sleep(5.0)
+...     waveform = stream.latest(rec.rate)  # last second as int16 view
 '''
-import pyaudio
+import queue
+import threading
 import wave
 
+import numpy as np
+try:
+    import pyaudio
+except ImportError:
+    # Only the recorders need PyAudio; RingBuffer works without it
+    pyaudio = None
+
+import metrics
+
 class Recorder(object):
     '''A recorder class for recording audio to a WAV file.
     Records in mono by default.
@@ -31,6 +48,10 @@ class Recorder(object):
         return RecordingFile(fname, mode, self.channels, self.rate,
                             self.frames_per_buffer)
 
+    def stream(self, seconds=10.0, archive=None):
+        return RecordingStream(seconds, archive, self.channels, self.rate,
+                               self.frames_per_buffer)
+
 class RecordingFile(object):
     def __init__(self, fname, mode, channels, 
                 rate, frames_per_buffer):
@@ -94,3 +115,132 @@ class RecordingFile(object):
         wavefile.setsampwidth(self._pa.get_sample_size(pyaudio.paInt16))
         wavefile.setframerate(self.rate)
         return wavefile
+
+
+class RingBuffer(object):
+    '''A preallocated ring buffer of int16 audio frames.
+
+    Every block is stored twice, at its ring position and again one
+    capacity further on, so the latest `capacity` frames are always
+    contiguous and can be handed out as a NumPy view without copying.
+    There is a single writer, which only advances `written` once the data
+    is in place, so readers need no lock. A view is only valid until the
+    writer wraps around onto it, so keep the capacity comfortably larger
+    than the windows being read.
+    '''
+
+    def __init__(self, capacity, channels=1):
+        self.capacity = capacity
+        self.channels = channels
+        self.written = 0
+        self._buffer = np.zeros((2 * capacity, channels), dtype=np.int16)
+
+    def write(self, frames):
+        frames = frames.reshape(-1, self.channels)
+        count = len(frames)
+        if count > self.capacity:
+            frames = frames[-self.capacity:]
+        start = (self.written + count - len(frames)) % self.capacity
+        end = start + len(frames)
+        self._buffer[start:end] = frames
+        if end <= self.capacity:
+            self._buffer[start + self.capacity:end + self.capacity] = frames
+        else:
+            split = self.capacity - start
+            self._buffer[start + self.capacity:] = frames[:split]
+            self._buffer[:end - self.capacity] = frames[split:]
+        self.written += count
+
+    def latest(self, count):
+        '''Return a view of the most recent `count` frames (fewer if the
+        buffer has not been filled that far yet).'''
+        count = min(count, self.capacity, self.written)
+        end = self.written % self.capacity + self.capacity
+        view = self._buffer[end - count:end]
+        if self.channels == 1:
+            return view[:, 0]
+        return view
+
+
+class RecordingStream(object):
+    '''Records continuously into a RingBuffer instead of a WAV file.
+
+    The stream stays open between reads, so capture is gapless and there is
+    no filesystem I/O on the hot path. If `archive` names a WAV file, the
+    raw blocks are also queued to a background thread that writes them out.
+    '''
+
+    def __init__(self, seconds, archive, channels, rate, frames_per_buffer):
+        self.channels = channels
+        self.rate = rate
+        self.frames_per_buffer = frames_per_buffer
+        self.buffer = RingBuffer(int(seconds * rate), channels)
+        self._pa = pyaudio.PyAudio()
+        self._stream = None
+        self._archive = None
+        self._archive_queue = None
+        self._archive_thread = None
+        if archive is not None:
+            self._archive = self._prepare_file(archive)
+            self._archive_queue = queue.Queue()
+            self._archive_thread = threading.Thread(target=self._write_archive)
+            self._archive_thread.daemon = True
+            self._archive_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception, value, traceback):
+        self.close()
+
+    def start_recording(self):
+        self._stream = self._pa.open(format=pyaudio.paInt16,
+                                        channels=self.channels,
+                                        rate=self.rate,
+                                        input=True,
+                                        frames_per_buffer=self.frames_per_buffer,
+                                        stream_callback=self.get_callback())
+        self._stream.start_stream()
+        return self
+
+    def stop_recording(self):
+        self._stream.stop_stream()
+        return self
+
+    def get_callback(self):
+        def callback(in_data, frame_count, time_info, status):
+            with metrics.timer('capture'):
+                self.buffer.write(np.frombuffer(in_data, dtype=np.int16))
+                if self._archive_queue is not None:
+                    self._archive_queue.put(in_data)
+            metrics.count('captured_frames', frame_count)
+            if status:
+                metrics.count('capture_overflows')
+            return None, pyaudio.paContinue
+        return callback
+
+    def latest(self, frames):
+        return self.buffer.latest(frames)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+        self._pa.terminate()
+        if self._archive_thread is not None:
+            self._archive_queue.put(None)
+            self._archive_thread.join()
+            self._archive.close()
+
+    def _write_archive(self):
+        while True:
+            in_data = self._archive_queue.get()
+            if in_data is None:
+                break
+            self._archive.writeframes(in_data)
+
+    def _prepare_file(self, fname, mode='wb'):
+        wavefile = wave.open(fname, mode)
+        wavefile.setnchannels(self.channels)
+        wavefile.setsampwidth(self._pa.get_sample_size(pyaudio.paInt16))
+        wavefile.setframerate(self.rate)
+        return wavefile
@@ -0,0 +1,55 @@
+"""Tests for the capture ring buffer."""
+
+import numpy as np
+import tensorflow as tf
+
+import recorder
+
+
+class RingBufferTest(tf.test.TestCase):
+
+  def testLatestBeforeFull(self):
+    ring = recorder.RingBuffer(10)
+    self.assertEqual(0, len(ring.latest(4)))
+    ring.write(np.arange(3, dtype=np.int16))
+    self.assertAllEqual([0, 1, 2], ring.latest(4))
+    self.assertAllEqual([1, 2], ring.latest(2))
+
+  def testWraparound(self):
+    ring = recorder.RingBuffer(10)
+    stream = np.arange(1000, dtype=np.int16)
+    written = 0
+    for size in [3, 7, 4, 9, 1, 10, 6, 8, 2, 5]:
+      ring.write(stream[written:written + size])
+      written += size
+      self.assertEqual(written, ring.written)
+      for count in [1, 5, 10]:
+        self.assertAllEqual(stream[max(0, written - count):written],
+                            ring.latest(count))
+
+  def testWriteLargerThanCapacity(self):
+    ring = recorder.RingBuffer(10)
+    ring.write(np.arange(4, dtype=np.int16))
+    ring.write(np.arange(100, 125, dtype=np.int16))
+    self.assertEqual(29, ring.written)
+    self.assertAllEqual(np.arange(115, 125), ring.latest(10))
+    self.assertAllEqual(np.arange(115, 125), ring.latest(20))
+    ring.write(np.arange(200, 203, dtype=np.int16))
+    self.assertAllEqual(np.concatenate([np.arange(118, 125),
+                                        np.arange(200, 203)]),
+                        ring.latest(10))
+
+  def testMirroredViewIsContiguous(self):
+    ring = recorder.RingBuffer(8, channels=2)
+    frames = np.arange(2 * 13, dtype=np.int16).reshape(-1, 2)
+    ring.write(frames[:5])
+    ring.write(frames[5:])  # Wraps around the end of the ring.
+    view = ring.latest(8)
+    self.assertEqual((8, 2), view.shape)
+    self.assertTrue(view.flags['C_CONTIGUOUS'])
+    self.assertTrue(np.shares_memory(view, ring._buffer))
+    self.assertAllEqual(frames[-8:], view)
+
+
+if __name__ == '__main__':
+  tf.test.main()
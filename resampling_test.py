@@ -0,0 +1,55 @@
+"""Tests for the polyphase resampler."""
+
+import numpy as np
+import tensorflow as tf
+
+import params
+import resampling
+
+
+class ResamplingTest(tf.test.TestCase):
+
+  def testSine(self):
+    t = np.arange(2 * 44100) / 44100
+    resampled = resampling.resample(np.sin(2 * np.pi * 1000 * t), 44100)
+    self.assertEqual(2 * params.SAMPLE_RATE, len(resampled))
+    t = np.arange(len(resampled)) / params.SAMPLE_RATE
+    # Away from the edges, where the signal is cut off.
+    self.assertAllClose(np.sin(2 * np.pi * 1000 * t)[500:-500],
+                        resampled[500:-500], atol=1e-4)
+
+  def testStreamingMatchesOneShot(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    waveform = np.random.uniform(-1.0, +1.0, 3 * 44100)
+    for quality in resampling.QUALITIES:
+      resampler = resampling.Resampler(44100, quality=quality)
+      block_edges = np.cumsum(np.random.randint(1, 5000, size=100))
+      blocks = np.split(waveform, block_edges[block_edges < len(waveform)])
+      streamed = np.concatenate(
+        [resampler.process(block) for block in blocks] +
+        [resampler.process(np.zeros(0), final=True)])
+      self.assertAllClose(
+        resampling.resample(waveform, 44100, quality=quality), streamed)
+
+  def testLengthMatchesResampy(self):
+    # resampy returns floor(len(x) * sr_out / sr_in) samples.
+    for (num_samples, expected) in ((3, 1), (88237, 32013), (44100, 16000)):
+      waveform = np.ones(num_samples)
+      self.assertLen(resampling.resample(waveform, 44100), expected)
+      self.assertLen(resampling.resample_batch([waveform] * 2, 44100)[0],
+                     expected)
+      resampler = resampling.Resampler(44100)
+      self.assertLen(np.concatenate(
+        [resampler.process(waveform[:2]),
+         resampler.process(waveform[2:], final=True)]), expected)
+
+  def testBatch(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    waveforms = np.random.uniform(-1.0, +1.0, (3, 44100))
+    for (waveform, resampled) in zip(
+        waveforms, resampling.resample_batch(waveforms, 44100)):
+      self.assertAllClose(resampling.resample(waveform, 44100), resampled)
+
+
+if __name__ == '__main__':
+  tf.test.main()
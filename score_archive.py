@@ -0,0 +1,227 @@
+"""Append-only, memory-mappable archive of per-frame scores and embeddings.
+
+An archive is a directory holding:
+
+  header.json     dtype, number of classes, embedding size, frame hop and
+                  the class names (from yamnet_class_map.csv).
+  scores.bin      (num_frames, num_classes) scores, raw row-major.
+  embeddings.bin  (num_frames, embedding_size) embeddings, if archived.
+  times.bin       (num_frames,) float64 frame start times, non-decreasing.
+
+The data files are plain arrays with no header of their own, so writers
+only ever append rows to them and readers map them with np.memmap without
+loading or copying anything: a time range is a slice found by binary search
+in the time index, and a class column is a strided view. The number of
+frames is derived from the file sizes, so a writer that was interrupted in
+the middle of a row leaves a readable archive; reopening it for writing
+truncates the partial row.
+
+  with ArchiveWriter('scores.archive', dtype='float16') as archive:
+    archive.append(scores, times=times)
+
+  archive = ArchiveReader('scores.archive')
+  dogs = archive.column('Dog', *archive.time_range(start, end))
+"""
+
+from __future__ import division, print_function
+
+import json
+import os
+
+import numpy as np
+
+import class_map as class_map_lib
+import params
+
+HEADER_FILE = 'header.json'
+SCORES_FILE = 'scores.bin'
+EMBEDDINGS_FILE = 'embeddings.bin'
+TIMES_FILE = 'times.bin'
+FORMAT_VERSION = 1
+
+
+def _num_rows(path, row_bytes):
+  return os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+
+
+class ArchiveWriter(object):
+  """Appends frame scores (and optionally embeddings) to an archive.
+
+  Opening an existing archive continues it; its header is kept, so dtype,
+  embeddings and hop_seconds only apply to a new archive.
+
+  Args:
+    path: Archive directory, created if missing.
+    dtype: 'float16' or 'float32' storage type of the matrices.
+    embeddings: Whether embeddings are archived along with the scores.
+    hop_seconds: Time step between frames, used for appends without times.
+    class_map: The class map CSV whose names go in the header.
+  """
+
+  def __init__(self, path, dtype='float16', embeddings=False,
+               hop_seconds=params.PATCH_HOP_SECONDS,
+               class_map='yamnet_class_map.csv'):
+    self.path = path
+    header_path = os.path.join(path, HEADER_FILE)
+    if os.path.exists(header_path):
+      with open(header_path) as header_file:
+        self.header = json.load(header_file)
+    else:
+      if np.dtype(dtype) not in (np.float16, np.float32):
+        raise ValueError('Unsupported archive dtype: {}'.format(dtype))
+      if not os.path.isdir(path):
+        os.makedirs(path)
+      self.header = {
+          'version': FORMAT_VERSION,
+          'dtype': np.dtype(dtype).name,
+          'num_classes': params.NUM_CLASSES,
+          'embedding_size': params.EMBEDDING_SIZE if embeddings else 0,
+          'hop_seconds': hop_seconds,
+          'class_names': [str(name) for name in
+                          class_map_lib.class_names(class_map)],
+      }
+      with open(header_path, 'w') as header_file:
+        json.dump(self.header, header_file)
+    self.dtype = np.dtype(self.header['dtype'])
+
+    self._files = [(TIMES_FILE, 1, np.float64),
+                   (SCORES_FILE, self.header['num_classes'], self.dtype)]
+    if self.header['embedding_size']:
+      self._files.append(
+        (EMBEDDINGS_FILE, self.header['embedding_size'], self.dtype))
+    # Drop any rows beyond the last frame that was completely written.
+    self.num_frames = min(
+      _num_rows(os.path.join(path, name), width * np.dtype(dtype).itemsize)
+      for (name, width, dtype) in self._files)
+    self._handles = []
+    for (name, width, dtype) in self._files:
+      handle = open(os.path.join(path, name), 'ab')
+      handle.truncate(self.num_frames * width * np.dtype(dtype).itemsize)
+      self._handles.append(handle)
+    self.last_time = None
+    if self.num_frames:
+      self.last_time = float(np.memmap(
+        os.path.join(path, TIMES_FILE), dtype=np.float64, mode='r',
+        shape=(self.num_frames,))[-1])
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exception, value, traceback):
+    self.close()
+
+  def append(self, scores, embeddings=None, times=None):
+    """Append (num_frames, num_classes) scores and their embeddings.
+
+    Args:
+      scores: Score matrix of the new frames.
+      embeddings: Their (num_frames, embedding_size) embeddings; required if
+        and only if the archive stores embeddings.
+      times: Start times of the new frames (e.g. time.time() seconds or
+        seconds into a recording), not earlier than those already archived.
+        By default the frames continue hop_seconds after the last one.
+    """
+    scores = np.asarray(scores)
+    if (embeddings is None) != (not self.header['embedding_size']):
+      raise ValueError('This archive {} embeddings.'.format(
+        'stores' if self.header['embedding_size'] else 'does not store'))
+    if times is None:
+      first = 0.0 if self.last_time is None else (
+        self.last_time + self.header['hop_seconds'])
+      times = first + self.header['hop_seconds'] * np.arange(len(scores))
+    times = np.asarray(times, dtype=np.float64)
+    if len(times) != len(scores):
+      raise ValueError('Got {} times for {} frames.'.format(
+        len(times), len(scores)))
+    if not len(scores):
+      return
+    if np.any(np.diff(times) < 0) or (
+        self.last_time is not None and times[0] < self.last_time):
+      raise ValueError('Archive times must not decrease.')
+
+    rows = [times, scores] + ([embeddings] if embeddings is not None else [])
+    for ((_, width, dtype), handle, data) in zip(self._files, self._handles,
+                                                 rows):
+      handle.write(np.ascontiguousarray(
+        np.reshape(data, [len(scores), width]), dtype=dtype).tobytes())
+    for handle in self._handles:
+      handle.flush()
+    self.num_frames += len(scores)
+    self.last_time = float(times[-1])
+
+  def close(self):
+    for handle in self._handles:
+      handle.close()
+    self._handles = []
+
+
+class ArchiveReader(object):
+  """Zero-copy read access to an archive through np.memmap.
+
+  The scores, embeddings and times attributes are memory maps of the frames
+  present when the archive was opened (or last refreshed), so only the rows
+  and columns actually used are paged in.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    with open(os.path.join(path, HEADER_FILE)) as header_file:
+      self.header = json.load(header_file)
+    self.dtype = np.dtype(self.header['dtype'])
+    self.class_names = self.header['class_names']
+    self.hop_seconds = self.header['hop_seconds']
+    self.refresh()
+
+  def refresh(self):
+    """Map the frames appended since the archive was opened."""
+    num_classes = self.header['num_classes']
+    embedding_size = self.header['embedding_size']
+    row_bytes = [(TIMES_FILE, 8),
+                 (SCORES_FILE, num_classes * self.dtype.itemsize)]
+    if embedding_size:
+      row_bytes.append((EMBEDDINGS_FILE, embedding_size * self.dtype.itemsize))
+    self.num_frames = min(_num_rows(os.path.join(self.path, name), size)
+                          for (name, size) in row_bytes)
+    self.times = self._map(TIMES_FILE, np.float64, (self.num_frames,))
+    self.scores = self._map(SCORES_FILE, self.dtype,
+                            (self.num_frames, num_classes))
+    self.embeddings = None
+    if embedding_size:
+      self.embeddings = self._map(EMBEDDINGS_FILE, self.dtype,
+                                  (self.num_frames, embedding_size))
+
+  def _map(self, name, dtype, shape):
+    if not self.num_frames:
+      return np.zeros(shape, dtype=dtype)  # np.memmap refuses empty files.
+    return np.memmap(os.path.join(self.path, name), dtype=dtype, mode='r',
+                     shape=shape)
+
+  def __len__(self):
+    return self.num_frames
+
+  def class_index(self, class_name):
+    """The score column of a class, given its name or index."""
+    if isinstance(class_name, str):
+      return self.class_names.index(class_name)
+    return int(class_name)
+
+  def time_range(self, start=None, end=None):
+    """The (first, stop) frame slice bounds of the frames in [start, end)."""
+    first = 0 if start is None else int(
+      np.searchsorted(self.times, start, side='left'))
+    stop = self.num_frames if end is None else int(
+      np.searchsorted(self.times, end, side='left'))
+    return first, stop
+
+  def frames(self, start=None, end=None):
+    """(times, scores, embeddings) views of the frames in [start, end).
+
+    embeddings is None if the archive has none.
+    """
+    first, stop = self.time_range(start, end)
+    return (self.times[first:stop], self.scores[first:stop],
+            None if self.embeddings is None else self.embeddings[first:stop])
+
+  def column(self, class_name, first=0, stop=None):
+    """A strided view of one class's scores over frames [first, stop)."""
+    return self.scores[first:stop, self.class_index(class_name)]
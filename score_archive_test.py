@@ -0,0 +1,59 @@
+"""Tests for the memory-mapped score archive."""
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+import params
+import score_archive
+
+
+class ScoreArchiveTest(tf.test.TestCase):
+
+  def testAppendAndRead(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    path = os.path.join(self.get_temp_dir(), 'embeddings.archive')
+    scores = np.random.uniform(size=(30, params.NUM_CLASSES))
+    embeddings = np.random.uniform(size=(30, params.EMBEDDING_SIZE))
+    times = np.concatenate([np.arange(20) * params.PATCH_HOP_SECONDS,
+                            100.0 + np.arange(10)])
+    with score_archive.ArchiveWriter(path, dtype='float32',
+                                     embeddings=True) as archive:
+      archive.append(scores[:20], embeddings[:20])
+      archive.append(scores[20:], embeddings[20:], times[20:])
+      with self.assertRaises(ValueError):
+        archive.append(scores[:1], embeddings[:1], [0.0])
+
+    archive = score_archive.ArchiveReader(path)
+    self.assertEqual(30, len(archive))
+    self.assertIsInstance(archive.scores, np.memmap)
+    self.assertAllClose(times, archive.times)
+    self.assertAllClose(scores, archive.scores)
+    self.assertAllClose(embeddings, archive.embeddings)
+    first, stop = archive.time_range(5.0, 102.0)
+    self.assertEqual((11, 22), (first, stop))
+    self.assertAllClose(scores[11:22, 0],
+                        archive.column('Speech', first, stop))
+    self.assertAllClose(scores[20:, 3], archive.frames(start=100.0)[1][:, 3])
+
+  def testResumeAfterPartialWrite(self):
+    path = os.path.join(self.get_temp_dir(), 'scores.archive')
+    scores = np.ones((4, params.NUM_CLASSES))
+    with score_archive.ArchiveWriter(path) as archive:
+      archive.append(scores)
+    with open(os.path.join(path, score_archive.SCORES_FILE), 'ab') as f:
+      f.write(b'\0' * 100)  # An interrupted append.
+    reader = score_archive.ArchiveReader(path)
+    self.assertEqual(4, len(reader))
+    self.assertEqual(np.float16, reader.scores.dtype)
+    with score_archive.ArchiveWriter(path) as archive:
+      archive.append(2 * scores[:2])
+    reader.refresh()
+    self.assertEqual(6, len(reader))
+    self.assertAllClose(4 * params.PATCH_HOP_SECONDS, reader.times[4])
+    self.assertAllClose(2 * scores[:2], reader.scores[4:])
+
+
+if __name__ == '__main__':
+  tf.test.main()
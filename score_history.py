@@ -0,0 +1,60 @@
+"""Rolling per-class score history for the live visualizations.
+
+ScoreHistory keeps the last `length` score vectors in a preallocated
+circular float32 array with a write index, so appending is O(1) and never
+allocates, however long the history. Alongside it keeps the IIR-decayed
+ranking scores used to choose which classes to show, with a vectorized
+stable-sort top-K.
+"""
+
+import numpy as np
+
+import params
+
+
+class ScoreHistory(object):
+  """Circular (length, num_classes) history of score vectors.
+
+  Rows are stored time-major, so appending writes one contiguous row. The
+  ranking is updated as ranking = decay * ranking + scores on every append.
+  """
+
+  def __init__(self, length=30, num_classes=params.NUM_CLASSES, decay=0.9):
+    self.length = length
+    self.decay = decay
+    self.ranking = np.zeros(num_classes, dtype=np.float32)
+    self._data = np.zeros((length, num_classes), dtype=np.float32)
+    self._index = 0
+    self.count = 0
+
+  def append(self, scores):
+    """Add one (num_classes,) score vector as the newest entry."""
+    self._data[self._index] = scores
+    self._index = (self._index + 1) % self.length
+    self.count += 1
+    self.ranking *= self.decay
+    self.ranking += scores
+
+  def top(self, k):
+    """Indexes of the k best-ranked classes, best first.
+
+    Classes ranked equally come out lowest index first.
+    """
+    return np.argsort(-self.ranking, kind='stable')[:k]
+
+  def latest(self):
+    """The newest score vector."""
+    return self._data[self._index - 1]
+
+  def series(self, class_index, out=None):
+    """The history of one class, oldest first, optionally written into out."""
+    if out is None:
+      out = np.empty(self.length, dtype=np.float32)
+    split = self.length - self._index
+    out[:split] = self._data[self._index:, class_index]
+    out[split:] = self._data[:self._index, class_index]
+    return out
+
+  def window(self):
+    """A chronological (length, num_classes) copy of the whole history."""
+    return np.concatenate([self._data[self._index:], self._data[:self._index]])
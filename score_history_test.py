@@ -0,0 +1,68 @@
+"""Tests for the rolling score history."""
+
+import numpy as np
+import tensorflow as tf
+
+import score_history
+
+
+class ScoreHistoryTest(tf.test.TestCase):
+
+  def testSeriesAcrossWraparound(self):
+    history = score_history.ScoreHistory(length=4, num_classes=3)
+    self.assertAllEqual(np.zeros(4), history.series(1))
+    for step in range(1, 7):
+      history.append(np.array([step, 10 * step, 0], dtype=np.float32))
+    # Six appends to a length four history: steps 3 to 6 remain.
+    self.assertEqual(6, history.count)
+    self.assertAllEqual([30, 40, 50, 60], history.series(1))
+    out = np.empty(4, dtype=np.float32)
+    self.assertIs(out, history.series(0, out=out))
+    self.assertAllEqual([3, 4, 5, 6], out)
+    self.assertAllEqual([[3, 30, 0], [4, 40, 0], [5, 50, 0], [6, 60, 0]],
+                        history.window())
+    # Exactly full: the write index is back at the start.
+    history.append(np.array([7, 70, 0], dtype=np.float32))
+    history.append(np.array([8, 80, 0], dtype=np.float32))
+    self.assertAllEqual([5, 6, 7, 8], history.series(0))
+
+  def testLatest(self):
+    history = score_history.ScoreHistory(length=3, num_classes=2)
+    for step in range(5):
+      history.append(np.array([step, -step], dtype=np.float32))
+      self.assertAllEqual([step, -step], history.latest())
+
+  def testTopOrderingAndTies(self):
+    history = score_history.ScoreHistory(length=2, num_classes=6, decay=0.0)
+    history.append(np.array([0.1, 0.5, 0.3, 0.9, 0.5, 0.0],
+                            dtype=np.float32))
+    self.assertAllEqual([3], history.top(1))
+    # Classes 1 and 4 tie: the lower index comes first.
+    self.assertAllEqual([3, 1, 4, 2], history.top(4))
+    self.assertAllEqual([3, 1, 4, 2, 0, 5], history.top(10))
+    history.append(np.full(6, 0.2, dtype=np.float32))
+    self.assertAllEqual([0, 1, 2], history.top(3))
+
+  def testTopTiesAcrossAllClasses(self):
+    history = score_history.ScoreHistory()
+    # At startup every class is ranked 0.
+    self.assertAllEqual(np.arange(10), history.top(10))
+    scores = np.zeros(history.ranking.shape, dtype=np.float32)
+    scores[[500, 7, 300]] = [0.5, 0.5, 0.9]
+    history.append(scores)
+    self.assertAllEqual([300, 7, 500, 0, 1, 2], history.top(6))
+
+  def testRankingDecay(self):
+    history = score_history.ScoreHistory(length=2, num_classes=2, decay=0.5)
+    history.append(np.array([1.0, 0.0], dtype=np.float32))
+    history.append(np.array([0.0, 0.8], dtype=np.float32))
+    self.assertAllClose([0.5, 0.8], history.ranking)
+    self.assertAllEqual([1, 0], history.top(2))
+    history.append(np.array([0.0, 0.0], dtype=np.float32))
+    self.assertAllClose([0.25, 0.4], history.ranking)
+    # The ranking outlives the history window.
+    self.assertAllClose([[0.0, 0.8], [0.0, 0.0]], history.window())
+
+
+if __name__ == '__main__':
+  tf.test.main()
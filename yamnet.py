@@ -15,12 +15,11 @@
 
 """Core model definition of YAMNet."""
 
-import csv
-
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras import Model, layers
 
+from class_map import class_names  # Also available from here.
 import features as features_lib
 import params
 
@@ -35,40 +34,43 @@ def _batch_norm(name):
   return _bn_layer
 
 
-def _conv(name, kernel, stride, filters):
+def _conv(name, kernel, stride, filters, fused=False):
   def _conv_layer(layer_input):
     output = layers.Conv2D(name='{}/conv'.format(name),
                            filters=filters,
                            kernel_size=kernel,
                            strides=stride,
                            padding=params.CONV_PADDING,
-                           use_bias=False,
+                           use_bias=fused,
                            activation=None)(layer_input)
-    output = _batch_norm(name='{}/conv/bn'.format(name))(output)
+    if not fused:
+      output = _batch_norm(name='{}/conv/bn'.format(name))(output)
     output = layers.ReLU(name='{}/relu'.format(name))(output)
     return output
   return _conv_layer
 
 
-def _separable_conv(name, kernel, stride, filters):
+def _separable_conv(name, kernel, stride, filters, fused=False):
   def _separable_conv_layer(layer_input):
     output = layers.DepthwiseConv2D(name='{}/depthwise_conv'.format(name),
                                     kernel_size=kernel,
                                     strides=stride,
                                     depth_multiplier=1,
                                     padding=params.CONV_PADDING,
-                                    use_bias=False,
+                                    use_bias=fused,
                                     activation=None)(layer_input)
-    output = _batch_norm(name='{}/depthwise_conv/bn'.format(name))(output)
+    if not fused:
+      output = _batch_norm(name='{}/depthwise_conv/bn'.format(name))(output)
     output = layers.ReLU(name='{}/depthwise_conv/relu'.format(name))(output)
     output = layers.Conv2D(name='{}/pointwise_conv'.format(name),
                            filters=filters,
                            kernel_size=(1, 1),
                            strides=1,
                            padding=params.CONV_PADDING,
-                           use_bias=False,
+                           use_bias=fused,
                            activation=None)(output)
-    output = _batch_norm(name='{}/pointwise_conv/bn'.format(name))(output)
+    if not fused:
+      output = _batch_norm(name='{}/pointwise_conv/bn'.format(name))(output)
     output = layers.ReLU(name='{}/pointwise_conv/relu'.format(name))(output)
     return output
   return _separable_conv_layer
@@ -93,48 +95,147 @@ _YAMNET_LAYER_DEFS = [
 ]
 
 
-def yamnet(features):
-  """Define the core YAMNet mode in Keras."""
+def yamnet(features, include_top=True, fused=False):
+  """Define the core YAMNet mode in Keras.
+
+  Returns the (predictions, embeddings) tensors. With include_top=False the
+  Dense/sigmoid classifier head is not built and predictions is None. With
+  fused=True the convolutions carry a bias and there are no batch norm
+  layers; such a model is filled from a trained one with fold_batch_norm().
+  """
   net = layers.Reshape(
     (params.PATCH_FRAMES, params.PATCH_BANDS, 1),
     input_shape=(params.PATCH_FRAMES, params.PATCH_BANDS))(features)
   for (i, (layer_fun, kernel, stride, filters)) in enumerate(_YAMNET_LAYER_DEFS):
-    net = layer_fun('layer{}'.format(i + 1), kernel, stride, filters)(net)
-  net = layers.GlobalAveragePooling2D()(net)
-  logits = layers.Dense(units=params.NUM_CLASSES, use_bias=True)(net)
+    net = layer_fun('layer{}'.format(i + 1), kernel, stride, filters,
+                    fused=fused)(net)
+  embeddings = layers.GlobalAveragePooling2D(
+    name=params.EMBEDDINGS_LAYER_NAME)(net)
+  if not include_top:
+    return None, embeddings
+  logits = layers.Dense(units=params.NUM_CLASSES, use_bias=True)(embeddings)
   predictions = layers.Activation(
     name=params.EXAMPLE_PREDICTIONS_LAYER_NAME,
     activation=params.CLASSIFIER_ACTIVATION)(logits)
-  return predictions
+  return predictions, embeddings
 
 
-def yamnet_frames_model(feature_params):
+def yamnet_frames_model(feature_params, include_embeddings=False,
+                        intermediate_layer=None, embeddings_only=False):
   """Defines the YAMNet waveform-to-class-scores model.
 
   Args:
     feature_params: An object with parameter fields to control the feature
     calculation.
+    include_embeddings: Also emit the per-patch embeddings.
+    intermediate_layer: Optional name of a trunk layer (e.g.
+    'layer14/pointwise_conv/relu') whose per-patch output is also emitted.
+    embeddings_only: Skip the classifier head and emit embeddings instead
+    of class scores. Such a model lacks the Dense layer, so load weights
+    into it with load_weights(..., by_name=True).
 
   Returns:
     A model accepting (1, num_samples) waveform input and emitting a
     (num_patches, num_classes) matrix of class scores per time frame as
     well as a (num_spectrogram_frames, num_mel_bins) spectrogram feature
-    matrix.
+    matrix. The optional outputs are inserted in between, in the order
+    embeddings then intermediate layer, all computed in the same forward
+    pass. With embeddings_only, the outputs are [embeddings,
+    (intermediate layer,) spectrogram].
   """
   waveform = layers.Input(batch_shape=(1, None))
   # Store the intermediate spectrogram features to use in visualization.
   spectrogram = features_lib.waveform_to_log_mel_spectrogram(
     tf.squeeze(waveform, axis=0), feature_params)
   patches = features_lib.spectrogram_to_patches(spectrogram, feature_params)
-  predictions = yamnet(patches)
+  predictions, embeddings = yamnet(patches, include_top=not embeddings_only)
+  outputs = [embeddings] if embeddings_only else [predictions]
+  if include_embeddings and not embeddings_only:
+    outputs.append(embeddings)
+  if intermediate_layer is not None:
+    trunk = Model(inputs=waveform, outputs=embeddings)
+    outputs.append(trunk.get_layer(intermediate_layer).output)
+  outputs.append(spectrogram)
   frames_model = Model(name='yamnet_frames', 
-                       inputs=waveform, outputs=[predictions, spectrogram])
+                       inputs=waveform, outputs=outputs)
   return frames_model
 
 
-def class_names(class_map_csv):
-  """Read the class name definition file and return a list of strings."""
-  with open(class_map_csv) as csv_file:
-    reader = csv.reader(csv_file)
-    next(reader)   # Skip header
-    return np.array([display_name for (_, _, display_name) in reader])
+def yamnet_features_model(feature_params):
+  """Defines the YAMNet waveform-to-patches feature model.
+
+  Args:
+    feature_params: An object with parameter fields to control the feature
+    calculation.
+
+  Returns:
+    A model accepting (1, num_samples) waveform input and emitting a
+    (num_patches, num_frames, num_bands) stack of log mel spectrogram
+    patches ready to be fed to yamnet_patches_model().
+  """
+  waveform = layers.Input(batch_shape=(1, None))
+  spectrogram = features_lib.waveform_to_log_mel_spectrogram(
+    tf.squeeze(waveform, axis=0), feature_params)
+  patches = features_lib.spectrogram_to_patches(spectrogram, feature_params)
+  features_model = Model(name='yamnet_features',
+                         inputs=waveform, outputs=patches)
+  return features_model
+
+
+def yamnet_patches_model(fused=False):
+  """Defines the YAMNet patches-to-class-scores model.
+
+  Unlike yamnet_frames_model(), the batch dimension is free, so patches
+  from any number of clips can be stacked and scored in a single pass
+  through the Mobilenet trunk. The layers (and hence the weights file)
+  are the same as for yamnet_frames_model().
+
+  Args:
+    fused: Build the inference graph with batch norm folded into the
+    convolutions. Its weights have to be set with fold_batch_norm().
+
+  Returns:
+    A model accepting (num_patches, num_frames, num_bands) patch input and
+    emitting a (num_patches, num_classes) matrix of class scores as well as
+    a (num_patches, embedding_size) matrix of embeddings.
+  """
+  patches = layers.Input(shape=(params.PATCH_FRAMES, params.PATCH_BANDS))
+  predictions, embeddings = yamnet(patches, fused=fused)
+  patches_model = Model(name='yamnet_patches',
+                        inputs=patches, outputs=[predictions, embeddings])
+  return patches_model
+
+
+def fold_batch_norm(model, fused_model):
+  """Copy the weights of a YAMNet model into its batch-norm-folded twin.
+
+  Each inference-time batch norm computes (x - mean) / sqrt(variance + eps)
+  + beta, which is an affine map per output channel. It is folded into the
+  preceding convolution by scaling the kernel and adding a bias, so the
+  fused model computes the same scores without the extra elementwise pass
+  over every activation tensor.
+
+  Args:
+    model: A model built with fused=False and with its weights loaded.
+    fused_model: The same model built with fused=True.
+  """
+  # Layers other than convolutions (i.e. the classifier head) are copied
+  # as they are, pairing them up in order since they are not named.
+  other_weights = [layer.get_weights() for layer in model.layers
+                   if layer.weights and not isinstance(
+                     layer, (layers.Conv2D, layers.DepthwiseConv2D,
+                             layers.BatchNormalization))]
+  for layer in fused_model.layers:
+    if isinstance(layer, (layers.Conv2D, layers.DepthwiseConv2D)):
+      kernel, = model.get_layer(layer.name).get_weights()
+      beta, mean, variance = model.get_layer(
+        '{}/bn'.format(layer.name)).get_weights()
+      scale = 1.0 / np.sqrt(variance + params.BATCHNORM_EPSILON)
+      if isinstance(layer, layers.DepthwiseConv2D):
+        # Depthwise kernels are [rows, cols, channels, depth_multiplier].
+        kernel = kernel * scale[np.newaxis, np.newaxis, :, np.newaxis]
+      else:
+        kernel = kernel * scale
+      layer.set_weights([kernel, beta - mean * scale])
+    elif layer.weights:
+      layer.set_weights(other_weights.pop(0))
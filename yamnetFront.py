@@ -17,13 +17,15 @@ import tkinter as tk
 
 #Import numpy for miscellanious number/data crunching
 import numpy as np
+import metrics
 from recorder import Recorder
+from score_history import ScoreHistory
+from inference_worker import InferenceWorker
+from gate import SilenceGate
+import score_archive
 
 
-import soundfile as sf
-import params
-import yamnet as yamnet_model
-import resampy
+import inference
 
 
 
@@ -35,19 +37,55 @@ to combine example codes, I've strayed from the best practice
 """
 class tkyamnet(tk.Tk):
     
-    def __init__(self, *args, **kwargs):
-        
-        #Constructor, builds the tkinter app and used frames
+    def __init__(self, *args, history_length=30, top_k=10, refresh_ms=1000,
+                 blit=True, inference_period=1.0, archive=None, **kwargs):
+        
+        #Constructor, builds the tkinter app and used frames.
+        #history_length is the number of results of scores kept and plotted,
+        #top_k the number of classes shown and refresh_ms the GUI tick
+        #interval. blit selects incremental rendering over a cached
+        #background instead of redrawing the whole figure every tick.
+        #inference_period is the interval in seconds between classifications
+        #of the latest second of audio, done on a background thread.
+        #archive optionally names a score_archive directory that every
+        #classification is appended to
         
         #Run the base class init        
         tk.Tk.__init__(self, *args, **kwargs)
         
-        """TODO Initialize Yamnet"""
-        self.yamnet = yamnet_model.yamnet_frames_model(params)
-        self.yamnet.load_weights('yamnet.h5')
+        self.history_length = history_length
+        self.top_k = top_k
+        self.refresh_ms = refresh_ms
+        self.blit = blit
+        
+        #Yamnet, with batch norm folded into the convolutions, is built on
+        #the inference thread at the first classification, so that the
+        #window opens without waiting for TensorFlow and the model.
+        #The gate skips the model on silence and on unchanged background
+        self.gate = SilenceGate()
+        self.yamnet = None
         
         #Prepare the visualization graph. Tight layout for fitting better
-        self.figure, self.axs = plt.subplots(10, figsize=(10,10))
+        self.figure, self.axs = plt.subplots(self.top_k, figsize=(10,10), squeeze=False)
+        self.axs = self.axs[:, 0]
+        
+        #Create the line artists once, the animation only updates their data
+        #and colors. With blitting they are animated artists, left out of
+        #full redraws and drawn over the cached background instead
+        #One history entry is added per tick that has a new classification,
+        #so entries are refresh_ms apart, or inference_period when slower.
+        #The x axis is in seconds before now
+        step = max(self.refresh_ms / 1000, inference_period)
+        self.xList = step * np.linspace(-self.history_length, -1, self.history_length)
+        self.lines = []
+        for a in self.axs:
+            line, = a.plot(self.xList, np.zeros(self.history_length), animated=self.blit)
+            #Set constant axis so that confidence close to 1 is plotted fully
+            a.set_ylim((0, 1.1))
+            self.lines.append(line)
+        self.axs[-1].set_xlabel('seconds')
+        #Class index currently shown by each line, to update only on changes
+        self.plotted = [None] * self.top_k
         plt.tight_layout()
         
         
@@ -85,20 +123,41 @@ class tkyamnet(tk.Tk):
         #Bring StartPage on top for user
         self.show_frame(GraphPage)
         
-        #Declare class variables used in animation   
-        self.xList = np.linspace(-30, -1, 30)
+        #Capture the background whenever the canvas is fully redrawn (at
+        #start and on resize), then draw it once
+        self.canvas = self.frames[GraphPage].canvas
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        self.canvas.draw()
+        
+        #Prepare the yamnet-format results and the IIR-filtered weights used
+        #to rank them, in a preallocated circular buffer
+        self.history = ScoreHistory(length=self.history_length, decay=0.9)
         
-        #Prepare the yamnet-format results, 521 classes for 30 seconds
-        self.data = np.zeros((521,30))
-        #Prepare the weights used to rank classification results
-        self.scores = np.zeros(521)
+        #Optional on-disk record of the scores, one frame per classification
+        self.archive = None
+        if archive is not None:
+            self.archive = score_archive.ArchiveWriter(
+                archive, hop_seconds=inference_period)
+        #Reused buffers for the plotted class histories, one per line
+        self.series = np.zeros((self.top_k, self.history_length), dtype=np.float32)
         
-        #Start audio recording
+        #Start audio recording into an in-memory ring buffer. The stream is
+        #kept open, so capture is gapless and nothing touches the disk
         self.rec = Recorder(channels=1)
-        self.recfile = self.rec.open('sample.wav','wb')
-        self.recfile.start_recording()
-        #After a second, start animating 
-        self.after(1000, self.animate)
+        self.recstream = self.rec.stream(seconds=10.0)
+        self.recstream.start_recording()
+        
+        #Classify the latest second on a background thread. The GUI only
+        #picks up the newest result, stale windows are dropped
+        self.worker = InferenceWorker(lambda: self.recstream.latest(self.rec.rate),
+                                      self.classification, period=inference_period)
+        #Number of worker errors already shown in the status label
+        self.shown_errors = 0
+        self.worker.start()
+        
+        #After a tick, start animating 
+        self.after(self.refresh_ms, self.animate)
         
     def show_frame(self, cont):
         
@@ -111,126 +170,112 @@ class tkyamnet(tk.Tk):
         
         #Closes the Tkinter and any pending events
         
+        #Don't wait for a model load or a slow classification to finish,
+        #the worker is a daemon thread
+        self.worker.stop(timeout=2 * self.worker.period)
         self.quit()
         self.destroy()
-        self.recfile.close()
+        self.recstream.close()
+        if self.archive is not None:
+            self.archive.close()
         
     def animate(self):
         
-        time_of_start = time.time()
-        #Runs Yamnet visualization, queued as an event every ~second
-        
-        self.recfile.stop_recording()
-        self.recfile.close()
-        
-        #Reading sample.wav file which is a mono signal (used in Yamnet by default) into desired format
-        wav_data, sr = sf.read('sample.wav', dtype=np.int16)
-        
-        self.recfile = self.rec.open('sample.wav','wb')
-        self.recfile.start_recording()
+        #Runs Yamnet visualization, queued as an event every tick
+        
+        #Queue another iteration a tick from now
+        self.after(self.refresh_ms, self.animate)
+        
+        #Newest classification from the worker, if there is a new one.
+        #Read the queue depth first, latest() empties the queue
+        depth = self.worker.peak_queue_depth()
+        result = self.worker.latest()
+        if result is None:
+            #Show a failed classification until the next one succeeds
+            if self.worker.errors != self.shown_errors:
+                self.shown_errors = self.worker.errors
+                self.frames[GraphPage].statuslabel['text'] = (
+                    "inference failed ({} errors): {!r}".format(
+                        self.worker.errors, self.worker.last_error))
+            return
+        new_samples = result.value
+        
+        #Store the new samples in place of the oldest ones. The ranking is
+        #decided by IIR-filtered samples, updated in the same call
+        with metrics.timer('ranking'):
+            self.history.append(new_samples)
+            
+            #Find the indexes of top scores
+            indexes = self.history.top(self.top_k)
         
-        #Queue another iteration a second from now
-        self.after(1000, self.animate)
+        #Record the scores with the time their audio was captured
+        if self.archive is not None:
+            self.archive.append(new_samples[np.newaxis], times=[result.captured])
         
+        with metrics.timer('render'):
+            self.render(indexes)
         
-        new_samples = self.classification(wav_data)
+        #Time from capturing the window to showing its scores
+        metrics.observe('latency', time.time() - result.captured)
         
-        #The ranking is decided by IIR-filtered samples
-        self.scores = self.scores * 0.9 + new_samples
+        #Show how far behind the audio the display is, and the worker's state
+        self.frames[GraphPage].statuslabel['text'] = (
+            "latency {:.0f} ms (inference {:.0f} ms), queue {}, dropped {}, "
+            "errors {}, gated {:.0%}".format(
+                1000 * (time.time() - result.captured),
+                1000 * (result.finished - result.captured),
+                depth, self.worker.dropped_windows, self.worker.errors,
+                self.gate.stats()['skip_rate']))
         
-        #Expand new sample dimensions for concatenation
-        new_samples = np.expand_dims(new_samples, axis=1)
+    def render(self, indexes):
         
-        #Concatenate the new samples to right, remove leftmost column
-        self.data = np.concatenate((self.data, new_samples), axis=1)
-        self.data = np.delete(self.data, 0, 1)
+        #Shows the histories of the classes in indexes, one per line
         
-        #Find the indexes of top 10 scores
-        indexes = self.findtopX(self.scores, 10)
-           
-        #Plot each subplot with corresponding class data
-        for i in range(10):
+        #Update each line with corresponding class data
+        for i in range(self.top_k):
             
-            #Select subplot
-            a = self.axs[i]
-            
-            #Remove old plot
-            a.clear()
-            
-            #Plot class scores of last 30 seconds
-            a.plot(self.xList, self.data[indexes[i], :], 'xkcd:'+self.colors[indexes[i]])
-            #Set constant axis so that confidence close to 1 is plotted fully
-            a.set_ylim((0, 1.1))
+            index = indexes[i]
             
+            #Class scores of the history, written into the line's own buffer
+            self.lines[i].set_ydata(self.history.series(index, out=self.series[i]))
             
-            #Set the label next to subplot as class name
-            self.frames[GraphPage].labels[i]['text'] = self.classes[indexes[i]]
-             
+            #Only restyle the line and relabel it when its class changes
+            if index != self.plotted[i]:
+                self.lines[i].set_color('xkcd:'+self.colors[index])
+                #Set the label next to subplot as class name
+                self.frames[GraphPage].labels[i]['text'] = self.classes[index]
+                self.plotted[i] = index
         
-        #Draw canvas to show updated graph
-        self.frames[GraphPage].canvas.draw()
+        if self.blit:
+            #Redraw only the lines over the cached background
+            self.canvas.restore_region(self.background)
+            self.draw_lines()
+            self.canvas.blit(self.figure.bbox)
+        else:
+            #Draw canvas to show updated graph
+            self.canvas.draw_idle()
         
-        # print(time.time() - time_of_start)
         
+    def on_draw(self, event):
         
-    def findtopX(self, values, X):
+        #Full redraw happened, cache the new background under the lines
         
-        #Find the indexes of largest X values from an 1D iterable list
+        if self.blit:
+            self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+            self.draw_lines()
         
-        #Variables that keep track of the topX values and indexes
-        topX = [0] * X
-        indexes = [0] * X
+    def draw_lines(self):
         
-        #Iterate trough the whole list
-        for index in range(len(values)):
-            """
-            Value is compared to the lowest uncompared value each iteration.
-            If candidate value is bigger, swap the ranking of comparables
-            and then compare to the next lowest value.
-            If candidate is smaller, move to next candidate.
-            """
-            
-            if values[index] > topX[X-1]:
-                topX[X-1] = values[index]
-                indexes[X-1] = index
-            else:
-                #Skip to next value
-                continue
-            
-            for i in range(X-2, -1, -1):       
-                
-                if values[index] > topX[i]:
-                    
-                    topX[i+1] = topX[i]
-                    indexes[i+1] = indexes[i]
-                    
-                    topX[i] = values[index]
-                    indexes[i] = index
-                else:
-                    #Skip to next value
-                    break
-        
-        return indexes
+        #Draws the animated line artists on top of the canvas
+        
+        for line in self.lines:
+            line.axes.draw_artist(line)
     
     def classification(self,wav_data):
-        waveform = wav_data / 32768.0  # Convert to [-1.0, +1.0]
-        sr = 44100
-        
-        # Convert to mono and the sample rate expected by YAMNet.
-        if len(waveform.shape) > 1:
-            waveform = np.mean(waveform, axis=1)
-        if sr != params.SAMPLE_RATE:
-            waveform = resampy.resample(waveform, sr, params.SAMPLE_RATE)
-        # Predict YAMNet classes.
-        # Second output is log-mel-spectrogram array (used for visualizations).
-        # (steps=1 is a work around for Keras batching limitations.)
-        scores, _ = self.yamnet.predict(np.reshape(waveform, [1, -1]), steps=1)
-        # Scores is a matrix of (time_frames, num_classes) classifier scores.
-        # Average them along time to get an overall classifier output for the clip.
-        prediction = np.mean(scores, axis=0)
-        # Report the highest-scoring classes and their scores.
-        #sound_events = np.argsort(prediction)[::-1]
-        return prediction
+        #Clip-mean scores of the 44.1 kHz int16 recording
+        if self.yamnet is None:
+            self.yamnet = inference.create_classifier(gate=self.gate)
+        return self.yamnet.classification(wav_data, sr=self.rec.rate)
             
                  
 '''
@@ -265,7 +310,7 @@ class GraphPage(tk.Frame):
         self.labels = []
         
         #Configure grid layout
-        for i in range(11):
+        for i in range(controller.top_k + 1):
             self.rowconfigure(i, weight = 1)
             
         for i in range(7):
@@ -275,7 +320,11 @@ class GraphPage(tk.Frame):
         self.titlelabel = tk.Label(self, text="Yamnet audio classification", font=("Verdana", 12))
         self.titlelabel.grid(row = 0, column = 0, columnspan=3, sticky = 'nsew')
         
-        self.scorelabel = tk.Label(self, text="Top 10 scores from Yamnet", font=("Verdana", 12))
+        #Tick latency, result queue depth and dropped windows
+        self.statuslabel = tk.Label(self, text="loading model", font=("Verdana", 9))
+        self.statuslabel.grid(row = 0, column = 3, columnspan=2, sticky = 'nsew')
+        
+        self.scorelabel = tk.Label(self, text="Top {} scores from Yamnet".format(controller.top_k), font=("Verdana", 12))
         self.scorelabel.grid(row = 0, column = 5, columnspan=2, sticky = 'nsew')
 
         """
@@ -286,49 +335,13 @@ class GraphPage(tk.Frame):
         #Create canvas for displaying the figure
         self.canvas = FigureCanvasTkAgg(controller.figure, self)
         self.canvas.draw()
-        self.canvas.get_tk_widget().grid(row=1, column=0, rowspan=10, columnspan=5, sticky = "nsew")
-        
-        #Labels for class names. These could've been procedurally generated, but meh
-        
-        label1 = tk.Label(self, text = "Number 1", font= ("Verdana", 12))
-        label1.grid(row = 1, column = 5, columnspan=2, sticky = "nsew")
-        self.labels.append(label1)
-        
-        label2 = tk.Label(self, text = "Number 2", font= ("Verdana", 12))
-        label2.grid(row = 2, column = 5, columnspan=2, sticky = "nsew")
-        self.labels.append(label2)
-        
-        label3 = tk.Label(self, text = "Number 3", font= ("Verdana", 12))
-        label3.grid(row = 3, column = 5, columnspan=2, sticky = "nsew")
-        self.labels.append(label3)
+        self.canvas.get_tk_widget().grid(row=1, column=0, rowspan=controller.top_k, columnspan=5, sticky = "nsew")
         
-        label4 = tk.Label(self, text = "Number 4", font= ("Verdana", 12))
-        label4.grid(row = 4, column = 5, columnspan=2, sticky = "nsew")
-        self.labels.append(label4)
-        
-        label5 = tk.Label(self, text = "Number 5", font= ("Verdana", 12))
-        label5.grid(row = 5, column = 5, columnspan=2, sticky = "nsew")       
-        self.labels.append(label5)
-        
-        label6 = tk.Label(self, text = "Number 6", font= ("Verdana", 12))
-        label6.grid(row = 6, column = 5, columnspan=2, sticky = "nsew")       
-        self.labels.append(label6)
-        
-        label7 = tk.Label(self, text = "Number 7", font= ("Verdana", 12))
-        label7.grid(row = 7, column = 5, columnspan=2, sticky = "nsew")       
-        self.labels.append(label7)
-        
-        label8 = tk.Label(self, text = "Number 8", font= ("Verdana", 12))
-        label8.grid(row = 8, column = 5, columnspan=2, sticky = "nsew")       
-        self.labels.append(label8)
-        
-        label9 = tk.Label(self, text = "Number 9", font= ("Verdana", 12))
-        label9.grid(row = 9, column = 5, columnspan=2, sticky = "nsew")       
-        self.labels.append(label9)
-        
-        label10 = tk.Label(self, text = "Number 10", font= ("Verdana", 12))
-        label10.grid(row = 10, column = 5, columnspan=2, sticky = "nsew")       
-        self.labels.append(label10)
+        #Labels for class names, one per plotted class
+        for i in range(controller.top_k):
+            label = tk.Label(self, text = "Number {}".format(i + 1), font= ("Verdana", 12))
+            label.grid(row = i + 1, column = 5, columnspan=2, sticky = "nsew")
+            self.labels.append(label)
         
 
 if __name__ == "__main__":   
@@ -340,6 +353,11 @@ if __name__ == "__main__":
     #Do not visualize figures via IPython, only via Tkinter
     plt.ioff()
     
+    #With YAMNET_METRICS=1, serve the stage timings in the Prometheus
+    #format on http://127.0.0.1:9464/metrics
+    if metrics.enabled:
+        metrics.serve()
+    
     #Construct TKinter app                
     app = tkyamnet()
 
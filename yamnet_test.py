@@ -15,10 +15,16 @@
 
 """Installation test for YAMNet."""
 
+import os
+
 import numpy as np
+import soundfile as sf
 import tensorflow as tf
 
+import gate
+import inference
 import params
+import quantize
 import yamnet
 
 class YAMNetTest(tf.test.TestCase):
@@ -65,6 +71,140 @@ class YAMNetTest(tf.test.TestCase):
             [1, -1]),
         expected_class_name='Sine wave')
 
+  def testEmbeddings(self):
+    waveform = np.zeros((1, int(3 * params.SAMPLE_RATE)))
+    with YAMNetTest._yamnet_graph.as_default():
+      model = yamnet.yamnet_frames_model(params, include_embeddings=True)
+      model.load_weights('yamnet.h5')
+      scores, embeddings, _ = model.predict(waveform, steps=1)
+      self.assertAllClose(
+          YAMNetTest._yamnet.predict(waveform, steps=1)[0], scores)
+      self.assertEqual((len(scores), 1024), embeddings.shape)
+
+  def testEmbeddingsOnly(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    waveform = np.random.uniform(-1.0, +1.0, (1, int(3 * params.SAMPLE_RATE)))
+    with YAMNetTest._yamnet_graph.as_default():
+      model = yamnet.yamnet_frames_model(params, include_embeddings=True)
+      model.load_weights('yamnet.h5')
+      _, embeddings, spectrogram = model.predict(waveform, steps=1)
+      embeddings_model = yamnet.yamnet_frames_model(params,
+                                                    embeddings_only=True)
+      embeddings_model.load_weights('yamnet.h5', by_name=True)
+      self.assertEmpty([layer for layer in embeddings_model.layers
+                        if layer.name == params.EXAMPLE_PREDICTIONS_LAYER_NAME])
+      only_embeddings, only_spectrogram = embeddings_model.predict(
+          waveform, steps=1)
+      self.assertEqual((len(embeddings), 1024), only_embeddings.shape)
+      self.assertAllClose(embeddings, only_embeddings, atol=1e-5)
+      self.assertAllClose(spectrogram, only_spectrogram)
+
+  def testIntermediateLayer(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    waveform = np.random.uniform(-1.0, +1.0, (1, int(3 * params.SAMPLE_RATE)))
+    with YAMNetTest._yamnet_graph.as_default():
+      model = yamnet.yamnet_frames_model(
+          params, include_embeddings=True,
+          intermediate_layer='layer14/pointwise_conv/relu')
+      model.load_weights('yamnet.h5')
+      scores, embeddings, activations, _ = model.predict(waveform, steps=1)
+      self.assertEqual((len(scores), 3, 2, 1024), activations.shape)
+      # The embedding is the average of the last trunk layer.
+      self.assertAllClose(embeddings, activations.mean(axis=(1, 2)),
+                          atol=1e-5)
+      self.assertAllClose(
+          YAMNetTest._yamnet.predict(waveform, steps=1)[0], scores, atol=1e-5)
+
+  def testFused(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    patches = np.random.uniform(
+        -5.0, 0.0, (8, params.PATCH_FRAMES, params.PATCH_BANDS))
+    with YAMNetTest._yamnet_graph.as_default():
+      model = yamnet.yamnet_patches_model()
+      model.load_weights('yamnet.h5')
+      fused_model = yamnet.yamnet_patches_model(fused=True)
+      yamnet.fold_batch_norm(model, fused_model)
+      self.assertEmpty([layer for layer in fused_model.layers
+                        if 'bn' in layer.name])
+      for expected, actual in zip(model.predict_on_batch(patches),
+                                  fused_model.predict_on_batch(patches)):
+        self.assertAllClose(expected, actual, atol=1e-4)
+
+  def testBatch(self):
+    # The classifier folds the batch norms, so compare at the tolerance of
+    # testFused.
+    np.random.seed(51773)  # Ensure repeatability.
+    waveforms = [np.random.uniform(-1.0, +1.0, int(seconds * params.SAMPLE_RATE))
+                 for seconds in (1, 3, 2.5)]
+    with YAMNetTest._yamnet_graph.as_default():
+      batch_scores = inference.YamnetClassifier().classify_batch(waveforms)
+      self.assertEqual(len(waveforms), len(batch_scores))
+      for waveform, scores in zip(waveforms, batch_scores):
+        self.assertAllClose(
+            YAMNetTest._yamnet.predict(
+                np.reshape(waveform, [1, -1]), steps=1)[0],
+            scores, atol=1e-4)
+
+  def testBatchBypassesGate(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    noise = np.random.uniform(-1.0, +1.0, params.SAMPLE_RATE)
+    waveforms = [np.zeros(2 * params.SAMPLE_RATE), noise, noise]
+    silence_gate = gate.SilenceGate()
+    gated = inference.YamnetClassifier(gate=silence_gate)
+    for expected, actual in zip(
+        inference.YamnetClassifier().classify_batch(waveforms),
+        gated.classify_batch(waveforms)):
+      self.assertAllClose(expected, actual, atol=1e-6)
+    # The unrelated clips neither went through the gate nor changed it.
+    self.assertEqual(0, silence_gate.stats()['patches'])
+    self.assertIsNone(silence_gate._reference)
+
+  def testClassifyFile(self):
+    np.random.seed(51773)  # Ensure repeatability.
+    waveform = np.random.uniform(-1.0, +1.0, (int(7.3 * 44100), 2))
+    path = os.path.join(self.get_temp_dir(), 'stereo.wav')
+    sf.write(path, waveform, 44100)
+    waveform, sr = sf.read(path)
+    classifier = inference.YamnetClassifier()
+    scores = list(classifier.classify_file(path, block_seconds=0.7,
+                                           batch_patches=4))
+    self.assertEqual([4, 4, 4, 2], [len(batch) for batch in scores])
+    self.assertAllClose(
+        classifier.classify_waveform(classifier.preprocess(waveform, sr)),
+        np.concatenate(scores), atol=1e-4)
+
+  def testSavedModel(self):
+    path = os.path.join(self.get_temp_dir(), 'yamnet_saved_model')
+    inference.export_saved_model(path)
+    np.random.seed(51773)  # Ensure repeatability.
+    waveform = np.random.uniform(-1.0, +1.0, 3 * params.SAMPLE_RATE)
+    # Both kinds of model take the same arguments.
+    saved_model = inference.create_classifier(path, fused=False)
+    self.assertIsInstance(saved_model, inference.SavedModelYamnetClassifier)
+    self.assertAllClose(
+        inference.YamnetClassifier().classify_waveform(waveform),
+        saved_model.classify_waveform(waveform), atol=1e-4)
+
+  def testQuantized(self):
+    path = os.path.join(self.get_temp_dir(), 'yamnet_int8.tflite')
+    with open(path, 'wb') as model_file:
+      model_file.write(quantize.convert(mode='int8'))
+    with YAMNetTest._yamnet_graph.as_default():
+      report = quantize.compare(
+          inference.YamnetClassifier(),
+          quantize.QuantizedYamnetClassifier(path, mode='int8'),
+          quantize.evaluation_waveforms())
+      self.assertEqual(1.0, report['top1_agreement'])
+      self.assertLess(report['max_abs_error'], 0.1)
+      # It takes the gate and the other arguments of YamnetClassifier.
+      silence_gate = gate.SilenceGate()
+      gated = quantize.QuantizedYamnetClassifier(
+          path, mode='int8', fused=False, gate=silence_gate)
+      gated.classify_waveform(np.zeros(2 * params.SAMPLE_RATE))
+      self.assertEqual(silence_gate.stats()['patches'],
+                       silence_gate.stats()['quiet'])
+      self.assertGreater(silence_gate.stats()['quiet'], 0)
+
 
 if __name__ == '__main__':
   tf.test.main()